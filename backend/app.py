@@ -1,26 +1,270 @@
-from flask import Flask, jsonify, request, render_template, send_file
+from flask import Flask, Response, g, jsonify, make_response, request, render_template, send_file, stream_with_context
+from functools import wraps
 from io import BytesIO
-from tools.doc import edit_word_tables
-from db.database import Database
+from tools.doc import DIAGNOSTICS_LEVELS, edit_word_tables, inspect_template, load_template
+from tools.roster_import import import_roster_csv
+from tools.user_batch import parse_operations
+from tools import fast_json
+from tools.compression import ResponseCompressor
+from tools.jobs import JobFailed, JobQueue, QueueFull
+from tools.render_cache import RenderCache
+from tools.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, SQL_BUCKETS, Registry
+from tools.counseling import RenderPool, counseling_fields, document_name, stream_zip
+from db.database import BatchAborted, Database
+from db.cursors import CursorLimit, CursorRegistry, SharedCursorRegistry
+from db.executor import QueryExecutor
+from db.query import ROSTER_COLUMNS, RosterQuery
+from db.state import SharedState
+from dotenv import load_dotenv
 import sqlite3
 import json
+import os
+import time
+
+load_dotenv(".env")  # Loads the .env file
 
 app = Flask(__name__)
-db = Database()
+# Prometheus histograms served at /metrics. They are per process, so with
+# serve.py's gunicorn workers each scrape sees the worker that answered it.
+metrics = Registry()
+REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "Time to produce a response, by route", ("method", "route", "status"))
+SQL_SECONDS = metrics.histogram(
+    "db_statement_duration_seconds", "SQL statement time including fetching, by normalized statement",
+    ("statement",), SQL_BUCKETS)
+RENDER_SECONDS = metrics.histogram(
+    "counseling_render_phase_seconds", "Counseling document render time, by phase", ("phase",))
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+# Registered before the compressor so its after_request runs last and counts compression too
+@app.after_request
+def record_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                method=request.method, route=route, status=response.status_code)
+    return response
+
+def record_render(response):
+    """Add the phase timings of one counseling render to RENDER_SECONDS."""
+    for phase, seconds in response.get('timings', {}).items():
+        RENDER_SECONDS.observe(seconds, phase=phase)
+
+# orjson-backed jsonify() when installed, plus gzip/brotli for large responses
+app.json = fast_json.FastJSONProvider(app)
+compressor = ResponseCompressor(min_size=int(os.getenv("COMPRESS_MIN_SIZE", "1024")))
+compressor.init_app(app)
+# DB_ENGINE=wal enables WAL journaling with a single serialized writer thread
+# ROSTER_REPLICA=1 answers roster reads from an in-memory copy of the roster table
+# SLOW_QUERY_MS logs statements slower than that (0 turns the log off)
+# DB_PATH points the app at another database file (bench.py uses it)
+db = Database(os.getenv("DB_PATH", "database.db"), engine=os.getenv("DB_ENGINE", "default"),
+              replica=os.getenv("ROSTER_REPLICA", "0").lower() in ("1", "true", "on"),
+              slow_query_ms=float(os.getenv("SLOW_QUERY_MS", "250")))
+db.timer.hooks.append(lambda statement, seconds: SQL_SECONDS.observe(seconds, statement=statement))
+metrics.gauge("db_pool_connections", "Pooled SQLite connections by state",
+              lambda: [((state,), db.pool.stats()[state]) for state in ("in_use", "idle")], ("state",))
+metrics.gauge("db_pool_wait_seconds_total", "Time spent waiting for a pooled connection",
+              lambda: db.pool.stats()["wait_time"], kind="counter")
+db.bootstrap()
+# Counseling fills look up MOS descriptions constantly; keep the small mos table in memory
+db.connect()
+db.load_mos_cache()
+db.load_replica()
+db.close()
+
+COUNSELING_TEMPLATE = "./static/counseling.docx"
+# Parse the counseling template once up front instead of on the first request
+load_template(COUNSELING_TEMPLATE)
+# Worker processes for rendering, started as renders need them. RENDER_WORKERS caps them
+# per server process (default: the CPU count, so one batch can use every core).
+render_pool = RenderPool(COUNSELING_TEMPLATE, max_workers=int(os.getenv("RENDER_WORKERS", "0")) or None)
+MAX_BATCH_DOCUMENTS = 500
+# Rendered counselings by content address, so regenerating the same document is a lookup.
+# RENDER_CACHE_MB bounds the in-memory tier (0 turns the cache off); RENDER_CACHE_DIR adds
+# an on-disk tier shared by all workers, bounded by RENDER_CACHE_DISK_MB.
+RENDER_CACHE_MB = float(os.getenv("RENDER_CACHE_MB", "64"))
+render_cache = RenderCache(
+    max_bytes=int(RENDER_CACHE_MB * 1024 * 1024),
+    directory=os.getenv("RENDER_CACHE_DIR") or None,
+    disk_max_bytes=int(float(os.getenv("RENDER_CACHE_DISK_MB", "512")) * 1024 * 1024),
+) if RENDER_CACHE_MB > 0 else None
+# Server processes answering requests; serve.py sets it for its gunicorn workers
+SERVER_PROCESSES = int(os.getenv("SERVER_PROCESSES", "1"))
+# State every server process must see lives in STATE_DIR (default: "state" beside the database)
+STATE_DIR = os.getenv("STATE_DIR") or os.path.join(os.path.dirname(os.path.abspath(db.path)), "state")
+state = SharedState(os.path.join(STATE_DIR, "state.db"))
+# Background counseling renders (POST /jobs/counseling). Job threads only wait on the
+# render pool's processes, so queued renders don't hold request workers or the GIL.
+# Job state and results are kept in STATE_DIR, so any worker can answer for a job.
+# JOB_QUEUE_DEPTH jobs may wait before new ones are turned away with 503; finished
+# jobs keep their document for JOB_TTL seconds.
+job_queue = JobQueue(state, os.path.join(STATE_DIR, "jobs"),
+                     workers=int(os.getenv("JOB_WORKERS", "0")) or render_pool.max_workers,
+                     max_queued=int(os.getenv("JOB_QUEUE_DEPTH", "100")),
+                     ttl=float(os.getenv("JOB_TTL", "600")))
+MAX_JOB_WAIT = 30.0
+
+def job_counts():
+    stats = job_queue.stats()
+    return [((status,), stats[status]) for status in ("queued", "running", "retained")]
+
+metrics.gauge("jobs", "Background jobs by state", job_counts, ("state",))
+if render_cache:
+    metrics.gauge("render_cache_lookups_total", "Counseling render cache lookups by result",
+                  lambda: [(("hit",), render_cache.stats()["hits"]), (("miss",), render_cache.stats()["misses"])],
+                  ("result",), kind="counter")
+    metrics.gauge("render_cache_bytes", "Size of the documents in the in-memory render cache",
+                  lambda: render_cache.stats()["bytes"])
+# Limits for ad-hoc SQL on /query; requests may ask for less, never more
+query_executor = QueryExecutor(db, max_rows=10000, timeout=5.0)
+QUERY_MAX_ROWS = 100000
+QUERY_MAX_TIMEOUT = 30.0
+# Server-side cursors for paging through large /query results. In a single process
+# with WAL each cursor keeps its own snapshot, otherwise pages are re-run with
+# LIMIT/OFFSET; with several processes the cursors are kept in the shared state
+# so any worker can continue one.
+if SERVER_PROCESSES > 1:
+    query_cursors = SharedCursorRegistry(db, state)
+else:
+    query_cursors = CursorRegistry(db, snapshot=db.engine == 'wal')
+
+@app.teardown_request
+def release_connection(exc):
+    # Return any connection a route left checked out to the pool
+    db.release()
+
+def conditional(view):
+    """
+    Tag a read-only view's response with the database's data version as a weak ETag
+    and answer 304 Not Modified when the client already holds that version, without
+    running the view at all. The version is taken before the view reads, so a write
+    racing with the read only ever makes the tag look older, never newer.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = db.data_version()
+        if request.if_none_match.contains_weak(version):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(version, weak=True)
+        # Let browsers keep the body but revalidate on every use
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept')
+        return response
+    return wrapper
 
 @app.route("/")
 def home():
     # Return static/index.html
     return render_template("index.html")
 
+# Accept type for the columnar roster representation (same as ?format=columnar)
+COLUMNAR_MIMETYPE = 'application/vnd.roster.columnar+json'
+
+def roster_response(fetch_all, **fixed):
+    """
+    Serve roster rows in the shape the query string asks for:
+      (no params)            full list, as returned by fetch_all()
+      rank, bilmos, pmos,    combined filters and sort keys compiled by RosterQuery
+      dor_from, dor_to,      (e.g. ?rank=PFC,LCPL&dor_from=20240101&sort=-DOR)
+      billet, sort
+      after/limit/offset     one page: {"users": [...], "next": {"after": ...} | {"offset": ...} | null}
+      format=ndjson          one JSON object per line, streamed from the cursor
+                             (also chosen by Accept: application/x-ndjson)
+      format=columnar        {"columns": [...], "rows": [[...], ...]} with each row a list in
+                             column order, plus "next" when paged (also chosen by
+                             Accept: application/vnd.roster.columnar+json)
+      explain=1              the compiled SQL and its EXPLAIN QUERY PLAN instead of rows
+    `fixed` holds filters taken from the URL path.
+    """
+    try:
+        query = RosterQuery.from_args(request.args, **fixed)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    ndjson = request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+    if ndjson:
+        def generate():
+            db.connect()
+            try:
+                # Send lines in blocks so each chunk (and compressor flush) carries many rows
+                lines = []
+                for row in db.iter_roster(query):
+                    lines.append(fast_json.dumps(row))
+                    if len(lines) >= 500:
+                        yield b"\n".join(lines) + b"\n"
+                        lines = []
+                if lines:
+                    yield b"\n".join(lines) + b"\n"
+            finally:
+                db.close()
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    columnar = request.args.get('format') == 'columnar' or \
+        request.accept_mimetypes.best == COLUMNAR_MIMETYPE
+    if columnar and 'explain' not in request.args:
+        try:
+            db.connect()
+            if query.paged:
+                rows, next_page = db.get_roster_page(query, columnar=True)
+                result = {"columns": ROSTER_COLUMNS, "rows": rows, "next": next_page}
+            else:
+                result = {"columns": ROSTER_COLUMNS, "rows": db.roster_rows(query)}
+            db.close()
+            return fast_json.response(result)
+        except sqlite3.Error as e:
+            db.close()
+            return jsonify({"error": str(e)}), 500
+    try:
+        db.connect()
+        if 'explain' in request.args:
+            result = db.explain_roster(query)
+        elif not request.args:
+            result = fetch_all()
+        elif query.paged:
+            users, next_page = db.get_roster_page(query)
+            result = {"users": users, "next": next_page}
+        else:
+            result = db.query_roster(query)
+        db.close()
+        return jsonify(result)
+    except sqlite3.Error as e:
+        db.close()
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/users', methods=['GET'])
+@conditional
 def get_all_users():
-    db.connect()
-    users = db.get_all_roster()
-    db.close()
-    return jsonify(users)
+    return roster_response(db.get_all_roster)
+
+MAX_SEARCH_RESULTS = 100
+
+@app.route('/users/search', methods=['GET'])
+@conditional
+def search_users():
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"error": "Provide a search term with ?q="}), 400
+    limit = request.args.get('limit', 20, type=int)
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+    try:
+        db.connect()
+        users = db.search_roster(text, limit)
+        db.close()
+        return jsonify(users)
+    except sqlite3.Error as e:
+        db.close()
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/users/<edipi>', methods=['GET'])
+@conditional
 def get_user_by_edipi(edipi):
     db.connect()
     user = db.get_user_by_edipi(edipi)
@@ -51,6 +295,46 @@ def insert_user():
         db.close()
         return jsonify({"error": str(e)}), 400
 
+MAX_BATCH_OPERATIONS = 5000
+
+@app.route('/users/batch', methods=['POST'])
+def batch_users():
+    """
+    Apply many inserts, updates and deletes in one transaction.
+    Body: {"operations": [{"op": "update", "edipi": "...", "rank": "CPL"}, ...],
+           "atomic": true}
+    atomic (the default) commits all operations or none; atomic=false skips the
+    failing ones and commits the rest. Returns counts and the failed operations.
+    """
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "The request body must be a JSON object"}), 400
+    payload = data.get('operations')
+    if not isinstance(payload, list):
+        return jsonify({"error": "operations must be a list"}), 400
+    if len(payload) > MAX_BATCH_OPERATIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_OPERATIONS} operations per batch"}), 400
+    atomic = data.get('atomic', True) is not False
+    operations, errors = parse_operations(payload)
+    if errors and atomic:
+        return jsonify({"committed": False, "inserted": 0, "updated": 0, "deleted": 0,
+                        "failed": len(errors), "errors": errors}), 400
+    try:
+        db.connect()
+        summary = db.batch_users(operations, atomic=atomic)
+        db.close()
+    except BatchAborted as e:
+        db.close()
+        return jsonify({"committed": False, "inserted": 0, "updated": 0, "deleted": 0,
+                        "failed": len(e.errors), "errors": e.errors}), 409
+    except sqlite3.Error as e:
+        db.close()
+        return jsonify({"error": str(e)}), 500
+    summary["errors"] = sorted(errors + summary["errors"], key=lambda error: error["index"])
+    summary["failed"] = len(summary["errors"])
+    summary["committed"] = True
+    return jsonify(summary), 200
+
 @app.route('/users/<edipi>', methods=['PUT'])
 def update_user(edipi):
     data = request.get_json()
@@ -80,21 +364,18 @@ def delete_user(edipi):
     db.close()
     return jsonify({"message": "User deleted successfully"})
 @app.route('/users/rank/<rank>', methods=['GET'])
+@conditional
 def get_users_by_rank(rank):
-    db.connect()
     rank = rank.upper()
-    users = db.get_all_roster_by_rank(rank)
-    db.close()
-    return jsonify(users)
+    return roster_response(lambda: db.get_all_roster_by_rank(rank), ranks=[rank])
 @app.route('/users/mos/<bilmos>', methods=['GET'])
+@conditional
 def get_users_by_mos(bilmos):
-    db.connect()
     bilmos = str(bilmos)
-    users = db.get_all_roster_by_mos(bilmos)
-    db.close()
-    return jsonify(users)
+    return roster_response(lambda: db.get_all_roster_by_mos(bilmos), bilmos=[bilmos])
 
 @app.route('/mos', methods=['GET'])
+@conditional
 def get_all_mos_desc():
     db.connect()
     mos_desc = db.get_all_mos_desc()
@@ -102,6 +383,7 @@ def get_all_mos_desc():
     return jsonify(mos_desc)
 
 @app.route('/mos/<bilmos>', methods=['GET'])
+@conditional
 def get_mos_desc_by_bilmos(bilmos):
     db.connect()
     bilmos = str(bilmos)
@@ -109,6 +391,7 @@ def get_mos_desc_by_bilmos(bilmos):
     db.close()
     if mos_desc:
         return jsonify(mos_desc)
+    return jsonify({"error": "MOS description not found"}), 404
 
 @app.route('/mos', methods=['POST'])
 def insert_mos_desc():
@@ -154,24 +437,249 @@ def delete_mos_desc(bilmos):
     
 
 
+def counseling_document(fields):
+    """Render one counseling from its EDIT_ fields and send it as a .docx download."""
+    # ?diagnostics=summary|full logs render details
+    diagnostics = request.args.get('diagnostics')
+    if diagnostics and diagnostics not in DIAGNOSTICS_LEVELS:
+        return jsonify({"error": f"diagnostics must be one of {', '.join(DIAGNOSTICS_LEVELS)}"}), 400
+
+    def send(doc_bytes, cache_status):
+        response = send_file(
+            BytesIO(doc_bytes),
+            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+            as_attachment=True,
+            download_name='filled_counseling.docx'
+        )
+        if cache_status:
+            response.headers['X-Render-Cache'] = cache_status
+        return response
+
+    # Renders with diagnostics are for their messages, so only plain renders are cached
+    cache_key = template = None
+    if render_cache and isinstance(fields, dict) and (diagnostics or os.getenv("DOC_DIAGNOSTICS", "off")) == "off":
+        try:
+            template = load_template(COUNSELING_TEMPLATE)
+            cache_key = template.cache_key(fields)
+        except Exception:
+            cache_key = template = None  # edit_word_tables reports the template problem
+        doc_bytes = render_cache.get(cache_key) if cache_key else None
+        if doc_bytes is not None:
+            return send(doc_bytes, 'hit')
+    # Render with the template the key came from, so the cached bytes match their key
+    doc_bytes, response = edit_word_tables(COUNSELING_TEMPLATE, json.dumps(fields), diagnostics, template)
+    record_render(response)
+    if response['status'] == 'error':
+        return jsonify(response), 400
+    if cache_key:
+        render_cache.put(cache_key, doc_bytes)
+    return send(doc_bytes, 'miss' if cache_key else None)
+
 @app.route('/fill_counseling', methods=['POST'])
 def fill_counseling():
-    
     # Get JSON data
     json_data = request.get_json()
-    
-    # Process the document
-    doc_bytes, response = edit_word_tables("./static/counseling.docx", json.dumps(json_data))
+    return counseling_document(json_data)
+
+def roster_counseling_fields(data):
+    """
+    EDIT_ fields for a body of {"edipi": "...", "senior_edipi": "...", "fields": {...}}:
+    the Marine, the senior and the Marine's MOS description looked up server-side,
+    with `fields` applied on top. Without an edipi only `fields` is used.
+    Returns (fields, None) or (None, error response).
+    """
+    edipi = data.get('edipi')
+    senior_edipi = data.get('senior_edipi')
+    fields = data.get('fields') or {}
+    if not isinstance(fields, dict):
+        return None, (jsonify({"error": "fields must be an object"}), 400)
+    if not edipi:
+        if senior_edipi:
+            return None, (jsonify({"error": "senior_edipi needs an edipi"}), 400)
+        return fields, None
+    try:
+        db.connect()
+        marine, senior, mos = db.get_counseling_rows(edipi, senior_edipi)
+        db.close()
+    except sqlite3.Error as e:
+        db.close()
+        return None, (jsonify({"error": str(e)}), 500)
+    if not marine:
+        return None, (jsonify({"error": f"User {edipi} not found"}), 404)
+    if senior_edipi and not senior:
+        return None, (jsonify({"error": f"Senior {senior_edipi} not found"}), 404)
+    return {**counseling_fields(marine, senior, mos), **fields}, None
+
+@app.route('/fill_counseling/edipi', methods=['POST'])
+def fill_counseling_by_edipi():
+    """
+    Render a counseling from roster data in one round trip. Body:
+    {"edipi": "...", "senior_edipi": "...", "fields": {free-text EDIT_ fields}}
+    The Marine, the senior and the Marine's MOS description are looked up
+    server-side; `fields` are applied on top and may override any of them.
+    """
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "The request body must be a JSON object"}), 400
+    if not data.get('edipi'):
+        return jsonify({"error": "Missing edipi"}), 400
+    fields, error = roster_counseling_fields(data)
+    if error:
+        return error
+    return counseling_document(fields)
+
+def render_counseling_job(fields):
+    """Job body: render one counseling on the render pool, through the render cache."""
+    cache_key = load_template(COUNSELING_TEMPLATE).cache_key(fields) if render_cache else None
+    if cache_key:
+        doc_bytes = render_cache.get(cache_key)
+        if doc_bytes is not None:
+            return doc_bytes
+    doc_bytes, response, rendered_key = render_pool.render(fields)
+    record_render(response)
     if response['status'] == 'error':
-        return jsonify(response), 400
-    
+        raise JobFailed("Counseling render failed", response['messages'])
+    if cache_key:
+        # Stored under the key of the template the worker rendered with
+        render_cache.put(rendered_key, doc_bytes)
+    return doc_bytes
+
+def job_status(job):
+    info = job.describe()
+    info["status_url"] = f"/jobs/{job.id}"
+    info["result_url"] = f"/jobs/{job.id}/result"
+    return info
+
+@app.route('/jobs/counseling', methods=['POST'])
+def submit_counseling_job():
+    """
+    Queue a counseling render and return its job id at once (202). The body is
+    either {"fields": {EDIT_ fields}} or the /fill_counseling/edipi body. Poll
+    GET /jobs/<id> (?wait=seconds to long-poll) and download GET /jobs/<id>/result.
+    """
+    data = request.get_json() or {}
+    if not isinstance(data, dict) or not ('fields' in data or 'edipi' in data):
+        return jsonify({"error": "Provide fields, edipi or both"}), 400
+    fields, error = roster_counseling_fields(data)
+    if error:
+        return error
+    try:
+        job = job_queue.submit('counseling', render_counseling_job, fields)
+    except QueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    response = jsonify(job_status(job))
+    response.headers['Location'] = f"/jobs/{job.id}"
+    return response, 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # ?wait=seconds holds the request until the job finishes or the time is up
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), MAX_JOB_WAIT)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    job = job_queue.wait(job_id, wait)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job_status(job)), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    if job.status == job.FAILED:
+        return jsonify(job_status(job)), 400
+    if job.status != job.DONE:
+        response = jsonify(job_status(job))
+        response.headers['Retry-After'] = '1'
+        return response, 202
+    doc_bytes = job_queue.result(job)
+    if doc_bytes is None:
+        return jsonify({"error": "Job not found or expired"}), 404
     return send_file(
         BytesIO(doc_bytes),
         mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
         as_attachment=True,
         download_name='filled_counseling.docx'
     )
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if job_queue.cancel(job_id):
+        return jsonify({"message": "Job cancelled"}), 200
+    return jsonify({"error": "Job not found or expired"}), 404
+
+@app.route('/counseling/template', methods=['GET'])
+def get_counseling_template():
+    # Full table/cell dump and placeholder locations, kept off the render path
+    return jsonify(inspect_template(COUNSELING_TEMPLATE))
+
+@app.route('/fill_counseling/batch', methods=['POST'])
+def fill_counseling_batch():
+    """
+    Render many counselings at once and stream them back as a ZIP.
+    Body is either {"documents": [{EDIT_ fields}, ...]} or
+    {"edipis": [...], "senior_edipi": "...", "fields": {shared EDIT_ fields}}.
+    """
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "The request body must be a JSON object"}), 400
+    # Checked before any lookups, so an oversized request costs no database work
+    requested = data['documents'] if 'documents' in data else data.get('edipis')
+    if isinstance(requested, list) and len(requested) > MAX_BATCH_DOCUMENTS:
+        return jsonify({"error": f"At most {MAX_BATCH_DOCUMENTS} documents per batch"}), 400
+    errors = []
+    if 'documents' in data:
+        field_sets = data['documents']
+        if not isinstance(field_sets, list) or not all(isinstance(f, dict) for f in field_sets):
+            return jsonify({"error": "documents must be a list of objects"}), 400
+    elif 'edipis' in data:
+        edipis = data['edipis']
+        shared = data.get('fields') or {}
+        if not isinstance(edipis, list) or not isinstance(shared, dict):
+            return jsonify({"error": "edipis must be a list and fields an object"}), 400
+        try:
+            db.connect()
+            senior = None
+            if data.get('senior_edipi'):
+                senior = db.get_user_by_edipi(data['senior_edipi'])
+                if not senior:
+                    db.close()
+                    return jsonify({"error": f"Senior {data['senior_edipi']} not found"}), 404
+            field_sets = []
+            for edipi in edipis:
+                marine = db.get_user_by_edipi(edipi)
+                if not marine:
+                    errors.append({"edipi": str(edipi), "error": "User not found"})
+                    continue
+                mos = db.get_mos_desc_by_bilmos(marine['BILMOS'])
+                field_sets.append({**counseling_fields(marine, senior, mos), **shared})
+            db.close()
+        except sqlite3.Error as e:
+            db.close()
+            return jsonify({"error": str(e)}), 500
+    else:
+        return jsonify({"error": "Provide either documents or edipis"}), 400
+
+    def documents():
+        for index, doc_bytes, response in render_pool.render_iter(field_sets):
+            record_render(response)
+            if response['status'] == 'error':
+                errors.append({"index": index, "error": response['messages']})
+                continue
+            yield document_name(index, field_sets[index]), doc_bytes
+
+    return Response(
+        stream_with_context(stream_zip(documents(), errors)),
+        mimetype='application/zip',
+        headers={"Content-Disposition": "attachment; filename=counselings.zip"}
+    )
+
 @app.route('/tables', methods=['GET'])
+@conditional
 def get_all_tables():
     try:
         db.connect()
@@ -182,24 +690,127 @@ def get_all_tables():
         db.close()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/stats/pool', methods=['GET'])
+def get_pool_stats():
+    stats = db.pool_stats()
+    stats["cursors"] = query_cursors.stats()
+    stats["compression"] = compressor.stats()
+    if render_cache:
+        stats["render_cache"] = render_cache.stats()
+    stats["jobs"] = job_queue.stats()
+    return jsonify(stats), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/stats/slow_queries', methods=['GET'])
+def get_slow_queries():
+    slow_log = db.timer.slow_log
+    if slow_log is None:
+        return jsonify({"error": "Slow query log is off (SLOW_QUERY_MS=0)"}), 404
+    return jsonify({"threshold_ms": slow_log.threshold_ms, "count": slow_log.count, "queries": slow_log.entries()}), 200
+
+@app.route('/stats/replica/check', methods=['GET'])
+def check_replica():
+    # Full comparison of the in-memory roster with the roster table
+    try:
+        db.connect()
+        report = db.check_replica()
+        db.close()
+        return jsonify(report), 200
+    except sqlite3.Error as e:
+        db.close()
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/query', methods=['POST'])
 def run_query():
+    """
+    Run one or more SQL statements. Body: {"query": "...", and optionally
+    "read_only": true, "max_rows": n, "timeout": seconds, "details": true}.
+    Returns a list with each statement's rows; with details, each statement's
+    rows, row count, truncation flag, changes and timing.
+    """
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "The request body must be a JSON object"}), 400
+    statement = data.get('query')
+    # "cursor": true with a single read-only statement returns the first page_size rows and a cursor
+    # id; GET /query/cursors/<id> returns the next page and DELETE closes it
+    if not isinstance(statement, str):
+        return jsonify({"error": "Provide the SQL to run as query"}), 400
+    try:
+        max_rows = min(int(data.get('max_rows', query_executor.max_rows)), QUERY_MAX_ROWS)
+        timeout = min(float(data.get('timeout', query_executor.timeout)), QUERY_MAX_TIMEOUT)
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_rows and timeout must be numbers"}), 400
+    if max_rows < 0 or timeout <= 0:
+        return jsonify({"error": "max_rows must not be negative and timeout must be positive"}), 400
+    details = bool(data.get('details')) or 'details' in request.args
+    if data.get('cursor'):
+        try:
+            db.connect()
+            page = query_cursors.open(request.remote_addr, statement, data.get('page_size'))
+            db.close()
+            return jsonify(page), 200
+        except CursorLimit as e:
+            db.close()
+            return jsonify({"error": str(e)}), 429
+        except (ValueError, TypeError) as e:
+            db.close()
+            return jsonify({"error": str(e)}), 400
+        except sqlite3.Error as e:
+            db.close()
+            return jsonify({"error": str(e)}), 500
+    try:
+        db.connect()
+        results = query_executor.run(statement, read_only=bool(data.get('read_only')),
+                                     max_rows=max_rows, timeout=timeout)
+        db.close()
+    except sqlite3.Error as e:
+        db.close()
+        return jsonify({"error": str(e)}), 500
+    failed = results[-1] if results and 'error' in results[-1] else None
+    status = 200
+    if failed:
+        status = 400 if failed.get('rejected') else 500
+    if details:
+        response = jsonify({"results": results, "error": failed['error'] if failed else None})
+    elif failed:
+        response = jsonify({"error": failed['error']})
+    else:
+        response = jsonify([result['rows'] for result in results])
+    response.status_code = status
+    # Per-statement timing and truncation for clients that keep the plain list shape
+    response.headers['Server-Timing'] = ', '.join(
+        f"stmt{index};dur={result['ms']}" for index, result in enumerate(results))
+    truncated = [str(index) for index, result in enumerate(results) if result.get('truncated')]
+    if truncated:
+        response.headers['X-Query-Truncated'] = ','.join(truncated)
+    return response
+
+@app.route('/query/cursors/<cursor_id>', methods=['GET'])
+def fetch_query_cursor(cursor_id):
     try:
-        statement = request.get_json()['query']
         db.connect()
-        # parse the statement for multiple queries
-        queries = statement.split(';')
-        results = []
-        for query in queries:
-            query = query.strip()
-            if query:
-                result = db.run_query(query)
-                results.append(result)
+        page = query_cursors.fetch(request.remote_addr, cursor_id, request.args.get('page_size', type=int))
         db.close()
-        return jsonify(results), 200
+    except ValueError as e:
+        db.close()
+        return jsonify({"error": str(e)}), 400
     except sqlite3.Error as e:
         db.close()
         return jsonify({"error": str(e)}), 500
+    if page is None:
+        return jsonify({"error": "Cursor not found or expired"}), 404
+    return jsonify(page), 200
+
+@app.route('/query/cursors/<cursor_id>', methods=['DELETE'])
+def close_query_cursor(cursor_id):
+    if query_cursors.close(request.remote_addr, cursor_id):
+        return jsonify({"message": "Cursor closed"}), 200
+    return jsonify({"error": "Cursor not found or expired"}), 404
+
 @app.route('/import/roster', methods=['POST'])
 def import_roster():
     try:
@@ -210,50 +821,21 @@ def import_roster():
         if not file.filename.endswith('.csv'):
             return jsonify({"error": "File is not a CSV"}), 400
         db.connect()
-        # Read the CSV file
-        import csv
-        import io
-        csv_file = io.StringIO(file.stream.read().decode('utf-8'))
-        csv_reader = csv.DictReader(csv_file)
-        for row in csv_reader:
-            # Check if required fields are present
-            required_fields = ['rank', 'firstName', 'lastName', 'edipi', 'dor', 'pmos', 'bilmos']
-            for field in required_fields:
-                if field not in row or not row[field]:
-                    row[field] = ''  # Set default value if not present
-            # Check if EDIPI is not already in the database
-            existing_user = db.get_user_by_edipi(row['edipi'])
-            if existing_user:
-                # If it is a duplicate entry (edipi), update it
-                db.update_user(
-                    row['rank'],
-                    row['firstName'],
-                    row['lastName'],
-                    row.get('mi', ''),
-                    row['edipi'],
-                    row['dor'],
-                    row['pmos'],
-                    row['bilmos'],
-                    row.get('billet', '')
-                )
-            else:
-                # Insert each row into the database
-                db.insert_user(
-                    row['rank'],
-                    row['firstName'],
-                    row['lastName'],
-                    row.get('mi', ''),
-                    row['edipi'],
-                    row['dor'],
-                    row['pmos'],
-                    row['bilmos'],
-                    row.get('billet', '')
-                )
+        # Stream, validate and upsert the CSV in chunked transactions
+        report = import_roster_csv(db, file.stream)
+        db.close()
+        if report["rejected_count"]:
+            report["message"] = f"Roster imported with {report['rejected_count']} rejected rows"
+        else:
+            report["message"] = "Roster imported successfully"
+        return jsonify(report), 200
+    except UnicodeDecodeError as e:
         db.close()
-        return jsonify({"message": "Roster imported successfully"}), 200
+        return jsonify({"error": f"File is not valid UTF-8: {e}"}), 400
     except sqlite3.Error as e:
         db.close()
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
+    # Development server with the reloader; use serve.py in production
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
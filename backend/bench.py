@@ -0,0 +1,385 @@
+"""
+Benchmarks for the Database layer, the roster importer, /query and the
+counseling renderer, run against synthetic rosters in temporary databases.
+
+    python bench.py run                          1k, 10k and 100k rows, JSON to stdout
+    python bench.py run --sizes 1000 -o base.json --engine wal --replica
+    python bench.py compare base.json new.json   flag benchmarks that got slower
+
+Each roster size runs in its own process with a fresh database built from a
+fixed seed, so runs are comparable across commits. Every benchmark reports
+min/median/mean/p95/max milliseconds over its repetitions; compare flags a
+regression when the median grows by more than --threshold (default 20%) and
+by more than --min-ms, and exits with status 1 if it finds any.
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = (1000, 10000, 100000)
+SEED = 1775
+
+RANKS = ['PVT', 'PFC', 'LCPL', 'CPL', 'SGT', 'SSGT', 'GYSGT', 'MSGT', '1STSGT', 'MGYSGT', 'SGTMAJ',
+         '2NDLT', '1STLT', 'CAPT', 'MAJ', 'LTCOL', 'COL']
+# Junior ranks dominate a real roster
+RANK_WEIGHTS = [4, 12, 20, 14, 9, 6, 3, 2, 1, 1, 1, 2, 2, 2, 1, 1, 1]
+MOS = {
+    '0111': 'ADMINISTRATIVE SPECIALIST', '0231': 'INTELLIGENCE SPECIALIST', '0311': 'RIFLEMAN',
+    '0331': 'MACHINE GUNNER', '0341': 'MORTARMAN', '0351': 'INFANTRY ASSAULTMAN',
+    '0352': 'ANTITANK MISSILEMAN', '0411': 'MAINTENANCE MANAGEMENT SPECIALIST',
+    '0431': 'LOGISTICS/EMBARKATION SPECIALIST', '0621': 'TRANSMISSION SYSTEM OPERATOR',
+    '0651': 'CYBER NETWORK OPERATOR', '0811': 'FIELD ARTILLERY CANNONEER', '1371': 'COMBAT ENGINEER',
+    '1833': 'ASSAULT AMPHIBIOUS VEHICLE CREWMAN', '2111': 'SMALL ARMS REPAIRER/TECHNICIAN',
+    '3043': 'SUPPLY CHAIN AND MATERIEL MANAGEMENT SPECIALIST', '3051': 'WAREHOUSE CLERK',
+    '3521': 'AUTOMOTIVE MAINTENANCE TECHNICIAN', '5811': 'MILITARY POLICE', '6046': 'AIRCRAFT MAINTENANCE ADMINISTRATION SPECIALIST',
+    '6672': 'AVIATION SUPPLY SPECIALIST', '7051': 'AIRCRAFT RESCUE AND FIREFIGHTING SPECIALIST',
+}
+FIRST_NAMES = ['JAMES', 'MARIA', 'DENNY', 'OLIVIA', 'NOAH', 'LIAM', 'AVA', 'ETHAN', 'SOPHIA', 'MASON',
+               'ISABELLA', 'LUCAS', 'MIA', 'LOGAN', 'AMELIA', 'ELIJAH', 'HARPER', 'AIDEN', 'EVELYN', 'JACKSON']
+LAST_NAMES = ['SMITH', 'JOHNSON', 'WILLIAMS', 'BROWN', 'JONES', 'GARCIA', 'MILLER', 'DAVIS', 'RODRIGUEZ',
+              'MARTINEZ', 'HERNANDEZ', 'LOPEZ', 'GONZALEZ', 'WILSON', 'ANDERSON', 'THOMAS', 'TAYLOR', 'MOORE',
+              'JACKSON', 'MARTIN', 'LEE', 'PEREZ', 'THOMPSON', 'WHITE', 'HARRIS', 'SANCHEZ', 'CLARK', 'LI']
+BILLETS = ['', '', '', 'FIRE TEAM LEADER', 'SQUAD LEADER', 'PLATOON SERGEANT', 'PLATOON COMMANDER',
+           'SECTION LEADER', 'COMPANY GUNNERY SERGEANT', 'S-4 CHIEF', 'ARMORER', 'DRIVER']
+# The template's free-text slots; the Marine and senior slots come from roster rows
+COUNSELING_FIELDS = {
+    "EDIT_OCCASION": "Quarterly",
+    "EDIT_perFrom": "20241001",
+    "EDIT_perTo": "20241231",
+    "EDIT_TOPICS": "Performance and conduct during the last quarter",
+    "EDIT_EVENTS": "Completed the squad leaders course; led two platoon-level field exercises",
+    "EDIT_EVAL": "Reliable, prepared, sets the example for junior Marines; needs to delegate more in the field",
+    "EDIT_TASKS": "Lead the next squad-level training event and mentor two junior Marines",
+    "EDIT_COMMENTS": "On track for promotion",
+}
+
+
+def roster(size, seed=SEED):
+    """`size` roster tuples (rank, first, last, mi, edipi, dor, pmos, bilmos, billet) that pass validation."""
+    rng = random.Random(seed)
+    codes = sorted(MOS)
+    edipis = rng.sample(range(1000000000, 9999999999), size)
+    rows = []
+    for edipi in edipis:
+        bilmos = rng.choice(codes)
+        dor = rng.randrange(2015, 2026) * 10000 + rng.randrange(1, 13) * 100 + rng.randrange(1, 29)
+        rows.append((
+            rng.choices(RANKS, RANK_WEIGHTS)[0],
+            rng.choice(FIRST_NAMES),
+            rng.choice(LAST_NAMES),
+            rng.choice('ABCDEFGHJKLMNPRSTW '),
+            str(edipi),
+            dor,
+            bilmos if rng.random() < 0.8 else rng.choice(codes),
+            bilmos,
+            rng.choice(BILLETS),
+        ))
+    return rows
+
+
+def roster_csv(rows):
+    """The rows as an /import/roster upload."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['rank', 'firstName', 'lastName', 'mi', 'edipi', 'dor', 'pmos', 'bilmos', 'billet'])
+    writer.writerows(rows)
+    return out.getvalue().encode('utf-8')
+
+
+def build_database(path, rows, engine='default'):
+    """Create a migrated database at `path` holding `rows` and the MOS table."""
+    from db.database import Database
+    db = Database(path, engine=engine)
+    db.bootstrap()
+    db.connect()
+    db.transaction(lambda cursor: cursor.executemany(
+        "INSERT INTO mos (BILMOS, DESCRIPTION) VALUES (?, ?)", sorted(MOS.items())))
+    for start in range(0, len(rows), 10000):
+        db.upsert_users(rows[start:start + 10000])
+    db.close()
+    db.shutdown()
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    ms = [sample * 1000 for sample in samples]
+    return {
+        "runs": len(ms),
+        "min_ms": round(ms[0], 4),
+        "median_ms": round(statistics.median(ms), 4),
+        "mean_ms": round(statistics.fmean(ms), 4),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 4),
+        "max_ms": round(ms[-1], 4),
+    }
+
+
+class Timer:
+    """
+    Runs benchmarks and collects their summaries. Each one gets a warm-up call,
+    then up to `repeat` timed calls, stopping early once `budget` seconds are spent.
+    """
+
+    def __init__(self, repeat, budget):
+        self.repeat = repeat
+        self.budget = budget
+        self.results = {}
+
+    def bench(self, name, fn, setup=None, repeat=None):
+        """Time fn(setup()) (or fn()); setup runs outside the timed region."""
+        repeat = repeat or self.repeat
+
+        def call():
+            argument = setup() if setup else None
+            started = time.perf_counter()
+            result = fn(argument) if setup else fn()
+            return time.perf_counter() - started, result
+
+        _, result = call()
+        samples = []
+        deadline = time.perf_counter() + self.budget
+        while len(samples) < repeat and (not samples or time.perf_counter() < deadline):
+            elapsed, result = call()
+            samples.append(elapsed)
+        self.results[name] = summarize(samples)
+        print(f"  {name:<40} {self.results[name]['median_ms']:>10.3f} ms", file=sys.stderr)
+        return result
+
+
+def measure(size, engine, replica, repeat, budget):
+    """Build a roster of `size` rows and run every benchmark against it (in this process)."""
+    workdir = tempfile.mkdtemp(prefix=f"bench-{size}-")
+    path = os.path.join(workdir, 'database.db')
+    rows = roster(size)
+    started = time.perf_counter()
+    build_database(path, rows, engine)
+    print(f"{size} rows: built in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    # app reads these when imported
+    os.environ.update(DB_PATH=path, DB_ENGINE=engine, ROSTER_REPLICA='1' if replica else '0', SLOW_QUERY_MS='0')
+    os.chdir(BACKEND)
+    import app as server
+    from werkzeug.datastructures import MultiDict
+    from db.query import ROSTER_COLUMNS, RosterQuery
+    from tools.counseling import counseling_fields
+    from tools.doc import edit_word_tables
+
+    db = server.db
+    client = server.app.test_client()
+    timer = Timer(repeat, budget)
+    rng = random.Random(SEED)
+    edipis = [row[4] for row in rows]
+    marine = rows[0]
+
+    def on_connection(fn):
+        def run(*args):
+            db.connect()
+            try:
+                return fn(*args)
+            finally:
+                db.close()
+        return run
+
+    def query(**args):
+        return RosterQuery.from_args(MultiDict(args))
+
+    # Database reads
+    timer.bench("db.get_user_by_edipi", on_connection(db.get_user_by_edipi), lambda: rng.choice(edipis))
+    timer.bench("db.get_all_roster", on_connection(db.get_all_roster))
+    timer.bench("db.get_all_roster_by_rank", on_connection(lambda: db.get_all_roster_by_rank('SGT')))
+    timer.bench("db.get_all_roster_by_mos", on_connection(lambda: db.get_all_roster_by_mos('0311')))
+    timer.bench("db.query_roster.filtered_sorted", on_connection(
+        lambda: db.query_roster(query(rank='PFC,LCPL', dor_from='20200101', sort='-DOR', limit='100'))))
+    timer.bench("db.get_roster_page", on_connection(lambda: db.get_roster_page(query(limit='100'))))
+    timer.bench("db.roster_rows", on_connection(lambda: db.roster_rows(query())))
+    timer.bench("db.iter_roster", on_connection(lambda: sum(1 for _ in db.iter_roster(query()))))
+    timer.bench("db.search_roster", on_connection(lambda: db.search_roster('smi squad')))
+    timer.bench("db.get_mos_desc_by_bilmos", on_connection(db.get_mos_desc_by_bilmos), lambda: rng.choice(sorted(MOS)))
+    timer.bench("db.get_all_mos_desc", on_connection(db.get_all_mos_desc))
+    timer.bench("db.get_all_tables", on_connection(db.get_all_tables))
+
+    # Database writes; each leaves the roster as it found it
+    spare = iter(range(100, 10 ** 9))
+
+    def new_user():
+        return ('PFC', 'BENCH', 'MARK', '', f"{next(spare):010d}", 20240101, '0311', '0311', '')
+
+    def insert_delete(user):
+        db.insert_user(*user)
+        db.delete_user(user[4])
+    timer.bench("db.insert_user+delete_user", on_connection(insert_delete), new_user)
+    timer.bench("db.update_user", on_connection(lambda: db.update_user(*marine)))
+    batch = rows[:1000]
+    timer.bench("db.upsert_users.1000", on_connection(lambda: db.upsert_users(batch)))
+    operations = [(index, 'update', row[4], {'BILLET': row[8]}) for index, row in enumerate(rows[:100])]
+    timer.bench("db.batch_users.100", on_connection(lambda: db.batch_users(operations)))
+
+    # HTTP through the Flask test client
+    def get(url, **kwargs):
+        def run():
+            response = client.get(url, **kwargs)
+            assert response.status_code == 200, (url, response.status_code)
+            response.get_data()
+        return run
+
+    def post(url, **kwargs):
+        def run():
+            response = client.post(url, **kwargs)
+            assert response.status_code == 200, (url, response.status_code, response.get_data()[:200])
+            return response.get_data()
+        return run
+
+    timer.bench("http.GET /users", get('/users'))
+    timer.bench("http.GET /users/<edipi>", lambda edipi: get(f'/users/{edipi}')(), lambda: rng.choice(edipis))
+    timer.bench("http.GET /users?rank&limit", get('/users?rank=SGT&limit=100'))
+    timer.bench("http.GET /users?format=columnar", get('/users?format=columnar'))
+    timer.bench("http.GET /mos/<bilmos>", get('/mos/0311'))
+    timer.bench("http.POST /query.aggregate", post('/query', json={
+        "query": "SELECT RANK, BILMOS, COUNT(*) AS n FROM roster GROUP BY RANK, BILMOS ORDER BY n DESC"}))
+    timer.bench("http.POST /query.scan", post('/query', json={
+        "query": "SELECT * FROM roster WHERE LASTNAME LIKE '%SON%' AND BILLET <> ''", "max_rows": 100000}))
+    upload = roster_csv(rows)
+    timer.bench("http.POST /import/roster",
+                lambda data: post('/import/roster', data=data, content_type='multipart/form-data')(),
+                lambda: {'file': (io.BytesIO(upload), 'roster.csv')}, repeat=3)
+
+    # Counseling renders, per document
+    fields = {**counseling_fields(dict(zip(ROSTER_COLUMNS, marine)), dict(zip(ROSTER_COLUMNS, rows[1])),
+                                  {'BILMOS': marine[7], 'DESCRIPTION': MOS[marine[7]]}),
+              **COUNSELING_FIELDS}
+    fields_json = json.dumps(fields)
+    timer.bench("doc.edit_word_tables", lambda: edit_word_tables(server.COUNSELING_TEMPLATE, fields_json, "off"))
+    # A new comment each time so the render cache can't answer; the cache_hit case measures a hit
+    renders = itertools.count()
+    timer.bench("http.POST /fill_counseling", lambda body: post('/fill_counseling', json=body)(),
+                lambda: {**fields, "EDIT_COMMENTS": f"Counseling {next(renders)}"})
+    timer.bench("http.POST /fill_counseling.cache_hit", post('/fill_counseling', json=fields))
+
+    server.render_pool.shutdown()
+    db.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {"size": size, "benchmarks": timer.results}
+
+
+def run(args):
+    sizes = [int(size) for size in args.sizes.split(',')]
+    meta = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "engine": args.engine,
+        "replica": args.replica,
+        "repeat": args.repeat,
+    }
+    try:
+        meta["commit"] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND,
+                                        capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    results = {}
+    for size in sizes:
+        # A process per size: app binds its database at import, and caches start cold
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as out:
+            output = out.name
+        command = [sys.executable, os.path.abspath(__file__), '_size', str(size), output,
+                   '--engine', args.engine, '--repeat', str(args.repeat), '--budget', str(args.budget)]
+        if args.replica:
+            command.append('--replica')
+        subprocess.run(command, check=True, stdout=sys.stderr)
+        with open(output) as f:
+            results[str(size)] = json.load(f)["benchmarks"]
+        os.unlink(output)
+    report = json.dumps({"meta": meta, "results": results}, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = []
+    print(f"{'size':>7}  {'benchmark':<40} {'baseline':>11} {'current':>11} {'change':>8}")
+    for size, benchmarks in current["results"].items():
+        before = baseline["results"].get(size, {})
+        for name, result in sorted(benchmarks.items()):
+            if name not in before:
+                print(f"{size:>7}  {name:<40} {'-':>11} {result['median_ms']:>9.3f}ms {'new':>8}")
+                continue
+            old, new = before[name]["median_ms"], result["median_ms"]
+            change = (new - old) / old if old else 0.0
+            flag = ""
+            if change > args.threshold and new - old > args.min_ms:
+                flag = "  REGRESSION"
+                regressions.append((size, name, change))
+            print(f"{size:>7}  {name:<40} {old:>9.3f}ms {new:>9.3f}ms {change:>+8.1%}{flag}")
+    for size, benchmarks in baseline["results"].items():
+        for name in sorted(set(benchmarks) - set(current["results"].get(size, {}))):
+            print(f"{size:>7}  {name:<40} {'missing from current run':>32}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the roster backend")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run the benchmarks and write JSON results")
+    run_parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                            help="comma-separated roster sizes (default %(default)s)")
+    run_parser.add_argument('--engine', choices=('default', 'wal'), default='default')
+    run_parser.add_argument('--replica', action='store_true', help="serve roster reads from the in-memory replica")
+    run_parser.add_argument('--repeat', type=int, default=20, help="timed runs per benchmark (default %(default)s)")
+    run_parser.add_argument('--budget', type=float, default=5.0,
+                            help="seconds per benchmark before it stops repeating (default %(default)s)")
+    run_parser.add_argument('-o', '--output', help="write results here instead of stdout")
+
+    compare_parser = commands.add_parser('compare', help="compare two result files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help="relative slowdown of the median that counts as a regression (default %(default)s)")
+    compare_parser.add_argument('--min-ms', type=float, default=0.05,
+                                help="ignore slowdowns smaller than this many milliseconds (default %(default)s)")
+
+    size_parser = commands.add_parser('_size')  # internal: one size, in a child process
+    size_parser.add_argument('size', type=int)
+    size_parser.add_argument('output')
+    size_parser.add_argument('--engine', default='default')
+    size_parser.add_argument('--replica', action='store_true')
+    size_parser.add_argument('--repeat', type=int, default=20)
+    size_parser.add_argument('--budget', type=float, default=5.0)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'compare':
+        compare(args)
+    else:
+        result = measure(args.size, args.engine, args.replica, args.repeat, args.budget)
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import threading
+
+
+class MosCache:
+    """
+    Process-local copy of the mos table, keyed by BILMOS.
+
+    The table is loaded whole, so a BILMOS missing from a loaded cache is known
+    not to exist. Each load is stamped with Database.data_version(); a lookup
+    made under a different version is a miss and the caller reloads. Writes made
+    through Database are applied in place instead of invalidating.
+    """
+
+    def __init__(self):
+        self._rows = None
+        self._version = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0}
+
+    def lookup(self, version):
+        """Return the cached {BILMOS: row} mapping, or None if it must be reloaded."""
+        with self._lock:
+            if self._rows is not None and self._version == version:
+                self._stats["hits"] += 1
+                return self._rows
+            self._stats["misses"] += 1
+            return None
+
+    def load(self, version, rows):
+        """Replace the cache with every row of the mos table and return the mapping."""
+        with self._lock:
+            self._rows = {row['BILMOS']: row for row in rows}
+            self._version = version
+            self._stats["loads"] += 1
+            return self._rows
+
+    def apply(self, before, after, change):
+        """
+        Record a write committed between data versions `before` and `after`.
+        change(rows) edits the {BILMOS: row} mapping to match the write; None
+        means its effect on mos is unknown and drops the cache.
+        """
+        with self._lock:
+            if self._rows is None:
+                return
+            if change is None or self._version != before:
+                # Unknown write, or something else changed the data first
+                self._rows = None
+                self._stats["invalidations"] += 1
+                return
+            rows = dict(self._rows)
+            change(rows)
+            self._rows = rows
+            self._version = after
+
+    def invalidate(self):
+        with self._lock:
+            if self._rows is not None:
+                self._stats["invalidations"] += 1
+            self._rows = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["hits"] + stats["misses"]
+            stats["size"] = len(self._rows) if self._rows is not None else 0
+            stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+            return stats
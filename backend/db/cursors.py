@@ -0,0 +1,363 @@
+import json
+import secrets
+import sqlite3
+import threading
+import time
+
+from db.executor import Budget, is_read_only, leading_keyword, split_statements
+
+# Statements that can be wrapped in SELECT * FROM (...) and paged with LIMIT/OFFSET
+SUBQUERY_KEYWORDS = ('SELECT', 'WITH', 'VALUES')
+
+
+class CursorLimit(sqlite3.OperationalError):
+    """Raised when a client already has as many open cursors as it may."""
+
+
+def _read_page(conn, sql, offset, count, budget):
+    """
+    Run `sql` on `conn` and return (up to `count` of its rows from `offset`, the
+    cursor description). SELECT, WITH and VALUES run as a subquery with LIMIT and
+    OFFSET; other statements (PRAGMA, EXPLAIN, ...) can't be subqueries, so they
+    run whole and the page is sliced out of their materialised rows.
+    """
+    cursor = conn.cursor()
+    try:
+        if leading_keyword(sql) in SUBQUERY_KEYWORDS:
+            # On their own lines so a trailing -- comment in sql can't swallow the parenthesis
+            rows = budget.run(conn, lambda: cursor.execute(
+                f"SELECT * FROM (\n{sql}\n) LIMIT ? OFFSET ?", (count, offset)).fetchall())
+        else:
+            rows = budget.run(conn, lambda: cursor.execute(sql).fetchall())[offset:offset + count]
+        return rows, cursor.description
+    finally:
+        cursor.close()
+
+
+class _Cursor:
+    """
+    One open result set. With its own connection (snapshot mode) the statement
+    stays open and each page continues it; otherwise each page re-runs the
+    statement through _read_page() on the caller's pooled connection.
+    """
+
+    def __init__(self, client, sql, conn=None):
+        self.client = client
+        self.sql = sql
+        self.conn = conn
+        self.cursor = None
+        self.pending = []  # look-ahead row already read from a snapshot cursor
+        self.offset = 0
+        self.columns = None
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def fetch(self, conn, page_size, budget):
+        """Return (rows as dictionaries, whether more rows follow)."""
+        if self.conn is not None:
+            if self.cursor is None:
+                self.cursor = self.conn.cursor()
+                budget.run(self.conn, lambda: self.cursor.execute(self.sql))
+            wanted = page_size + 1 - len(self.pending)
+            rows = self.pending + budget.run(self.conn, lambda: self.cursor.fetchmany(wanted))
+            description = self.cursor.description
+        else:
+            rows, description = _read_page(conn, self.sql, self.offset, page_size + 1, budget)
+        if self.columns is None and description:
+            self.columns = [column[0] for column in description]
+        self.pending = rows[page_size:]
+        rows = rows[:page_size]
+        self.offset += len(rows)
+        self.last_used = time.monotonic()
+        return [dict(row) for row in rows], bool(self.pending)
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except sqlite3.Error:
+                pass
+            self.conn = None
+
+
+class CursorRegistry:
+    """
+    Server-side cursors over read-only ad-hoc SELECTs, paged on request.
+
+    snapshot=True gives every cursor its own read-only connection whose open
+    statement keeps a consistent snapshot and continues where the last page
+    stopped. That needs WAL, where an open reader doesn't block writers; with the
+    rollback journal each page re-runs the statement with LIMIT/OFFSET instead.
+    Cursors idle for `idle_timeout` seconds are closed, and each client may hold
+    at most `max_per_client` of them.
+
+    Cursors live in this process. Use SharedCursorRegistry when several worker
+    processes serve the same clients.
+    """
+
+    def __init__(self, db, snapshot=False, page_size=100, max_page_size=1000, idle_timeout=120.0,
+                 max_per_client=5, timeout=5.0, max_steps=200_000_000):
+        self.db = db
+        self.snapshot = snapshot
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.idle_timeout = idle_timeout
+        self.max_per_client = max_per_client
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "closed": 0, "expired": 0, "exhausted": 0, "pages": 0, "rejected": 0}
+
+    def _page_size(self, page_size):
+        page_size = page_size or self.page_size
+        if not 1 <= page_size <= self.max_page_size:
+            raise ValueError(f"page_size must be between 1 and {self.max_page_size}")
+        return page_size
+
+    def expire(self):
+        """Close cursors idle for longer than idle_timeout."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            expired = [cursor_id for cursor_id, cursor in self._cursors.items() if cursor.last_used < cutoff]
+            cursors = [self._cursors.pop(cursor_id) for cursor_id in expired]
+            self._stats["expired"] += len(cursors)
+        for cursor in cursors:
+            with cursor.lock:
+                cursor.close()
+
+    def _statement(self, text):
+        """The single read-only statement in `text`, without its trailing semicolon."""
+        statements = split_statements(text)
+        if len(statements) != 1:
+            raise ValueError("A cursor takes exactly one statement")
+        sql = statements[0].rstrip(';').strip()
+        if not is_read_only(self.db.conn, sql):
+            raise ValueError("Only statements that don't modify the database can be paged with a cursor")
+        return sql
+
+    def open(self, client, text, page_size=None):
+        """
+        Start a cursor over `text`, which must be one read-only statement, and return
+        its first page: {"cursor": id or None once exhausted, "columns": [...],
+        "rows": [...], "has_more": bool}. Needs a connection checked out with db.connect().
+        """
+        page_size = self._page_size(page_size)
+        sql = self._statement(text)
+        self.expire()
+        with self._lock:
+            if sum(1 for cursor in self._cursors.values() if cursor.client == client) >= self.max_per_client:
+                self._stats["rejected"] += 1
+                raise CursorLimit(f"At most {self.max_per_client} open cursors per client; close or finish one first")
+            cursor_id = secrets.token_urlsafe(16)
+            cursor = _Cursor(client, sql, self.db.open_reader() if self.snapshot else None)
+            self._cursors[cursor_id] = cursor
+            self._stats["opened"] += 1
+        return self._page(cursor_id, cursor, page_size)
+
+    def fetch(self, client, cursor_id, page_size=None):
+        """Return the next page of an open cursor, in the same shape as open(). None if unknown."""
+        page_size = self._page_size(page_size)
+        self.expire()
+        with self._lock:
+            cursor = self._cursors.get(cursor_id)
+        if cursor is None or cursor.client != client:
+            return None
+        return self._page(cursor_id, cursor, page_size)
+
+    def close(self, client, cursor_id):
+        """Close a cursor. Returns False if it was unknown."""
+        with self._lock:
+            cursor = self._cursors.get(cursor_id)
+            if cursor is None or cursor.client != client:
+                return False
+            del self._cursors[cursor_id]
+            self._stats["closed"] += 1
+        with cursor.lock:
+            cursor.close()
+        return True
+
+    def _page(self, cursor_id, cursor, page_size):
+        budget = Budget(self.timeout, self.max_steps)
+        try:
+            with cursor.lock:
+                rows, more = cursor.fetch(self.db.conn, page_size, budget)
+        except sqlite3.Error:
+            self._discard(cursor_id, cursor)
+            raise
+        with self._lock:
+            self._stats["pages"] += 1
+        if not more:
+            self._discard(cursor_id, cursor)
+            with self._lock:
+                self._stats["exhausted"] += 1
+        return {"cursor": cursor_id if more else None, "columns": cursor.columns or [], "rows": rows, "has_more": more}
+
+    def _discard(self, cursor_id, cursor):
+        with self._lock:
+            self._cursors.pop(cursor_id, None)
+        with cursor.lock:
+            cursor.close()
+
+    def close_all(self):
+        with self._lock:
+            cursors = list(self._cursors.values())
+            self._cursors.clear()
+        for cursor in cursors:
+            with cursor.lock:
+                cursor.close()
+
+    def after_fork(self):
+        """Forget cursors inherited from the parent process; their connections belong to it."""
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open"] = len(self._cursors)
+            stats["clients"] = len({cursor.client for cursor in self._cursors.values()})
+            return stats
+
+
+class SharedCursorRegistry(CursorRegistry):
+    """
+    CursorRegistry whose cursors are rows in a SharedState table, so a page can be
+    fetched from whichever worker process the request reaches. Each page re-runs
+    the statement from the recorded position (there is no snapshot mode), and a
+    page fetched concurrently for the same cursor is re-read from where the other
+    request left it.
+    """
+
+    def __init__(self, db, state, **limits):
+        super().__init__(db, snapshot=False, **limits)
+        self.state = state
+        state.create('''
+            CREATE TABLE IF NOT EXISTS query_cursors (
+                ID TEXT PRIMARY KEY,
+                CLIENT TEXT NOT NULL,
+                SQL TEXT NOT NULL,
+                POSITION INTEGER NOT NULL,
+                COLUMNS TEXT NOT NULL,
+                LAST_USED REAL NOT NULL
+            )
+        ''')
+
+    def expire(self):
+        """Close cursors idle for longer than idle_timeout."""
+        # Wall-clock time; monotonic clocks aren't comparable between processes
+        expired = self.state.execute('''
+            DELETE FROM query_cursors
+            WHERE LAST_USED < ?
+        ''', (time.time() - self.idle_timeout,)).rowcount
+        with self._lock:
+            self._stats["expired"] += expired
+
+    def _record(self, client, cursor_id):
+        row = self.state.execute('''
+            SELECT * FROM query_cursors
+            WHERE ID = ? AND CLIENT = ?
+        ''', (cursor_id, client)).fetchone()
+        return dict(row) if row else None
+
+    def open(self, client, text, page_size=None):
+        page_size = self._page_size(page_size)
+        sql = self._statement(text)
+        self.expire()
+        open_cursors = self.state.execute('''
+            SELECT COUNT(*) FROM query_cursors
+            WHERE CLIENT = ?
+        ''', (client,)).fetchone()[0]
+        if open_cursors >= self.max_per_client:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise CursorLimit(f"At most {self.max_per_client} open cursors per client; close or finish one first")
+        with self._lock:
+            self._stats["opened"] += 1
+        record = {"ID": secrets.token_urlsafe(16), "CLIENT": client, "SQL": sql, "POSITION": 0, "COLUMNS": None}
+        return self._page(record, page_size)
+
+    def fetch(self, client, cursor_id, page_size=None):
+        page_size = self._page_size(page_size)
+        self.expire()
+        record = self._record(client, cursor_id)
+        if record is None:
+            return None
+        return self._page(record, page_size)
+
+    def close(self, client, cursor_id):
+        closed = self.state.execute('''
+            DELETE FROM query_cursors
+            WHERE ID = ? AND CLIENT = ?
+        ''', (cursor_id, client)).rowcount
+        if closed:
+            with self._lock:
+                self._stats["closed"] += 1
+        return bool(closed)
+
+    def _page(self, record, page_size):
+        budget = Budget(self.timeout, self.max_steps)
+        while True:
+            try:
+                rows, description = _read_page(self.db.conn, record["SQL"], record["POSITION"], page_size + 1, budget)
+            except sqlite3.Error:
+                self._forget(record)
+                raise
+            more = len(rows) > page_size
+            rows = rows[:page_size]
+            columns = json.loads(record["COLUMNS"]) if record["COLUMNS"] else \
+                [column[0] for column in description or ()]
+            if self._advance(record, len(rows), columns, more):
+                break
+            # Another request paged or closed this cursor meanwhile; continue from where it stopped
+            record = self._record(record["CLIENT"], record["ID"])
+            if record is None:
+                return None
+        with self._lock:
+            self._stats["pages"] += 1
+            if not more:
+                self._stats["exhausted"] += 1
+        return {"cursor": record["ID"] if more else None, "columns": columns,
+                "rows": [dict(row) for row in rows], "has_more": more}
+
+    def _advance(self, record, count, columns, more):
+        """Record that `count` more rows were returned. False if the cursor moved or closed meanwhile."""
+        if record["COLUMNS"] is None:
+            # First page of a new cursor; only worth keeping if there is more to read
+            if more:
+                self.state.execute('''
+                    INSERT INTO query_cursors (ID, CLIENT, SQL, POSITION, COLUMNS, LAST_USED)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (record["ID"], record["CLIENT"], record["SQL"], count, json.dumps(columns), time.time()))
+            return True
+        if more:
+            return self.state.execute('''
+                UPDATE query_cursors
+                SET POSITION = ?, LAST_USED = ?
+                WHERE ID = ? AND POSITION = ?
+            ''', (record["POSITION"] + count, time.time(), record["ID"], record["POSITION"])).rowcount > 0
+        return self.state.execute('''
+            DELETE FROM query_cursors
+            WHERE ID = ? AND POSITION = ?
+        ''', (record["ID"], record["POSITION"])).rowcount > 0
+
+    def _forget(self, record):
+        self.state.execute('''
+            DELETE FROM query_cursors
+            WHERE ID = ?
+        ''', (record["ID"],))
+
+    def close_all(self):
+        """Nothing to do: other workers may still page these cursors, and idle ones expire."""
+
+    def after_fork(self):
+        """Nothing to do: cursors are in the shared state, not in this process."""
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        row = self.state.execute('''
+            SELECT COUNT(*), COUNT(DISTINCT CLIENT) FROM query_cursors
+        ''').fetchone()
+        stats["open"], stats["clients"] = row[0], row[1]
+        return stats
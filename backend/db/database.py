@@ -1,74 +1,567 @@
+import itertools
+import os
+import re
 import sqlite3
+import threading
+from db.cache import MosCache
+from db.pool import ConnectionPool
+from db.query import ROSTER_COLUMNS
+from db.replica import RosterReplica
+from db.schema import migrate
+from db.timing import StatementTimer
+from db.version import VersionFile
+from db.writer import WriterThread
+
+ENGINES = ('default', 'wal')
+
+# Connection tuning used by the 'wal' engine
+WAL_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+
+def _unchanged(cache):
+    """Cache change for writes that never touch the cached table."""
+
+
+class BatchAborted(sqlite3.DatabaseError):
+    """An atomic batch failed; nothing was written. `errors` lists the failing operations."""
+
+    def __init__(self, errors):
+        super().__init__(errors[0]["error"] if errors else "Batch aborted")
+        self.errors = errors
+
 
 class Database:
-    def __init__(self):
-        self.conn = None
-        self.cursor = None
+    def __init__(self, path='database.db', pool_size=5, pool_timeout=30.0, engine='default', replica=False,
+                 slow_query_ms=None):
+        """
+        engine='default' keeps SQLite's rollback journal and commits on the
+        calling thread. engine='wal' switches the file to WAL, serves reads from
+        read-only pooled connections and funnels every write through a single
+        writer thread.
+        replica=True keeps a copy of the roster in memory and answers roster
+        reads from it; SQLite stays the durable store.
+        Every statement is timed through self.timer; add hooks to it to collect
+        timings. Statements slower than slow_query_ms are logged.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+        self.path = path
+        self.engine = engine
+        self.timer = StatementTimer(slow_query_ms)
+        self.pool = ConnectionPool(path, max_size=pool_size, timeout=pool_timeout, on_connect=self._configure,
+                                   factory=self.timer.connection_class)
+        self.writer = WriterThread(self._connect_writer, on_commit=self._publish_version) if engine == 'wal' else None
+        # Last committed write count, shared by every process using this database
+        self._version_file = VersionFile(path + '-version')
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._version_lock = threading.Lock()
+        self._writes_in_flight = 0
+        self.mos_cache = MosCache()
+        self.replica = RosterReplica() if replica else None
+        self._replica_lock = threading.Lock()
+
+    @property
+    def conn(self):
+        """Connection checked out by the calling thread, if any."""
+        return getattr(self._local, 'conn', None)
+
+    @property
+    def cursor(self):
+        """Cursor on the calling thread's connection, if any."""
+        return getattr(self._local, 'cursor', None)
+
+    def _configure(self, conn):
+        """Per-connection setup, run once when the pool opens a connection."""
+        conn.row_factory = sqlite3.Row  # Allows accessing rows as dictionaries
+        if self.engine == 'wal':
+            for pragma in WAL_PRAGMAS:
+                conn.execute(pragma)
+            # Readers never write; writes go through self.writer
+            conn.execute("PRAGMA query_only = ON")
+
+    def _connect_writer(self):
+        """Open the writer thread's connection. Transactions are managed explicitly."""
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               factory=self.timer.connection_class)
+        conn.row_factory = sqlite3.Row
+        for pragma in WAL_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def open_reader(self):
+        """Open a configured, read-only connection outside the pool; the caller closes it."""
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=self.timer.connection_class)
+        self._configure(conn)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
 
     def connect(self):
-        """Create and return a database connection."""
-        self.conn = sqlite3.connect('database.db')
-        self.conn.row_factory = sqlite3.Row  # Allows accessing rows as dictionaries
-        self.cursor = self.conn.cursor()
-        self.create_table()
+        """Check out a pooled connection for the calling thread.
+           Nested connect()/close() pairs on the same thread share one connection.
+        """
+        if not self._schema_ready:
+            # Normally done at startup; covers callers that never bootstrapped
+            self.bootstrap()
+        if self.conn is None:
+            conn = self.pool.checkout()
+            self._local.conn = conn
+            self._local.cursor = conn.cursor()
+            self._local.depth = 0
+        self._local.depth += 1
 
     def close(self):
-        """Close the database connection."""
-        if self.conn:
-            self.conn.close()
+        """Return the calling thread's connection to the pool."""
+        if self.conn is None:
+            return
+        self._local.depth -= 1
+        if self._local.depth <= 0:
+            self.release()
 
-    def create_table(self):
-        """Create tables if they don't exist."""
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS roster (
-                RANK TEXT NOT NULL,
-                FIRSTNAME TEXT NOT NULL,
-                LASTNAME TEXT NOT NULL,
-                MI TEXT,
-                EDIPI CHAR(10) PRIMARY KEY CHECK (LENGTH(EDIPI) = 10 AND EDIPI GLOB '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]'),
-                DOR INTEGER NOT NULL,
-                PMOS CHAR(4) NOT NULL CHECK (LENGTH(PMOS) = 4 AND PMOS GLOB '[0-9][0-9][0-9][0-9]'),
-                BILMOS CHAR(4) NOT NULL CHECK (LENGTH(BILMOS) = 4 AND BILMOS GLOB '[0-9][0-9][0-9][0-9]'),
-                BILLET TEXT
-            )
-        ''')
+    def release(self):
+        """Return the calling thread's connection to the pool regardless of nesting."""
+        conn = self.conn
+        if conn is None:
+            return
+        self._local.cursor.close()
+        self._local.conn = None
+        self._local.cursor = None
+        self._local.depth = 0
+        self.pool.checkin(conn)
+
+    def pool_stats(self):
+        """Connection pool counters (checkouts, waits, hit rate, ...)."""
+        stats = self.pool.stats()
+        if self.writer:
+            stats["writer"] = self.writer.stats()
+        stats["mos_cache"] = self.mos_cache.stats()
+        if self.replica:
+            stats["replica"] = self.replica.stats()
+        return stats
+
+    def shutdown(self):
+        """Drain pending writes and close idle connections."""
+        if self.writer:
+            self.writer.stop()
+        self.pool.close_all()
+
+    def after_fork(self):
+        """
+        Give a freshly forked worker process its own pool and writer thread.
+        SQLite connections must not cross a fork, so anything inherited from the
+        parent is dropped without being used; the schema flag and the warm
+        mos/roster caches are kept.
+        """
+        self.pool = ConnectionPool(self.path, max_size=self.pool.max_size, timeout=self.pool.timeout,
+                                   on_connect=self._configure, factory=self.timer.connection_class)
+        self.writer = WriterThread(self._connect_writer, on_commit=self._publish_version) if self.engine == 'wal' else None
+        self._local = threading.local()
+        self._version_lock = threading.Lock()
+        self._writes_in_flight = 0
+        self._replica_lock = threading.Lock()
+
+    def bootstrap(self):
+        """Apply pending schema migrations. Runs once per process."""
+        with self._schema_lock:
+            if not self._schema_ready:
+                migrate(self.path)
+                if self.engine == 'wal':
+                    # journal_mode is persistent, so setting it once is enough
+                    conn = sqlite3.connect(self.path)
+                    try:
+                        conn.execute("PRAGMA journal_mode = WAL")
+                    finally:
+                        conn.close()
+                conn = sqlite3.connect(self.path, isolation_level=None)
+                try:
+                    self._publish_version(conn)
+                finally:
+                    conn.close()
+                self._schema_ready = True
+
+    def transaction(self, fn, mos=None, roster=None):
+        """Run fn(cursor) as one committed write transaction and return its result.
+           With the 'wal' engine this runs on the writer thread, otherwise on the
+           calling thread's connection.
+           mos(rows) applies the write to the MOS cache's {BILMOS: row} mapping and
+           roster(draft) to a draft of the roster replica; leave either None when the write's
+           effect on that table is unknown to drop the cached copy.
+        """
+        versions = []
+
+        def write(cursor):
+            # The write lock is held from here on, so no other process commits until
+            # this transaction does: the version read now is exactly the data fn changes
+            files = self._file_stamp()
+            result = fn(cursor)
+            count = self._bump_version(cursor.connection)
+            versions[:] = [self._version_token(count, files), (count + 1) & 0x7fffffff]
+            return result
+
+        with self._version_lock:
+            self._writes_in_flight += 1
+        try:
+            if self.writer:
+                result = self.writer.execute(write)
+            else:
+                try:
+                    # Explicit, so savepoints inside fn nest in it instead of committing on RELEASE
+                    if not self.conn.in_transaction:
+                        self.conn.execute("BEGIN IMMEDIATE")
+                    result = write(self.cursor)
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
+                self._publish_version(self.conn)
+            # The caches patch in this write only if they hold the data it started from;
+            # whatever else committed since is reflected in the counter part of `after`
+            before, count = versions
+            after = self._version_token(count)
+            self.mos_cache.apply(before, after, mos)
+            if self.replica:
+                self.replica.apply(before, after, roster)
+        finally:
+            with self._version_lock:
+                self._writes_in_flight -= 1
+        return result
+
+    @staticmethod
+    def _bump_version(conn):
+        """Count a write in the database header's user_version, inside the write's transaction.
+           Returns the count before this write.
+        """
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        # user_version is a signed 32-bit integer
+        conn.execute(f"PRAGMA user_version = {(version + 1) & 0x7fffffff}")
+        return version
+
+    def _publish_version(self, conn):
+        """Copy the committed write count to the shared version file, right after a commit.
+           Taking the write lock to do it keeps processes from publishing out of order, so
+           the file never goes back to a count older than the data.
+        """
+        timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+        conn.execute("PRAGMA busy_timeout = 0")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            # Busy: whoever holds the lock commits after us and publishes a count that includes ours
+            return
+        finally:
+            conn.execute(f"PRAGMA busy_timeout = {timeout}")
+        try:
+            self._version_file.set(conn.execute("PRAGMA user_version").fetchone()[0])
+        finally:
+            conn.execute("COMMIT")
+
+    def _file_stamp(self):
+        """Size and mtime of the database file and its WAL."""
+        parts = []
+        for path in (self.path, self.path + '-wal'):
+            try:
+                stat = os.stat(path)
+                parts += [stat.st_mtime_ns, stat.st_size]
+            except FileNotFoundError:
+                parts += [0, 0]
+        return parts
+
+    def _version_token(self, count, files=None):
+        return '-'.join(format(part, 'x') for part in [count] + (self._file_stamp() if files is None else files))
+
+    def data_version(self):
+        """Return a token that changes whenever the data may have changed.
+           Combines the write counter every transaction() bumps in the database
+           itself, as last published to the shared version file, with the size
+           and mtime of the database file and its WAL, which catch writes made
+           without transaction() (e.g. the sqlite3 shell). Every process computes
+           the same token for the same data, so ETags match across serve.py's
+           workers. Costs no query: a read of mapped memory and two stat() calls.
+        """
+        return self._version_token(self._version_file.get())
+
+    def _write(self, sql, params=(), mos=_unchanged, roster=_unchanged):
+        """Execute a single write statement, commit it and return the rowcount."""
+        return self.transaction(lambda cursor: cursor.execute(sql, params).rowcount, mos, roster)
+
+    def _write_roster(self, sql, params, edipis):
+        """Execute a single roster write and refresh the replica's copy of `edipis`."""
+        stored = []
+
+        def write(cursor):
+            rowcount = cursor.execute(sql, params).rowcount
+            stored.extend(self._read_back(cursor, edipis))
+            return rowcount
+
+        return self.transaction(write, _unchanged, lambda replica: self._refresh(replica, edipis, stored))
+
+    def _read_back(self, cursor, edipis):
+        """Re-read rows as SQLite stored them (after type affinity) for the replica."""
+        if not self.replica:
+            return []
+        rows = []
+        edipis = [str(edipi) for edipi in edipis]
+        # Stay well under SQLite's bound parameter limit
+        for start in range(0, len(edipis), 500):
+            chunk = edipis[start:start + 500]
+            cursor.execute(f'''
+                SELECT {', '.join(ROSTER_COLUMNS)} FROM roster
+                WHERE EDIPI IN ({', '.join('?' * len(chunk))})
+                ORDER BY rowid
+            ''', chunk)
+            rows.extend(tuple(row) for row in cursor.fetchall())
+        return rows
+
+    @staticmethod
+    def _refresh(replica, edipis, stored):
+        """Make the replica draft's rows for `edipis` match `stored`, the rows read back after the write."""
+        present = {row[ROSTER_COLUMNS.index('EDIPI')] for row in stored}
+        replica.remove([str(edipi) for edipi in edipis if str(edipi) not in present])
+        replica.put(stored)
+
+    def schema_version(self):
+        """Return the applied schema version."""
         self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS mos (
-                BILMOS CHAR(4) PRIMARY KEY CHECK (LENGTH(BILMOS) = 4 AND BILMOS GLOB '[0-9][0-9][0-9][0-9]'),
-                DESCRIPTION TEXT NOT NULL,
-                FOREIGN KEY (BILMOS) REFERENCES roster(BILMOS)
-            )
+            SELECT MAX(VERSION) FROM schema_version
         ''')
-        self.conn.commit()
+        return self.cursor.fetchone()[0] or 0
 
     def insert_user(self, rank, firstname, lastname, mi, edipi, dor, pmos, bilmos, billet):
         """Insert a new user into the roster table."""
-        self.cursor.execute('''
+        self._write_roster('''
             INSERT INTO roster (RANK, FIRSTNAME, LASTNAME, MI, EDIPI, DOR, PMOS, BILMOS, BILLET)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (rank, firstname, lastname, mi, edipi, dor, pmos, bilmos, billet))
-        self.conn.commit()
+        ''', (rank, firstname, lastname, mi, edipi, dor, pmos, bilmos, billet), [edipi])
 
     def update_user(self, rank, firstname, lastname, mi, edipi, dor, pmos, bilmos, billet):
         """Update a user by EDIPI."""
-        self.cursor.execute('''
+        self._write_roster('''
             UPDATE roster
             SET RANK = ?, FIRSTNAME = ?, LASTNAME = ?, MI = ?, DOR = ?, PMOS = ?, BILMOS = ?, BILLET = ?
             WHERE EDIPI = ?
-        ''', (rank, firstname, lastname, mi, dor, pmos, bilmos, edipi, billet))
-        self.conn.commit()
+        ''', (rank, firstname, lastname, mi, dor, pmos, bilmos, billet, edipi), [edipi])
 
     def delete_user(self, edipi):
         """Delete a user by EDIPI."""
-        self.cursor.execute('''
+        self._write_roster('''
             DELETE FROM roster
             WHERE EDIPI = ?
-        ''', (edipi,))
-        self.conn.commit()
+        ''', (edipi,), [edipi])
+
+    def upsert_users(self, rows):
+        """
+        Insert or update many users in one transaction.
+        rows is a list of (rank, firstname, lastname, mi, edipi, dor, pmos, bilmos, billet) tuples.
+        Returns a list of (index, error message) for rows the database rejected;
+        every other row is written.
+        """
+        sql = '''
+            INSERT INTO roster (RANK, FIRSTNAME, LASTNAME, MI, EDIPI, DOR, PMOS, BILMOS, BILLET)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(EDIPI) DO UPDATE SET
+                RANK = excluded.RANK, FIRSTNAME = excluded.FIRSTNAME, LASTNAME = excluded.LASTNAME,
+                MI = excluded.MI, DOR = excluded.DOR, PMOS = excluded.PMOS,
+                BILMOS = excluded.BILMOS, BILLET = excluded.BILLET
+        '''
+
+        edipis = [row[4] for row in rows]
+        stored = []
+
+        def write(cursor):
+            cursor.execute("SAVEPOINT upsert_users")
+            try:
+                cursor.executemany(sql, rows)
+                cursor.execute("RELEASE upsert_users")
+                rejected = []
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK TO upsert_users")
+                cursor.execute("RELEASE upsert_users")
+                # A row failed a constraint; fall back to row-by-row to isolate it.
+                # A failing statement is undone on its own, so the good rows stay.
+                rejected = []
+                for index, row in enumerate(rows):
+                    try:
+                        cursor.execute(sql, row)
+                    except sqlite3.Error as e:
+                        rejected.append((index, str(e)))
+            stored.extend(self._read_back(cursor, edipis))
+            return rejected
+
+        return self.transaction(write, _unchanged, lambda replica: self._refresh(replica, edipis, stored))
+
+    def _roster_replica(self):
+        """The current roster replica snapshot, reloaded from SQLite if it is stale; None when disabled.
+           Callers read only from the returned snapshot, which later writes never change.
+        """
+        if not self.replica:
+            return None
+        version = self.data_version()
+        snapshot = self.replica.lookup(version)
+        if snapshot is not None:
+            return snapshot
+        if self._writes_in_flight:
+            # A write from this process is committing; it patches the replica
+            # when it returns, so serve the pre-write rows rather than reload
+            snapshot = self.replica.snapshot
+            if snapshot is not None:
+                return snapshot
+        with self._replica_lock:
+            # Another thread may have reloaded while this one waited
+            snapshot = self.replica.snapshot
+            if snapshot is None or snapshot.version != version:
+                self.cursor.execute(f'''
+                    SELECT {', '.join(ROSTER_COLUMNS)} FROM roster
+                ''')
+                snapshot = self.replica.load(version, self.cursor.fetchall())
+        return snapshot
+
+    def load_replica(self):
+        """Load the roster replica (if enabled) ahead of the first read."""
+        self._roster_replica()
+
+    def check_replica(self):
+        """Compare the roster replica with the roster table; see RosterReplica.check()."""
+        if not self.replica:
+            return {"enabled": False}
+        self.cursor.execute(f'''
+            SELECT {', '.join(ROSTER_COLUMNS)} FROM roster
+        ''')
+        report = self.replica.check(self.cursor.fetchall())
+        report["enabled"] = True
+        return report
+
+    def batch_users(self, operations, atomic=True):
+        """
+        Apply many roster changes in order, in one transaction.
+        operations is a list of (index, op, edipi, {COLUMN: value}) with op 'insert'
+        (all columns), 'update' (only the given columns) or 'delete'. Consecutive
+        operations of the same shape run as one executemany().
+
+        Returns {"inserted": n, "updated": n, "deleted": n, "errors": [{"index", "edipi", "error"}]}.
+        With atomic=True the first failing operation rolls back the whole batch and
+        BatchAborted is raised; otherwise failing operations are skipped.
+        """
+        for _, _, _, values in operations:
+            unknown = set(values) - set(ROSTER_COLUMNS)
+            if unknown:
+                raise ValueError(f"Unknown roster columns: {', '.join(sorted(unknown))}")
+        edipis = list(dict.fromkeys(edipi for _, _, edipi, _ in operations))
+        stored = []
+
+        def statement(op, columns):
+            if op == 'insert':
+                return f'''
+                    INSERT INTO roster (EDIPI, {', '.join(columns)})
+                    VALUES (?, {', '.join('?' * len(columns))})
+                '''
+            if op == 'update':
+                return f'''
+                    UPDATE roster
+                    SET {', '.join(column + ' = ?' for column in columns)}
+                    WHERE EDIPI = ?
+                '''
+            return '''
+                DELETE FROM roster
+                WHERE EDIPI = ?
+            '''
+
+        def params(op, edipi, values, columns):
+            if op == 'insert':
+                return (edipi, *(values[column] for column in columns))
+            if op == 'update':
+                return (*(values[column] for column in columns), edipi)
+            return (edipi,)
+
+        def write(cursor):
+            existing = set()
+            for start in range(0, len(edipis), 500):
+                chunk = edipis[start:start + 500]
+                cursor.execute(f'''
+                    SELECT EDIPI FROM roster
+                    WHERE EDIPI IN ({', '.join('?' * len(chunk))})
+                ''', chunk)
+                existing.update(row[0] for row in cursor.fetchall())
+            summary = {"inserted": 0, "updated": 0, "deleted": 0, "errors": []}
+            counter = {'insert': 'inserted', 'update': 'updated', 'delete': 'deleted'}
+
+            def fail(index, edipi, message):
+                summary["errors"].append({"index": index, "edipi": edipi, "error": message})
+                if atomic:
+                    raise BatchAborted(summary["errors"])
+
+            def check(op, edipi):
+                """Validate one operation against `existing` and record its effect there."""
+                if op == 'insert' and edipi in existing:
+                    return "User already exists"
+                if op != 'insert' and edipi not in existing:
+                    return "User not found"
+                if op == 'delete':
+                    existing.discard(edipi)
+                else:
+                    existing.add(edipi)
+                return None
+
+            shape = lambda operation: (operation[1], tuple(sorted(operation[3])))
+            for (op, columns), group in itertools.groupby(operations, key=shape):
+                group = list(group)
+                sql = statement(op, columns)
+                before = set(existing)
+                rows = []
+                for index, _, edipi, values in group:
+                    problem = check(op, edipi)
+                    if problem:
+                        fail(index, edipi, problem)
+                    else:
+                        rows.append(params(op, edipi, values, columns))
+                cursor.execute("SAVEPOINT batch_users")
+                try:
+                    cursor.executemany(sql, rows)
+                    cursor.execute("RELEASE batch_users")
+                    summary[counter[op]] += len(rows)
+                    continue
+                except sqlite3.Error:
+                    cursor.execute("ROLLBACK TO batch_users")
+                    cursor.execute("RELEASE batch_users")
+                # A row broke a constraint; replay the group one operation at a time
+                # to find it. A failing statement is undone on its own.
+                existing.clear()
+                existing.update(before)
+                summary["errors"] = [error for error in summary["errors"]
+                                     if error["index"] not in {operation[0] for operation in group}]
+                for index, _, edipi, values in group:
+                    problem = check(op, edipi)
+                    if problem:
+                        fail(index, edipi, problem)
+                        continue
+                    try:
+                        cursor.execute(sql, params(op, edipi, values, columns))
+                        summary[counter[op]] += 1
+                    except sqlite3.Error as e:
+                        # Undo the effect check() recorded
+                        if op == 'delete':
+                            existing.add(edipi)
+                        elif op == 'insert':
+                            existing.discard(edipi)
+                        fail(index, edipi, str(e))
+            stored.extend(self._read_back(cursor, edipis))
+            return summary
+
+        return self.transaction(write, _unchanged, lambda replica: self._refresh(replica, edipis, stored))
 
     def get_user_by_edipi(self, edipi):
         """Get a user by EDIPI, return as dictionary."""
         edipi = str(edipi)
+        replica = self._roster_replica()
+        if replica:
+            row = replica.get(edipi)
+            return row.as_dict() if row else None
         self.cursor.execute('''
             SELECT * FROM roster
             WHERE EDIPI = ?
@@ -76,8 +569,41 @@ class Database:
         row = self.cursor.fetchone()
         return dict(row) if row else None
 
+    def get_counseling_rows(self, edipi, senior_edipi=None):
+        """Everything a counseling needs in one lookup: (marine, senior, marine's mos row).
+           Each is a dictionary, or None if not found. Without the replica, both roster
+           rows and the MOS description come from a single joined query.
+        """
+        edipi = str(edipi)
+        senior_edipi = str(senior_edipi) if senior_edipi else None
+        replica = self._roster_replica()
+        if replica:
+            marine = replica.get(edipi)
+            senior = replica.get(senior_edipi) if senior_edipi else None
+            marine = marine.as_dict() if marine else None
+            senior = senior.as_dict() if senior else None
+            mos = self.get_mos_desc_by_bilmos(marine['BILMOS']) if marine else None
+            return marine, senior, mos
+        self.cursor.execute('''
+            SELECT roster.*, mos.BILMOS AS MOS_BILMOS, mos.DESCRIPTION AS MOS_DESCRIPTION
+            FROM roster
+            LEFT JOIN mos ON mos.BILMOS = roster.BILMOS
+            WHERE roster.EDIPI IN (?, ?)
+        ''', (edipi, senior_edipi or edipi))
+        rows = {}
+        mos = {}
+        for row in self.cursor.fetchall():
+            row = dict(row)
+            bilmos, description = row.pop('MOS_BILMOS'), row.pop('MOS_DESCRIPTION')
+            rows[row['EDIPI']] = row
+            mos[row['EDIPI']] = {'BILMOS': bilmos, 'DESCRIPTION': description} if bilmos is not None else None
+        return rows.get(edipi), rows.get(senior_edipi) if senior_edipi else None, mos.get(edipi)
+
     def get_all_roster(self):
         """Get all roster, return as list of dictionaries."""
+        replica = self._roster_replica()
+        if replica:
+            return [row.as_dict() for row in replica.all()]
         self.cursor.execute('''
             SELECT * FROM roster
         ''')
@@ -86,6 +612,9 @@ class Database:
 
     def get_all_roster_by_rank(self, rank):
         """Get all roster by RANK, return as list of dictionaries."""
+        replica = self._roster_replica()
+        if replica:
+            return [row.as_dict() for row in replica.by('RANK', rank)]
         self.cursor.execute('''
             SELECT * FROM roster
             WHERE RANK = ?
@@ -96,6 +625,9 @@ class Database:
     def get_all_roster_by_mos(self, bilmos):
         """Get all roster by BILMOS, return as list of dictionaries."""
         bilmos = str(bilmos)
+        replica = self._roster_replica()
+        if replica:
+            return [row.as_dict() for row in replica.by('BILMOS', bilmos)]
         self.cursor.execute('''
             SELECT * FROM roster
             WHERE BILMOS = ?
@@ -103,50 +635,161 @@ class Database:
         rows = self.cursor.fetchall()
         return [dict(row) for row in rows]
 
+    def query_roster(self, query):
+        """Get all roster rows matching a RosterQuery, return as list of dictionaries."""
+        replica = self._roster_replica()
+        if replica:
+            return [row.as_dict() for row in replica.select(query)]
+        sql, params = query.compile()
+        self.cursor.execute(sql, params)
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def roster_rows(self, query, limit=None):
+        """Get roster rows matching a RosterQuery as tuples in ROSTER_COLUMNS order,
+           without building a dictionary per row. `limit` overrides query.limit.
+        """
+        replica = self._roster_replica()
+        if replica:
+            return replica.select(query, limit=limit)
+        sql, params = query.compile(limit=limit)
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        try:
+            return cursor.execute(sql, params).fetchall()
+        finally:
+            cursor.close()
+
+    def get_roster_page(self, query, columnar=False):
+        """Get one page of a RosterQuery (limit defaults to 100).
+           Returns (rows, next cursor or None) where the cursor is {"after": <last EDIPI>}
+           for the default order or {"offset": <n>} for custom sorts. Rows are dictionaries,
+           or tuples in ROSTER_COLUMNS order with columnar=True.
+        """
+        limit = query.limit or 100
+        rows = self.roster_rows(query, limit=limit + 1)
+        if len(rows) <= limit:
+            next_page = None
+        else:
+            rows = rows[:limit]
+            if query.sort:
+                next_page = {"offset": (query.offset or 0) + limit}
+            else:
+                next_page = {"after": rows[-1][ROSTER_COLUMNS.index('EDIPI')]}
+        if not columnar:
+            rows = [dict(zip(ROSTER_COLUMNS, row)) for row in rows]
+        return rows, next_page
+
+    def iter_roster(self, query, batch_size=500):
+        """Yield roster rows matching a RosterQuery as dictionaries, fetching `batch_size` rows at a time."""
+        replica = self._roster_replica()
+        if replica:
+            for row in replica.select(query):
+                yield row.as_dict()
+            return
+        sql, params = query.compile()
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(row)
+        finally:
+            cursor.close()
+
+    def explain_roster(self, query):
+        """Return the compiled SQL, its parameters and SQLite's EXPLAIN QUERY PLAN for a RosterQuery."""
+        sql, params = query.compile()
+        self.cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        plan = [row[3] for row in self.cursor.fetchall()]
+        return {"sql": sql, "params": params, "plan": plan}
+
+    def search_roster(self, text, limit=20):
+        """Full-text search of names and billets, best matches first.
+           Every word must match the start of a word in FIRSTNAME, LASTNAME, MI or BILLET,
+           so "smi squad" finds SMITH, Squad Leader. Returns at most `limit` rows as a list
+           of dictionaries.
+
+           Every match is ranked, so a one-letter prefix on a large roster costs more than
+           a longer one; the type-ahead gets faster as the user types.
+        """
+        terms = re.findall(r'\w+', text)
+        if not terms:
+            return []
+        # Quote each word so FTS5 syntax characters in user input are taken literally
+        match = ' '.join('"' + term + '"*' for term in terms)
+        # ORDER BY rank is sorted inside FTS5, cheaper than ordering on a bm25() column
+        self.cursor.execute('''
+            SELECT roster.* FROM (
+                SELECT rowid, rank FROM roster_fts
+                WHERE roster_fts MATCH ? AND rank MATCH 'bm25(5.0, 10.0, 1.0, 2.0)'
+                ORDER BY rank
+                LIMIT ?
+            ) AS hits
+            JOIN roster ON roster.rowid = hits.rowid
+            ORDER BY hits.rank
+        ''', (match, limit))
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def rebuild_search_index(self):
+        """Rebuild roster_fts from roster (needed if roster rowids change, e.g. after VACUUM)."""
+        self._write("INSERT INTO roster_fts (roster_fts) VALUES ('rebuild')")
+
     def insert_mos_desc(self, bilmos, description):
         """Insert a new mos description into the mos table."""
         bilmos = str(bilmos)
-        self.cursor.execute('''
+        row = {'BILMOS': bilmos, 'DESCRIPTION': description}
+        self._write('''
             INSERT INTO mos (BILMOS, DESCRIPTION)
             VALUES (?, ?)
-        ''', (bilmos, description))
-        self.conn.commit()
+        ''', (bilmos, description), mos=lambda rows: rows.__setitem__(bilmos, row))
 
     def update_mos_desc(self, bilmos, description):
         """Update a mos description by BILMOS."""
         bilmos = str(bilmos)
-        self.cursor.execute('''
+        def update(rows):
+            if bilmos in rows:
+                rows[bilmos] = {'BILMOS': bilmos, 'DESCRIPTION': description}
+
+        self._write('''
             UPDATE mos
             SET DESCRIPTION = ?
             WHERE BILMOS = ?
-        ''', (description, bilmos))
-        self.conn.commit()
+        ''', (description, bilmos), mos=update)
 
     def delete_mos_desc(self, bilmos):
         """Delete a mos description by BILMOS."""
         bilmos = str(bilmos)
-        self.cursor.execute('''
+        self._write('''
             DELETE FROM mos
             WHERE BILMOS = ?
-        ''', (bilmos,))
-        self.conn.commit()
+        ''', (bilmos,), mos=lambda rows: rows.pop(bilmos, None))
+
+    def _mos_rows(self):
+        """The cached {BILMOS: row} mapping, reloaded from the mos table when stale."""
+        version = self.data_version()
+        rows = self.mos_cache.lookup(version)
+        if rows is None:
+            self.cursor.execute('''
+                SELECT * FROM mos
+            ''')
+            rows = self.mos_cache.load(version, [dict(row) for row in self.cursor.fetchall()])
+        return rows
+
+    def load_mos_cache(self):
+        """Load the mos table into the MOS cache."""
+        self._mos_rows()
 
     def get_mos_desc_by_bilmos(self, bilmos):
         """Get MOS description by BILMOS, return as dictionary."""
-        bilmos = str(bilmos)
-        self.cursor.execute('''
-            SELECT * FROM mos
-            WHERE BILMOS = ?
-        ''', (bilmos,))
-        row = self.cursor.fetchone()
+        row = self._mos_rows().get(str(bilmos))
         return dict(row) if row else None
 
     def get_all_mos_desc(self):
         """Get all mos descriptions, return as list of dictionaries."""
-        self.cursor.execute('''
-            SELECT * FROM mos
-        ''')
-        return [dict(row) for row in self.cursor.fetchall()]
+        return [dict(row) for row in self._mos_rows().values()]
 
     def get_all_tables(self):
         """Get all tables in the database.
@@ -162,14 +805,13 @@ class Database:
             SELECT NAME FROM sqlite_master 
             WHERE TYPE = 'table'
             AND NAME NOT LIKE 'sqlite_%'
+            AND NAME NOT LIKE 'roster_fts_%'
         ''')
         tables = [row[0] for row in self.cursor.fetchall()]
         return {"tables": tables}
 
     def run_query(self, query):
         """
-        Runs any query on the database.
+        Runs any query on the database. Writes are committed.
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        return [dict(row) for row in rows]
\ No newline at end of file
+        return self.transaction(lambda cursor: [dict(row) for row in cursor.execute(query).fetchall()])
\ No newline at end of file
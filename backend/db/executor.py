@@ -0,0 +1,200 @@
+import re
+import sqlite3
+import time
+
+# Authorizer actions a statement may need without writing anything
+READ_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+# Pragmas that take an argument but only report on the schema
+READ_PRAGMAS = {
+    'table_info', 'table_xinfo', 'table_list', 'index_list', 'index_info', 'index_xinfo',
+    'foreign_key_list', 'foreign_key_check', 'integrity_check', 'quick_check',
+}
+# String literals, quoted identifiers and comments; matched together so '--'
+# or '/*' inside a string is not taken for a comment
+_TOKENS = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\]|--[^\n]*|/\*.*?(?:\*/|\Z)""", re.S)
+
+
+class QueryBudgetExceeded(sqlite3.OperationalError):
+    """Raised when ad-hoc SQL runs past its time or VM-step budget."""
+
+
+class ReadOnlyViolation(sqlite3.OperationalError):
+    """Raised when a statement would write but read-only execution was requested."""
+
+
+class Budget:
+    """
+    Wall-clock and VM-step allowance shared by every statement of one request,
+    enforced through a connection's progress handler.
+    """
+
+    def __init__(self, timeout, max_steps, check_interval=10000):
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.check_interval = check_interval
+        self.deadline = time.monotonic() + timeout
+        self.steps = 0
+        self.exceeded = None
+
+    def _progress(self):
+        self.steps += self.check_interval
+        if self.steps > self.max_steps:
+            self.exceeded = f"Query exceeded its budget of {self.max_steps} VM steps"
+        elif time.monotonic() > self.deadline:
+            self.exceeded = f"Query exceeded its time budget of {self.timeout}s"
+        return 1 if self.exceeded else 0
+
+    def check(self):
+        """Raise QueryBudgetExceeded if the budget is already spent."""
+        if not self.exceeded and time.monotonic() > self.deadline:
+            self.exceeded = f"Query exceeded its time budget of {self.timeout}s"
+        if self.exceeded:
+            raise QueryBudgetExceeded(self.exceeded)
+
+    def run(self, conn, fn):
+        """Call fn() with the budget enforced on `conn`; SQLite interrupts become QueryBudgetExceeded."""
+        self.check()
+        conn.set_progress_handler(self._progress, self.check_interval)
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if self.exceeded and not isinstance(e, QueryBudgetExceeded):
+                raise QueryBudgetExceeded(self.exceeded) from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+
+def strip_comments(sql):
+    """Return `sql` with every comment replaced by a space."""
+    return _TOKENS.sub(lambda match: ' ' if match.group().startswith(('--', '/*')) else match.group(), sql)
+
+
+def leading_keyword(sql):
+    """The first keyword of a statement in upper case (SELECT, WITH, EXPLAIN, ...), or ''."""
+    match = re.match(r'\s*(\w+)', strip_comments(sql))
+    return match.group(1).upper() if match else ''
+
+
+def split_statements(text):
+    """
+    Split SQL text into single statements. Semicolons only end a statement
+    where SQLite agrees it is complete, so ';' inside string literals,
+    comments and trigger bodies is left alone. Pieces holding nothing but
+    comments (e.g. a trailing "-- note") are dropped.
+    """
+    statements = []
+    buffer = ''
+    pieces = text.split(';')
+    for i, piece in enumerate(pieces):
+        buffer += piece
+        if i < len(pieces) - 1:
+            buffer += ';'
+            if not sqlite3.complete_statement(buffer):
+                continue
+        elif not buffer.strip():
+            break
+        statement = buffer.strip()
+        buffer = ''
+        if strip_comments(statement).strip().rstrip(';').strip():
+            statements.append(statement)
+    return statements
+
+
+def is_read_only(conn, sql):
+    """Compile (without running) `sql` and report whether it only reads.
+       EXPLAIN statements never run what they explain, so they always only read.
+    """
+    if leading_keyword(sql) == 'EXPLAIN':
+        return True
+    writes = []
+
+    def authorize(action, arg1, arg2, db_name, trigger):
+        if action == sqlite3.SQLITE_PRAGMA:
+            if arg2 is not None and arg1.lower() not in READ_PRAGMAS:
+                writes.append(action)
+        elif action not in READ_ACTIONS:
+            writes.append(action)
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorize)
+    try:
+        conn.execute("EXPLAIN " + sql).close()
+    finally:
+        conn.set_authorizer(None)
+    return not writes
+
+
+class QueryExecutor:
+    """
+    Runs ad-hoc SQL against a Database with limits, so one bad statement can't
+    exhaust memory or hold a worker indefinitely:
+
+        max_rows    rows kept per statement; further rows are not fetched and the
+                    result is flagged truncated
+        timeout     wall-clock seconds for the whole request
+        max_steps   SQLite VM instructions for the whole request
+
+    Statements that only read run on the calling thread's pooled connection.
+    Statements that write are committed one by one through Database.transaction()
+    (the writer thread with the 'wal' engine), unless read_only is requested, in
+    which case they are rejected before they run.
+    """
+
+    def __init__(self, db, max_rows=10000, timeout=5.0, max_steps=200_000_000, check_interval=10000):
+        self.db = db
+        self.max_rows = max_rows
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.check_interval = check_interval
+
+    def run(self, text, read_only=False, max_rows=None, timeout=None, max_steps=None):
+        """
+        Execute every statement in `text` in order, stopping at the first error.
+        Returns one dict per statement attempted:
+            {"statement": "...", "read_only": true, "rows": [...], "row_count": 2,
+             "truncated": false, "changes": 0, "ms": 0.41}
+        A failed statement has "error" instead of rows, and "rejected": true if it
+        was stopped by a limit (budget or read_only) rather than by SQLite.
+        """
+        max_rows = self.max_rows if max_rows is None else max_rows
+        timeout = self.timeout if timeout is None else timeout
+        max_steps = self.max_steps if max_steps is None else max_steps
+        budget = Budget(timeout, max_steps, self.check_interval)
+
+        def execute(cursor, sql):
+            def fetch():
+                cursor.execute(sql)
+                rows = cursor.fetchmany(max_rows + 1)
+                truncated = len(rows) > max_rows
+                return [dict(row) for row in rows[:max_rows]], truncated, max(cursor.rowcount, 0)
+            return budget.run(cursor.connection, fetch)
+
+        results = []
+        for sql in split_statements(text):
+            result = {"statement": sql}
+            results.append(result)
+            started = time.perf_counter()
+            try:
+                budget.check()
+                reads_only = is_read_only(self.db.conn, sql)
+                result["read_only"] = reads_only
+                if reads_only:
+                    cursor = self.db.conn.cursor()
+                    try:
+                        rows, truncated, changes = execute(cursor, sql)
+                    finally:
+                        cursor.close()
+                elif read_only:
+                    raise ReadOnlyViolation("Statement would modify the database but read_only was requested")
+                else:
+                    rows, truncated, changes = self.db.transaction(lambda cursor: execute(cursor, sql))
+                result.update(rows=rows, row_count=len(rows), truncated=truncated, changes=changes)
+            except sqlite3.Error as e:
+                result["error"] = str(e)
+                if isinstance(e, (QueryBudgetExceeded, ReadOnlyViolation)):
+                    result["rejected"] = True
+                break
+            finally:
+                result["ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return results
@@ -0,0 +1,144 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection became available in time."""
+
+
+class ConnectionPool:
+    """
+    Bounded pool of reusable sqlite3 connections.
+
+    Connections are opened lazily up to `max_size`, configured once by the
+    `on_connect` callback, and handed out with checkout()/checkin(). Idle
+    connections are pinged before reuse once they have been idle longer than
+    `health_check_interval` seconds. `factory` is the sqlite3.Connection class to open.
+    """
+
+    def __init__(self, path, max_size=5, timeout=30.0, health_check_interval=30.0, on_connect=None,
+                 factory=sqlite3.Connection):
+        self.path = path
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.on_connect = on_connect
+        self._idle = deque()  # (connection, last_used)
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "checkins": 0,
+            "hits": 0,
+            "misses": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+            "discarded": 0,
+        }
+
+    def _open(self):
+        """Open and configure a new connection."""
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=self.factory)
+        if self.on_connect:
+            self.on_connect(conn)
+        return conn
+
+    def _healthy(self, conn, last_used):
+        """Ping a connection that has been idle for a while."""
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        self._stats["discarded"] += 1
+        self._size -= 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def checkout(self):
+        """Take a connection from the pool, opening one if the pool is not full."""
+        deadline = None
+        with self._cond:
+            while True:
+                while self._idle:
+                    conn, last_used = self._idle.pop()
+                    if self._healthy(conn, last_used):
+                        self._stats["checkouts"] += 1
+                        self._stats["hits"] += 1
+                        return conn
+                    self._discard(conn)
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                # Pool exhausted, wait for a checkin
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.timeout
+                    self._stats["waits"] += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"Timed out after {self.timeout}s waiting for a database connection")
+                started = time.monotonic()
+                self._cond.wait(remaining)
+                self._stats["wait_time"] += time.monotonic() - started
+        # Open outside the lock so slow opens don't block other checkins
+        try:
+            conn = self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats["checkouts"] += 1
+            self._stats["misses"] += 1
+        return conn
+
+    def checkin(self, conn):
+        """Return a connection to the pool, rolling back any open transaction."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            healthy = True
+        except sqlite3.Error:
+            healthy = False
+        with self._cond:
+            self._stats["checkins"] += 1
+            if healthy:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+            self._cond.notify()
+
+    def close_all(self):
+        """Close every idle connection."""
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+
+    def stats(self):
+        """Return pool-level counters and the connection hit rate."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["max_size"] = self.max_size
+        stats["hit_rate"] = stats["hits"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
@@ -0,0 +1,127 @@
+ROSTER_COLUMNS = ('RANK', 'FIRSTNAME', 'LASTNAME', 'MI', 'EDIPI', 'DOR', 'PMOS', 'BILMOS', 'BILLET')
+
+MAX_PAGE_SIZE = 1000
+
+
+def _split(values):
+    """Flatten repeated and comma separated query values: ['PFC,LCPL', 'CPL'] -> ['PFC', 'LCPL', 'CPL']."""
+    return [v.strip() for value in values for v in value.split(',') if v.strip()]
+
+
+class RosterQuery:
+    """
+    Composable roster filter and sort, compiled into one parameterized SELECT.
+
+    Every filter is optional and they are ANDed together. Results are ordered
+    by `sort` (column names, '-' prefix for descending) with EDIPI as the final
+    tie-breaker so paging is stable. Keyset paging with `after` is only
+    available for the default EDIPI order; custom sorts page with `offset`.
+    """
+
+    def __init__(self, ranks=None, bilmos=None, pmos=None, dor_from=None, dor_to=None,
+                 has_billet=None, sort=None, after=None, limit=None, offset=None):
+        self.ranks = [r.upper() for r in ranks] if ranks else None
+        self.bilmos = [str(b) for b in bilmos] if bilmos else None
+        self.pmos = [str(p) for p in pmos] if pmos else None
+        self.dor_from = dor_from
+        self.dor_to = dor_to
+        self.has_billet = has_billet
+        self.sort = []
+        for key in sort or []:
+            column = key.lstrip('+-').upper()
+            if column not in ROSTER_COLUMNS:
+                raise ValueError(f"Cannot sort by {key}; expected one of {', '.join(ROSTER_COLUMNS)}")
+            self.sort.append((column, 'DESC' if key.startswith('-') else 'ASC'))
+        if self.sort and after is not None:
+            raise ValueError("after can only be used with the default EDIPI order; use offset with sort")
+        if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        if offset is not None and offset < 0:
+            raise ValueError("offset must not be negative")
+        self.after = after
+        self.limit = limit
+        self.offset = offset
+
+    @classmethod
+    def from_args(cls, args, **fixed):
+        """
+        Build a query from request arguments:
+            rank, bilmos, pmos   one or more values (repeated or comma separated)
+            dor_from, dor_to     inclusive DOR range (YYYYMMDD)
+            billet               true/false - only Marines with/without a billet
+            sort                 e.g. sort=RANK,-DOR
+            after, limit, offset paging
+        `fixed` overrides arguments that come from the URL path.
+        """
+        def integer(name):
+            value = args.get(name)
+            if value in (None, ''):
+                return None
+            try:
+                return int(value)
+            except ValueError:
+                raise ValueError(f"{name} must be an integer")
+
+        billet = args.get('billet')
+        if billet not in (None, ''):
+            if billet.lower() not in ('true', 'false', '1', '0'):
+                raise ValueError("billet must be true or false")
+            billet = billet.lower() in ('true', '1')
+        else:
+            billet = None
+        options = {
+            'ranks': _split(args.getlist('rank')) or None,
+            'bilmos': _split(args.getlist('bilmos')) or None,
+            'pmos': _split(args.getlist('pmos')) or None,
+            'dor_from': integer('dor_from'),
+            'dor_to': integer('dor_to'),
+            'has_billet': billet,
+            'sort': _split(args.getlist('sort')) or None,
+            'after': args.get('after') or None,
+            'limit': integer('limit'),
+            'offset': integer('offset'),
+        }
+        options.update(fixed)
+        return cls(**options)
+
+    @property
+    def paged(self):
+        return self.after is not None or self.limit is not None or self.offset is not None
+
+    def compile(self, limit=None):
+        """Return (sql, params). `limit` overrides self.limit (used to peek one row ahead)."""
+        clauses = []
+        params = []
+        for column, values in (('RANK', self.ranks), ('BILMOS', self.bilmos), ('PMOS', self.pmos)):
+            if values:
+                clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        if self.dor_from is not None:
+            clauses.append("DOR >= ?")
+            params.append(self.dor_from)
+        if self.dor_to is not None:
+            clauses.append("DOR <= ?")
+            params.append(self.dor_to)
+        if self.has_billet is True:
+            clauses.append("BILLET IS NOT NULL AND BILLET != ''")
+        elif self.has_billet is False:
+            clauses.append("(BILLET IS NULL OR BILLET = '')")
+        if self.after is not None:
+            clauses.append("EDIPI > ?")
+            params.append(str(self.after))
+        # Explicit columns so tuple rows always come back in ROSTER_COLUMNS order
+        sql = f"SELECT {', '.join(ROSTER_COLUMNS)} FROM roster"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        order = [f"{column} {direction}" for column, direction in self.sort]
+        if 'EDIPI' not in dict(self.sort):
+            order.append("EDIPI ASC")
+        sql += " ORDER BY " + ", ".join(order)
+        limit = self.limit if limit is None else limit
+        if limit is not None or self.offset:
+            sql += " LIMIT ?"
+            params.append(limit if limit is not None else -1)
+            if self.offset:
+                sql += " OFFSET ?"
+                params.append(self.offset)
+        return sql, params
@@ -0,0 +1,347 @@
+import heapq
+import itertools
+import threading
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+
+from db.query import ROSTER_COLUMNS
+
+EDIPI = ROSTER_COLUMNS.index('EDIPI')
+INDEXED_COLUMNS = ('RANK', 'BILMOS')
+
+
+class RosterRow(tuple):
+    """One roster row as a plain tuple in ROSTER_COLUMNS order, with named accessors."""
+
+    __slots__ = ()
+
+    def as_dict(self):
+        return dict(zip(ROSTER_COLUMNS, self))
+
+
+for _position, _column in enumerate(ROSTER_COLUMNS):
+    setattr(RosterRow, _column, property(itemgetter(_position)))
+
+
+def _sort_value(value):
+    """Order values across types the way SQLite does: NULL, then numbers, then text."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, value)
+
+
+def _order(rows, sort, count=None):
+    """
+    Sort `rows` (already in EDIPI order, the final tie-breaker) by `sort`, a list of
+    (column, 'ASC'|'DESC'), keeping the first `count` rows when given. Compares the
+    raw values first and falls back to SQLite's cross-type order if they don't compare.
+    """
+    positions = [ROSTER_COLUMNS.index(column) for column, _ in sort]
+    descending = [direction == 'DESC' for _, direction in sort]
+    for cross_type in (False, True):
+        if cross_type:
+            def key_for(*positions):
+                return lambda row: tuple(_sort_value(row[position]) for position in positions)
+        else:
+            def key_for(*positions):
+                return itemgetter(*positions)
+        try:
+            if len(set(descending)) == 1:
+                # One direction: a single stable pass, or a heap when only the top is needed
+                key = key_for(*positions)
+                if count is not None:
+                    select = heapq.nlargest if descending[0] else heapq.nsmallest
+                    return select(count, rows, key=key)
+                return sorted(rows, key=key, reverse=descending[0])
+            # Mixed directions: stable sorts from the last key to the first
+            ordered = rows
+            for position, reverse in reversed(list(zip(positions, descending))):
+                ordered = sorted(ordered, key=key_for(position), reverse=reverse)
+            return ordered[:count] if count is not None else ordered
+        except TypeError:
+            continue
+
+
+class RosterSnapshot:
+    """
+    One version of the roster: rows keyed by EDIPI, the EDIPI-sorted key list
+    and the per-column indexes, stamped with the data version they hold.
+    A published snapshot is never modified, so readers use it without locking
+    while writes publish newer ones.
+    """
+
+    __slots__ = ('rows', 'edipis', 'indexes', 'version')
+
+    def __init__(self, rows, edipis, indexes, version):
+        self.rows = rows
+        self.edipis = edipis
+        self.indexes = indexes
+        self.version = version
+
+    def get(self, edipi):
+        return self.rows.get(edipi)
+
+    def all(self):
+        """Every row, in table (insertion) order like SELECT * FROM roster."""
+        return list(self.rows.values())
+
+    def by(self, column, value):
+        """Rows whose indexed `column` equals `value`, in EDIPI order."""
+        rows = self.rows
+        return [rows[edipi] for edipi in self.indexes[column].get(value, ())]
+
+    def select(self, query, limit=None):
+        """Rows matching a RosterQuery, filtered, sorted and sliced like its compiled SQL.
+           `limit` overrides query.limit, as in RosterQuery.compile().
+        """
+        limit = query.limit if limit is None else limit
+        if query.ranks:
+            candidates = [self.indexes['RANK'].get(rank, []) for rank in set(query.ranks)]
+        elif query.bilmos:
+            candidates = [self.indexes['BILMOS'].get(bilmos, []) for bilmos in set(query.bilmos)]
+        else:
+            candidates = [self.edipis]
+        if query.after is not None:
+            after = str(query.after)
+            candidates = [keys[bisect_right(keys, after):] for keys in candidates]
+        edipis = candidates[0] if len(candidates) == 1 else heapq.merge(*candidates)
+
+        checks = []
+        for column, values in (('RANK', query.ranks), ('BILMOS', query.bilmos), ('PMOS', query.pmos)):
+            if values:
+                position = ROSTER_COLUMNS.index(column)
+                checks.append(lambda row, position=position, values=set(values): row[position] in values)
+        if query.dor_from is not None or query.dor_to is not None:
+            dor = ROSTER_COLUMNS.index('DOR')
+            low = _sort_value(query.dor_from) if query.dor_from is not None else (1, float('-inf'))
+            high = _sort_value(query.dor_to) if query.dor_to is not None else (3, 0)
+            # NULL never satisfies a comparison
+            checks.append(lambda row: row[dor] is not None and low <= _sort_value(row[dor]) <= high)
+        if query.has_billet is not None:
+            billet = ROSTER_COLUMNS.index('BILLET')
+            checks.append(lambda row: bool(row[billet]) == query.has_billet)
+
+        rows = self.rows
+        matches = (rows[edipi] for edipi in edipis)
+        if checks:
+            matches = (row for row in matches if all(check(row) for check in checks))
+        # Without a custom sort the candidates are already in EDIPI order,
+        # so a page can stop as soon as it is full
+        if not query.sort and limit is not None:
+            matches = itertools.islice(matches, (query.offset or 0) + limit)
+        matches = list(matches)
+
+        start = query.offset or 0
+        if query.sort:
+            matches = _order(matches, query.sort, start + limit if limit is not None else None)
+        end = start + limit if limit is not None else None
+        return matches[start:end]
+
+
+class _Draft:
+    """
+    The next snapshot while a write is applied to it. Starts from shallow copies
+    of the current one and copies the key lists it changes, so the published
+    snapshot readers may still hold is left as it was.
+    """
+
+    def __init__(self, snapshot):
+        self.rows = dict(snapshot.rows)
+        self.edipis = snapshot.edipis
+        self.indexes = {column: dict(index) for column, index in snapshot.indexes.items()}
+        self._copied_edipis = False
+        self._copied_keys = set()
+        self.writes = 0
+
+    def _edipis(self):
+        if not self._copied_edipis:
+            self.edipis = list(self.edipis)
+            self._copied_edipis = True
+        return self.edipis
+
+    def _keys(self, column, value):
+        index = self.indexes[column]
+        if (column, value) not in self._copied_keys:
+            index[value] = list(index.get(value, ()))
+            self._copied_keys.add((column, value))
+        return index[value]
+
+    def put(self, rows):
+        """Insert or replace rows (value tuples in ROSTER_COLUMNS order)."""
+        for values in rows:
+            row = RosterRow(values)
+            edipi = row[EDIPI]
+            old = self.rows.get(edipi)
+            if old is None:
+                insort(self._edipis(), edipi)
+            for column in INDEXED_COLUMNS:
+                position = ROSTER_COLUMNS.index(column)
+                if old is not None and old[position] == row[position]:
+                    continue
+                if old is not None:
+                    self._unindex(column, old[position], edipi)
+                insort(self._keys(column, row[position]), edipi)
+            self.rows[edipi] = row
+            self.writes += 1
+
+    def remove(self, edipis):
+        for edipi in edipis:
+            old = self.rows.pop(edipi, None)
+            if old is None:
+                continue
+            keys = self._edipis()
+            del keys[bisect_left(keys, edipi)]
+            for column in INDEXED_COLUMNS:
+                self._unindex(column, old[ROSTER_COLUMNS.index(column)], edipi)
+            self.writes += 1
+
+    def _unindex(self, column, value, edipi):
+        keys = self._keys(column, value)
+        del keys[bisect_left(keys, edipi)]
+        if not keys:
+            del self.indexes[column][value]
+            self._copied_keys.discard((column, value))
+
+    def publish(self, version):
+        return RosterSnapshot(self.rows, self.edipis, self.indexes, version)
+
+
+class RosterReplica:
+    """
+    In-memory copy of the roster table.
+
+    Rows live in a dict keyed by EDIPI, with EDIPI-sorted key lists for the
+    whole table and per RANK and BILMOS value, so lookups, filters and keyset
+    pages come back in the same order SQLite's indexes give. Like MosCache,
+    each load is stamped with Database.data_version() and writes made through
+    Database are applied; any other change forces a reload.
+
+    The data is held as a RosterSnapshot. lookup() hands out the current one
+    and writes build and publish a new one instead of changing it, so a reader
+    never sees a write half applied or the replica dropped under it. A write
+    costs a copy of the row dict, which is cheap next to the commit itself.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0, "writes": 0}
+
+    @property
+    def snapshot(self):
+        """The current RosterSnapshot, or None when nothing is loaded."""
+        return self._snapshot
+
+    @property
+    def version(self):
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else None
+
+    def lookup(self, version):
+        """The RosterSnapshot holding the data for `version`, or None."""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                self._stats["hits"] += 1
+                return snapshot
+            self._stats["misses"] += 1
+            return None
+
+    def load(self, version, rows):
+        """Replace the replica with `rows` (value tuples in ROSTER_COLUMNS order) and return the new snapshot."""
+        by_edipi = {}
+        for values in rows:
+            row = RosterRow(values)
+            by_edipi[row[EDIPI]] = row
+        edipis = sorted(by_edipi)
+        indexes = {column: {} for column in INDEXED_COLUMNS}
+        for column in INDEXED_COLUMNS:
+            position = ROSTER_COLUMNS.index(column)
+            index = indexes[column]
+            for edipi in edipis:
+                index.setdefault(by_edipi[edipi][position], []).append(edipi)
+        snapshot = RosterSnapshot(by_edipi, edipis, indexes, version)
+        with self._lock:
+            self._snapshot = snapshot
+            self._stats["loads"] += 1
+        return snapshot
+
+    def apply(self, before, after, change):
+        """
+        Record a write committed between data versions `before` and `after`.
+        change(draft) calls put()/remove() on a draft of the next snapshot to
+        match the write; None means its effect on the roster is unknown and
+        drops the replica. `before` is read under the write lock, so a snapshot
+        missing another process's commit never matches it and is reloaded
+        instead of patched.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                return
+            if change is None or snapshot.version != before:
+                self._drop()
+                return
+            draft = _Draft(snapshot)
+            change(draft)
+            self._snapshot = draft.publish(after)
+            self._stats["writes"] += draft.writes
+
+    def invalidate(self):
+        with self._lock:
+            if self._snapshot is not None:
+                self._drop()
+
+    def _drop(self):
+        # Readers holding the old snapshot finish with it; the next lookup reloads
+        self._snapshot = None
+        self._stats["invalidations"] += 1
+
+    def check(self, rows, max_details=100):
+        """
+        Compare the replica with `rows` read from the database and verify its indexes.
+        Returns counts of missing, extra and differing rows with a sample of EDIPIs.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"loaded": False}
+        replica = snapshot.rows
+        database = {values[EDIPI]: tuple(values) for values in rows}
+        missing = [edipi for edipi in database if edipi not in replica]
+        extra = [edipi for edipi in replica if edipi not in database]
+        different = [edipi for edipi, values in database.items()
+                     if edipi in replica and tuple(replica[edipi]) != values]
+        index_errors = []
+        if snapshot.edipis != sorted(replica):
+            index_errors.append("EDIPI")
+        for column in INDEXED_COLUMNS:
+            position = ROSTER_COLUMNS.index(column)
+            expected = {}
+            for edipi in snapshot.edipis:
+                expected.setdefault(replica[edipi][position], []).append(edipi)
+            if expected != snapshot.indexes[column]:
+                index_errors.append(column)
+        return {
+            "loaded": True,
+            "consistent": not (missing or extra or different or index_errors),
+            "rows": len(replica),
+            "database_rows": len(database),
+            "missing_count": len(missing),
+            "extra_count": len(extra),
+            "different_count": len(different),
+            "missing": missing[:max_details],
+            "extra": extra[:max_details],
+            "different": different[:max_details],
+            "index_errors": index_errors,
+        }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            snapshot = self._snapshot
+        lookups = stats["hits"] + stats["misses"]
+        stats["rows"] = len(snapshot.rows) if snapshot is not None else 0
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        return stats
@@ -0,0 +1,172 @@
+import sqlite3
+
+# Ordered schema migrations. Each step is (version, description, steps) where
+# steps is a list of SQL statements or callables taking the connection.
+# Never edit a released step; append a new one instead.
+
+
+def _add_billet_column(conn):
+    """Databases created before BILLET existed are missing the column."""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(roster)")]
+    if 'BILLET' not in columns:
+        conn.execute("ALTER TABLE roster ADD COLUMN BILLET TEXT")
+
+
+MIGRATIONS = [
+    (1, "Create roster and mos tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS roster (
+            RANK TEXT NOT NULL,
+            FIRSTNAME TEXT NOT NULL,
+            LASTNAME TEXT NOT NULL,
+            MI TEXT,
+            EDIPI CHAR(10) PRIMARY KEY CHECK (LENGTH(EDIPI) = 10 AND EDIPI GLOB '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]'),
+            DOR INTEGER NOT NULL,
+            PMOS CHAR(4) NOT NULL CHECK (LENGTH(PMOS) = 4 AND PMOS GLOB '[0-9][0-9][0-9][0-9]'),
+            BILMOS CHAR(4) NOT NULL CHECK (LENGTH(BILMOS) = 4 AND BILMOS GLOB '[0-9][0-9][0-9][0-9]'),
+            BILLET TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS mos (
+            BILMOS CHAR(4) PRIMARY KEY CHECK (LENGTH(BILMOS) = 4 AND BILMOS GLOB '[0-9][0-9][0-9][0-9]'),
+            DESCRIPTION TEXT NOT NULL,
+            FOREIGN KEY (BILMOS) REFERENCES roster(BILMOS)
+        )
+        ''',
+    ]),
+    (2, "Add roster.BILLET to databases created without it", [
+        _add_billet_column,
+    ]),
+    (3, "Point the foreign key from roster.BILMOS to mos.BILMOS", [
+        '''
+        CREATE TABLE mos_new (
+            BILMOS CHAR(4) PRIMARY KEY CHECK (LENGTH(BILMOS) = 4 AND BILMOS GLOB '[0-9][0-9][0-9][0-9]'),
+            DESCRIPTION TEXT NOT NULL
+        )
+        ''',
+        "INSERT INTO mos_new (BILMOS, DESCRIPTION) SELECT BILMOS, DESCRIPTION FROM mos",
+        "DROP TABLE mos",
+        "ALTER TABLE mos_new RENAME TO mos",
+        '''
+        CREATE TABLE roster_new (
+            RANK TEXT NOT NULL,
+            FIRSTNAME TEXT NOT NULL,
+            LASTNAME TEXT NOT NULL,
+            MI TEXT,
+            EDIPI CHAR(10) PRIMARY KEY CHECK (LENGTH(EDIPI) = 10 AND EDIPI GLOB '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]'),
+            DOR INTEGER NOT NULL,
+            PMOS CHAR(4) NOT NULL CHECK (LENGTH(PMOS) = 4 AND PMOS GLOB '[0-9][0-9][0-9][0-9]'),
+            BILMOS CHAR(4) NOT NULL CHECK (LENGTH(BILMOS) = 4 AND BILMOS GLOB '[0-9][0-9][0-9][0-9]') REFERENCES mos(BILMOS),
+            BILLET TEXT
+        )
+        ''',
+        '''
+        INSERT INTO roster_new (RANK, FIRSTNAME, LASTNAME, MI, EDIPI, DOR, PMOS, BILMOS, BILLET)
+        SELECT RANK, FIRSTNAME, LASTNAME, MI, EDIPI, DOR, PMOS, BILMOS, BILLET FROM roster
+        ''',
+        "DROP TABLE roster",
+        "ALTER TABLE roster_new RENAME TO roster",
+    ]),
+    (4, "Index roster by RANK and BILMOS", [
+        "CREATE INDEX IF NOT EXISTS idx_roster_rank ON roster (RANK)",
+        "CREATE INDEX IF NOT EXISTS idx_roster_bilmos ON roster (BILMOS)",
+    ]),
+    (5, "Extend the RANK and BILMOS indexes with EDIPI for keyset pagination", [
+        # The EDIPI suffix lets filtered pages walk the index in EDIPI order without a sort
+        "CREATE INDEX IF NOT EXISTS idx_roster_rank_edipi ON roster (RANK, EDIPI)",
+        "CREATE INDEX IF NOT EXISTS idx_roster_bilmos_edipi ON roster (BILMOS, EDIPI)",
+        "DROP INDEX IF EXISTS idx_roster_rank",
+        "DROP INDEX IF EXISTS idx_roster_bilmos",
+    ]),
+    (6, "Index roster by PMOS and by (RANK, DOR)", [
+        # RANK and BILMOS lookups use the (RANK, EDIPI) and (BILMOS, EDIPI) prefixes
+        "CREATE INDEX IF NOT EXISTS idx_roster_pmos ON roster (PMOS)",
+        "CREATE INDEX IF NOT EXISTS idx_roster_rank_dor ON roster (RANK, DOR)",
+    ]),
+    (7, "Full-text search over roster names and billets", [
+        # External-content FTS5 table: stores only the index, reads text from roster by rowid.
+        # prefix='1 2 3' keeps short type-ahead prefixes off the slow path.
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS roster_fts USING fts5(
+            FIRSTNAME, LASTNAME, MI, BILLET,
+            content='roster', content_rowid='rowid', prefix='1 2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS roster_fts_insert AFTER INSERT ON roster BEGIN
+            INSERT INTO roster_fts (rowid, FIRSTNAME, LASTNAME, MI, BILLET)
+            VALUES (new.rowid, new.FIRSTNAME, new.LASTNAME, new.MI, new.BILLET);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS roster_fts_delete AFTER DELETE ON roster BEGIN
+            INSERT INTO roster_fts (roster_fts, rowid, FIRSTNAME, LASTNAME, MI, BILLET)
+            VALUES ('delete', old.rowid, old.FIRSTNAME, old.LASTNAME, old.MI, old.BILLET);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS roster_fts_update AFTER UPDATE ON roster BEGIN
+            INSERT INTO roster_fts (roster_fts, rowid, FIRSTNAME, LASTNAME, MI, BILLET)
+            VALUES ('delete', old.rowid, old.FIRSTNAME, old.LASTNAME, old.MI, old.BILLET);
+            INSERT INTO roster_fts (rowid, FIRSTNAME, LASTNAME, MI, BILLET)
+            VALUES (new.rowid, new.FIRSTNAME, new.LASTNAME, new.MI, new.BILLET);
+        END
+        ''',
+        "INSERT INTO roster_fts (roster_fts) VALUES ('rebuild')",
+    ]),
+]
+
+
+def current_version(conn):
+    """Return the highest applied migration version (0 for a fresh database)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            VERSION INTEGER PRIMARY KEY,
+            DESCRIPTION TEXT NOT NULL,
+            APPLIED_AT TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    row = conn.execute("SELECT MAX(VERSION) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(path):
+    """
+    Bring the database at `path` up to the latest schema version.
+    Each pending migration runs in its own transaction and is recorded in
+    schema_version. Returns the list of versions applied.
+    """
+    conn = sqlite3.connect(path, isolation_level=None)
+    applied = []
+    try:
+        # BEGIN IMMEDIATE serializes concurrent bootstraps from several processes
+        conn.execute("BEGIN IMMEDIATE")
+        version = current_version(conn)
+        conn.execute("COMMIT")
+        for step_version, description, steps in MIGRATIONS:
+            if step_version <= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Re-check under the write lock in case another process got here first
+                if current_version(conn) >= step_version:
+                    conn.execute("COMMIT")
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute('''
+                    INSERT INTO schema_version (VERSION, DESCRIPTION)
+                    VALUES (?, ?)
+                ''', (step_version, description))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(step_version)
+    finally:
+        conn.close()
+    return applied
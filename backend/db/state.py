@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import threading
+
+
+class SharedState:
+    """
+    Small SQLite database for server state that every worker process must see,
+    such as open /query cursors and background jobs.
+
+    It lives in its own file, so its writes never change Database.data_version()
+    or invalidate the caches keyed on it. Each thread of each process opens its
+    own autocommit connection on first use, including threads of a process
+    forked after the state was created.
+    """
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path)
+        try:
+            # journal_mode is persistent; WAL keeps readers from blocking writers across workers
+            conn.execute("PRAGMA journal_mode = WAL")
+        finally:
+            conn.close()
+
+    @property
+    def conn(self):
+        """The calling thread's connection, opened on first use in this process."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # A connection inherited through fork belongs to the parent; leave it alone
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def execute(self, sql, params=()):
+        return self.conn.execute(sql, params)
+
+    def create(self, *statements):
+        """Run CREATE ... IF NOT EXISTS statements for a table the caller keeps here."""
+        # On a connection of its own, so a process that forks workers afterwards holds none
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
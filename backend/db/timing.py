@@ -0,0 +1,169 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?\b")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+MAX_STATEMENT_LENGTH = 300
+
+logger = logging.getLogger("db.slow_queries")
+
+
+@lru_cache(maxsize=2048)
+def normalize(sql):
+    """
+    Reduce a statement to its shape so executions group together: comments
+    dropped, literals replaced by ?, IN (?, ?, ...) lists collapsed and
+    whitespace squeezed, cut to MAX_STATEMENT_LENGTH characters.
+    """
+    sql = _COMMENTS.sub(" ", sql)
+    sql = _STRINGS.sub("?", sql)
+    sql = _NUMBERS.sub("?", sql)
+    sql = _LISTS.sub("(?, ...)", sql)
+    sql = _SPACE.sub(" ", sql).strip().rstrip(";").strip()
+    if len(sql) > MAX_STATEMENT_LENGTH:
+        sql = sql[:MAX_STATEMENT_LENGTH - 3] + "..."
+    return sql
+
+
+class SlowQueryLog:
+    """Logs statements slower than `threshold_ms` and keeps the most recent `keep` of them."""
+
+    def __init__(self, threshold_ms, keep=100):
+        self.threshold_ms = threshold_ms
+        self._entries = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, statement, seconds):
+        ms = seconds * 1000
+        if ms < self.threshold_ms:
+            return
+        with self._lock:
+            self.count += 1
+            self._entries.append({"statement": statement, "ms": round(ms, 3), "at": time.time()})
+        logger.warning("Slow query (%.1f ms): %s", ms, statement)
+
+    def entries(self):
+        """Recent slow statements, newest first."""
+        with self._lock:
+            return list(reversed(self._entries))
+
+
+class StatementTimer:
+    """
+    Times every statement run on the connections a Database opens.
+
+    Connections come from connection_class(); their cursors add up the time
+    spent in execute() and in fetching the results, and report the total once
+    the statement is finished with (results exhausted, cursor closed or reused).
+    Each statement is passed through normalize() and handed to every
+    hook(statement, seconds) and to the slow-query log.
+    """
+
+    def __init__(self, slow_query_ms=None):
+        self.hooks = []
+        self.slow_log = SlowQueryLog(slow_query_ms) if slow_query_ms else None
+        self.connection_class = type("TimedConnection", (TimedConnection,), {"timer": self})
+
+    def record(self, sql, seconds):
+        statement = normalize(sql)
+        for hook in self.hooks:
+            hook(statement, seconds)
+        if self.slow_log is not None:
+            self.slow_log.record(statement, seconds)
+
+
+class TimedCursor(sqlite3.Cursor):
+    _sql = None
+    _elapsed = 0.0
+
+    def _finish(self):
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            self.connection.timer.record(sql, self._elapsed)
+
+    def _run(self, sql, call, *args):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            self._sql = sql
+            self._elapsed = time.perf_counter() - started
+            if self.description is None:
+                # Nothing to fetch, the statement is done
+                self._finish()
+
+    def execute(self, sql, parameters=()):
+        return self._run(sql, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(sql, super().executemany, sql, seq_of_parameters)
+
+    def _fetched(self, started, done):
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - started
+            if done:
+                self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, True)
+            raise
+        self._fetched(started, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors report to a StatementTimer (set as `timer` on a subclass)."""
+
+    timer = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
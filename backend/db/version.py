@@ -0,0 +1,33 @@
+import mmap
+import os
+import struct
+
+_VALUE = struct.Struct('<q')
+
+
+class VersionFile:
+    """
+    One integer in a small file that every process maps into memory, so reading
+    it is a memory access rather than a system call or a query.
+
+    Database keeps the last committed write count here (see
+    Database._publish_version()); the mapping is shared, so a value set by one
+    serve.py worker is seen by the others at once, and it survives fork.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < _VALUE.size:
+                os.ftruncate(fd, _VALUE.size)
+            self._map = mmap.mmap(fd, _VALUE.size)
+        finally:
+            # The mapping keeps the file open
+            os.close(fd)
+
+    def get(self):
+        return _VALUE.unpack_from(self._map)[0]
+
+    def set(self, value):
+        _VALUE.pack_into(self._map, 0, value)
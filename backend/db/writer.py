@@ -0,0 +1,117 @@
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+
+class WriterThread:
+    """
+    Single thread that owns the only read-write connection to the database.
+
+    Callers submit functions taking a cursor; the thread runs them in order.
+    Jobs that queue up while a transaction is running are committed together
+    (group commit), each inside its own savepoint so one failing job doesn't
+    roll back its neighbours. on_commit(conn), if given, runs on the thread
+    after each commit, before the jobs' callers are woken.
+    """
+
+    def __init__(self, connect, max_batch=64, on_commit=None):
+        self._connect = connect
+        self.max_batch = max_batch
+        self.on_commit = on_commit
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"jobs": 0, "transactions": 0, "errors": 0}
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, fn):
+        """Queue fn(cursor) for the writer thread, return a Future with its result."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def execute(self, fn):
+        """Run fn(cursor) on the writer thread and wait for its result."""
+        return self.submit(fn).result()
+
+    def stop(self, timeout=None):
+        """Finish queued writes, then stop the thread."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+    def _run(self):
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    return
+                batch = [job]
+                stop = False
+                while len(batch) < self.max_batch:
+                    try:
+                        job = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        stop = True
+                        break
+                    batch.append(job)
+                self._run_batch(conn, cursor, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _run_batch(self, conn, cursor, batch):
+        results = []
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                cursor.execute("SAVEPOINT job")
+                try:
+                    results.append((future, fn(cursor), None))
+                    cursor.execute("RELEASE job")
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO job")
+                    cursor.execute("RELEASE job")
+                    results.append((future, None, e))
+            cursor.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            self._stats["errors"] += len(batch)
+            for fn, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self._stats["transactions"] += 1
+        if self.on_commit:
+            self.on_commit(conn)
+        for future, result, error in results:
+            self._stats["jobs"] += 1
+            if error is not None:
+                self._stats["errors"] += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,121 @@
+"""
+Production entry point: python serve.py
+
+Uses gunicorn when it is installed (Linux/macOS). The app, the database schema,
+the mos/roster caches and the counseling template are loaded once in the master
+process, then WORKERS processes fork from it, so every worker starts warm and
+opens its own connection pool. Where gunicorn isn't available (Windows) it falls
+back to waitress, a single process serving with THREADS threads.
+
+Workers share no Python objects, so state a client may reach through any of
+them is kept outside the processes: background jobs and /query cursors in
+STATE_DIR, and the data version behind ETags in the database, published to a
+memory-mapped file beside it (<database>-version) after each commit. With
+several workers, /query cursors re-run each page instead of holding a WAL
+snapshot open; WORKERS=1 keeps the snapshots. The mos, roster and render
+caches are per worker but keyed on shared data, so they only cost memory.
+/metrics reports on the worker that answered the scrape.
+
+Each worker renders counselings on its own pool of up to RENDER_WORKERS processes
+(default: one per CPU), started from a fork server as renders need them, so a
+batch on any worker can use every core.
+
+Settings come from .env:
+    URL                 the port to listen on is taken from here
+    BIND                host:port to listen on instead (default 0.0.0.0:<URL port>)
+    WORKERS             worker processes (gunicorn only, default 2 x CPUs + 1)
+    STATE_DIR           directory for the state shared by the workers (see app.py)
+    THREADS             threads per worker (default 4)
+    RENDER_WORKERS      render processes per worker (default: one per CPU)
+    GRACEFUL_TIMEOUT    seconds workers get to finish in-flight requests on shutdown (default 30)
+    REQUEST_TIMEOUT     seconds before a stuck gunicorn worker is restarted (default 120)
+"""
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+import os
+
+load_dotenv(".env")  # Loads the .env file
+
+CPUS = os.cpu_count() or 1
+WORKERS = int(os.getenv("WORKERS", "0")) or 2 * CPUS + 1
+THREADS = int(os.getenv("THREADS", "4"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "120"))
+BIND = os.getenv("BIND") or f"0.0.0.0:{urlparse(os.getenv('URL', '')).port or 5000}"
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+
+def shutdown():
+    """Close what a serving process holds open: jobs, cursors, render workers, pending writes."""
+    import app
+    app.job_queue.shutdown()
+    app.query_cursors.close_all()
+    app.render_pool.shutdown()
+    app.db.shutdown()
+
+
+def post_fork(server, worker):
+    # Connections, the writer thread, cursors and job threads inherited from the master belong to it
+    import app
+    app.db.after_fork()
+    app.query_cursors.after_fork()
+    app.job_queue.after_fork()
+
+
+def worker_exit(server, worker):
+    shutdown()
+
+
+if BaseApplication is not None:
+    class Server(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            import app
+            return app.app
+
+
+def main():
+    if BaseApplication is None:
+        try:
+            import waitress
+        except ImportError:
+            raise SystemExit("serve.py needs gunicorn (Linux/macOS) or waitress (Windows): pip install gunicorn")
+        import app
+        print(f"Serving with waitress on {BIND}, {THREADS} threads")
+        try:
+            waitress.serve(app.app, listen=BIND, threads=THREADS, channel_timeout=REQUEST_TIMEOUT)
+        finally:
+            shutdown()
+        return
+
+    # Tells the app to keep state that requests share (e.g. /query cursors) where every worker sees it
+    os.environ["SERVER_PROCESSES"] = str(WORKERS)
+    import app
+    # Preloaded in the master; close its connections before the workers fork
+    app.db.shutdown()
+    Server({
+        'bind': BIND,
+        'workers': WORKERS,
+        'threads': THREADS,
+        'worker_class': 'gthread',
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'timeout': REQUEST_TIMEOUT,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
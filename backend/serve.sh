@@ -0,0 +1,2 @@
+source venv/Scripts/activate
+python serve.py
\ No newline at end of file
@@ -1,6 +1,13 @@
 import cmd
+import csv
+import io
+import random
+import sys
+import threading
+import time
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import os
 
@@ -8,6 +15,167 @@ load_dotenv(".env")  # Loads the .env file
 
 URL = os.getenv("URL")
 
+# Endpoints the load command can drive, with their default share of the traffic
+LOAD_MIX = {"users": 5, "user": 40, "mos": 30, "fill": 5, "import": 0}
+# Rows re-imported by each /import/roster request of the load command
+LOAD_IMPORT_ROWS = 50
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class LoadTest:
+    """
+    Drives a weighted mix of endpoints from a pool of threads, each with its own
+    keep-alive requests.Session, for `duration` seconds.
+
+    With rate=0 every thread sends its next request as soon as the last one
+    returns (closed loop, `concurrency` requests in flight). With a rate, sends
+    are scheduled at fixed intervals and latency is measured from the scheduled
+    time, so queueing behind a slow server shows up instead of being hidden.
+    """
+
+    def __init__(self, base_url, mix, duration=30.0, concurrency=8, rate=0.0, timeout=30.0):
+        self.base_url = base_url
+        self.mix = {name: weight for name, weight in mix.items() if weight > 0}
+        self.duration = duration
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._samples = {name: [] for name in self.mix}  # (seconds, ok)
+        self._errors = {}
+        self._next_send = None
+        self.users = []
+        self.mos = []
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def prepare(self):
+        """Sample existing Marines and MOS codes so requests hit real rows."""
+        response = requests.get(f"{self.base_url}/users", params={"limit": 1000}, timeout=self.timeout)
+        response.raise_for_status()
+        self.users = response.json()["users"]
+        if not self.users:
+            raise ValueError("The roster is empty; load needs existing users to request")
+        response = requests.get(f"{self.base_url}/mos", timeout=self.timeout)
+        response.raise_for_status()
+        self.mos = [row["BILMOS"] for row in response.json()] or [user["BILMOS"] for user in self.users]
+
+    def _request(self, name):
+        session = self._session()
+        url = self.base_url
+        if name == "users":
+            return session.get(f"{url}/users", timeout=self.timeout)
+        if name == "user":
+            return session.get(f"{url}/users/{random.choice(self.users)['EDIPI']}", timeout=self.timeout)
+        if name == "mos":
+            return session.get(f"{url}/mos/{random.choice(self.mos)}", timeout=self.timeout)
+        if name == "fill":
+            marine, senior = random.choice(self.users), random.choice(self.users)
+            data = {
+                "EDIT_lastName": marine["LASTNAME"], "EDIT_firstName": marine["FIRSTNAME"],
+                "Edit_MI": marine["MI"] or "", "EDIT_EDIPI": marine["EDIPI"], "EDIT_RANK": marine["RANK"],
+                "EDIT_DOR": marine["DOR"], "EDIT_PMOS": marine["PMOS"], "EDIT_BILMOS": marine["BILMOS"],
+                "EDIT_sLastName": senior["LASTNAME"], "EDIT_sFirstName": senior["FIRSTNAME"],
+                "EDIT_sMI": senior["MI"] or "", "EDIT_sEDIPI": senior["EDIPI"], "EDIT_sRank": senior["RANK"],
+                "EDIT_Billet": senior["BILLET"] or "", "EDIT_TOPICS": "Load test",
+            }
+            return session.post(f"{url}/fill_counseling", json=data, timeout=self.timeout)
+        if name == "import":
+            # Re-import existing rows unchanged, so the roster is left as it was
+            out = io.StringIO()
+            writer = csv.writer(out)
+            writer.writerow(['rank', 'firstName', 'lastName', 'mi', 'edipi', 'dor', 'pmos', 'bilmos', 'billet'])
+            for user in random.sample(self.users, min(LOAD_IMPORT_ROWS, len(self.users))):
+                writer.writerow([user["RANK"], user["FIRSTNAME"], user["LASTNAME"], user["MI"] or "", user["EDIPI"],
+                                 user["DOR"], user["PMOS"], user["BILMOS"], user["BILLET"] or ""])
+            files = {"file": ("load.csv", out.getvalue().encode("utf-8"), "text/csv")}
+            return session.post(f"{url}/import/roster", files=files, timeout=self.timeout)
+        raise ValueError(f"Unknown endpoint {name}")
+
+    def _scheduled_start(self):
+        """With a rate, wait for the next send slot and return it; otherwise now."""
+        if not self.rate:
+            return time.perf_counter()
+        with self._lock:
+            slot = self._next_send
+            self._next_send += 1.0 / self.rate
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return slot
+
+    def _worker(self, deadline):
+        names = list(self.mix)
+        weights = list(self.mix.values())
+        while True:
+            started = self._scheduled_start()
+            if started >= deadline:
+                return
+            name = random.choices(names, weights)[0]
+            try:
+                response = self._request(name)
+                response.content  # read the whole body
+                ok = response.status_code < 400
+                error = None if ok else f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                ok, error = False, type(e).__name__
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._samples[name].append((elapsed, ok))
+                if error:
+                    key = (name, error)
+                    self._errors[key] = self._errors.get(key, 0) + 1
+
+    def run(self):
+        """Run the load and return the report (see report())."""
+        started = time.perf_counter()
+        self._next_send = started
+        deadline = started + self.duration
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for future in [pool.submit(self._worker, deadline) for _ in range(self.concurrency)]:
+                future.result()
+        return self.report(time.perf_counter() - started)
+
+    def report(self, elapsed):
+        """Per endpoint and overall: requests, throughput, error rate and latency percentiles (ms)."""
+        def summarize(samples):
+            latencies = sorted(seconds * 1000 for seconds, _ in samples)
+            errors = sum(1 for _, ok in samples if not ok)
+            return {
+                "requests": len(samples),
+                "throughput": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+                "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+                "p50_ms": round(_percentile(latencies, 0.50), 2),
+                "p95_ms": round(_percentile(latencies, 0.95), 2),
+                "p99_ms": round(_percentile(latencies, 0.99), 2),
+                "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+            }
+
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+            errors = dict(self._errors)
+        endpoints = {name: summarize(values) for name, values in samples.items()}
+        endpoints["total"] = summarize([sample for values in samples.values() for sample in values])
+        return {
+            "duration": round(elapsed, 2),
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "endpoints": endpoints,
+            "errors": [{"endpoint": name, "error": error, "count": count}
+                       for (name, error), count in sorted(errors.items())],
+        }
+
+
 class ApiTestCLI(cmd.Cmd):
     intro = "Welcome to the Flask API Test CLI. Type 'help' or '?' to list commands.\n"
     prompt = "(API Test) "
@@ -218,17 +386,6 @@ class ApiTestCLI(cmd.Cmd):
             # Ask EDIPI of senior
             senior_edipi = "1234567890"
             senior_billet = "safsdfsadfsag"
-            # Fetch user
-            response = requests.get(f"{self.base_url}/users/{edipi}")
-            response.raise_for_status()
-            user = response.json()
-            
-            # Fetch senior
-            response = requests.get(f"{self.base_url}/users/{senior_edipi}")
-            response.raise_for_status()
-            senior = response.json()
-            print(user)
-            print(senior)
             # Ask for occasion
             occasion = "adafsdf"
 
@@ -253,46 +410,72 @@ class ApiTestCLI(cmd.Cmd):
             # Ask for comments
             comments = "asfsafasdf"
             
-            # Fetch MOS description
-            response = requests.get(f"{self.base_url}/mos/{user.get('bilmos')}")
-            response.raise_for_status()
-            mos_desc = response.json()
-            
-            # Create JSON data
-            
+            # The server looks up both Marines and the MOS description itself
             data = {
-                "EDIT_lastName": user.get('lastName'),
-                "EDIT_firstName": user.get('firstName'),
-                "Edit_MI": len(user.get('mi')) > 0 and user.get('mi') or "",
-                "EDIT_EDIPI": user.get('edipi'),
-                "EDIT_RANK": user.get('rank'),
-                "EDIT_DOR": user.get('dor'),
-                "EDIT_PMOS": user.get('pmos'),
-                "EDIT_BILMOS": user.get('bilmos'),
-                "EDIT_OCCASION": user.get('occasion'),
-                "EDIT_perFrom": user.get('periodFrom'),
-                "EDIT_perTo": user.get('periodTo'),
-                "EDIT_sLastName": senior.get('lastName'),
-                "EDIT_sFirstName": senior.get('firstName'),
-                "EDIT_sMI": len(senior.get('mi')) > 0 and senior.get('mi') or "",
-                "EDIT_sEDIPI": senior.get('edipi'),
-                "EDIT_sRank": senior.get('rank'),
-                "EDIT_Billet": senior.get('billet'),
-                "EDIT_TOPICS": topics,
-                "EDIT_EVENTS": events,
-                "EDIT_mos": mos_desc.get('desc'),
-                "EDIT_EVAL": eval,
-                "EDIT_TASKS": goals,
-                "EDIT_COMMENTS": comments
+                "edipi": edipi,
+                "senior_edipi": senior_edipi,
+                "fields": {
+                    "EDIT_OCCASION": occasion,
+                    "EDIT_perFrom": period_from,
+                    "EDIT_perTo": period_to,
+                    "EDIT_TOPICS": topics,
+                    "EDIT_EVENTS": events,
+                    "EDIT_EVAL": eval,
+                    "EDIT_TASKS": goals,
+                    "EDIT_COMMENTS": comments
+                }
             }
            
-            response=requests.post(f"{self.base_url}/fill_counseling", json=data)
+            response=requests.post(f"{self.base_url}/fill_counseling/edipi", json=data)
             response.raise_for_status()
-            self._print_response(response)
+            print(f"Received {len(response.content)} byte counseling document")
         except requests.RequestException as e:
             print(f"Error: {e}")
 
 
+    def do_load(self, arg):
+        """Generate concurrent load and report latency per endpoint:
+        load [duration=30] [concurrency=8] [rate=0] [mix=users:5,user:40,mos:30,fill:5,import:0] [json=1]
+        rate is total requests per second (0 = as fast as `concurrency` threads allow).
+        mix weights the endpoints: users (GET /users), user (GET /users/<edipi>),
+        mos (GET /mos/<bilmos>), fill (POST /fill_counseling) and import (POST /import/roster,
+        re-importing existing rows unchanged)."""
+        options = {"duration": "30", "concurrency": "8", "rate": "0", "json": "0"}
+        mix = dict(LOAD_MIX)
+        try:
+            for token in arg.split():
+                key, _, value = token.partition("=")
+                if key == "mix":
+                    for part in value.split(","):
+                        name, _, weight = part.partition(":")
+                        if name not in LOAD_MIX:
+                            raise ValueError(f"unknown endpoint {name!r}, expected one of {', '.join(LOAD_MIX)}")
+                        mix[name] = float(weight or 1)
+                elif key in options:
+                    options[key] = value
+                else:
+                    raise ValueError(f"unknown option {key!r}")
+            load = LoadTest(self.base_url, mix, duration=float(options["duration"]),
+                            concurrency=int(options["concurrency"]), rate=float(options["rate"]))
+            if not load.mix:
+                raise ValueError("mix gives every endpoint a weight of 0")
+            load.prepare()
+        except (ValueError, requests.RequestException) as e:
+            print(f"Error: {e}")
+            return
+        pace = f"{load.rate:g} req/s" if load.rate else "closed loop"
+        print(f"Running {load.duration:g}s against {self.base_url} with {load.concurrency} threads ({pace})...")
+        report = load.run()
+        if options["json"] not in ("0", "false"):
+            print(json.dumps(report, indent=2))
+            return
+        print(f"{'endpoint':<10} {'requests':>9} {'req/s':>8} {'errors':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name, stats in report["endpoints"].items():
+            print(f"{name:<10} {stats['requests']:>9} {stats['throughput']:>8.1f} {stats['error_rate']:>8.2%} "
+                  f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+        for error in report["errors"]:
+            print(f"  {error['endpoint']}: {error['error']} x{error['count']}")
+
     def do_exit(self, arg):
         """Exit the CLI"""
         print("Goodbye!")
@@ -303,4 +486,8 @@ class ApiTestCLI(cmd.Cmd):
         return self.do_exit(arg)
      
 if __name__ == '__main__':
-    ApiTestCLI().cmdloop()
\ No newline at end of file
+    # "python test.py load duration=60 ..." runs one command without the prompt
+    if len(sys.argv) > 1:
+        ApiTestCLI().onecmd(" ".join(sys.argv[1:]))
+    else:
+        ApiTestCLI().cmdloop()
\ No newline at end of file
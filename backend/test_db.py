@@ -0,0 +1,298 @@
+"""
+Tests for the db package: python -m unittest test_db (from this directory).
+
+Each test works on a fresh database file in a temporary directory. The
+multi-process tests stand in for serve.py's workers, which share one
+database file but keep their own caches.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from db.cursors import CursorLimit, CursorRegistry, SharedCursorRegistry
+from db.database import Database
+from db.executor import QueryExecutor, is_read_only, split_statements
+from db.query import ROSTER_COLUMNS
+from db.replica import RosterReplica
+from db.state import SharedState
+
+ENGINES = ('default', 'wal')
+
+
+# Runs until a budget stops it
+ENDLESS = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+
+
+def _roster_row(edipi, rank='Cpl', bilmos='0311', lastname='Marine'):
+    values = {"RANK": rank, "FIRSTNAME": 'Test', "LASTNAME": lastname, "MI": 'T', "EDIPI": edipi,
+              "DOR": '2020-01-01', "PMOS": bilmos, "BILMOS": bilmos, "BILLET": ''}
+    return tuple(values[column] for column in ROSTER_COLUMNS)
+
+
+def _page_shared_cursor(path, state_path, cursor_id, results):
+    """Another worker: fetch one page of a cursor opened elsewhere."""
+    db = Database(path)
+    db.connect()
+    try:
+        registry = SharedCursorRegistry(db, SharedState(state_path))
+        results.put(registry.fetch('client', cursor_id, 3))
+    finally:
+        db.close()
+        db.shutdown()
+
+
+def _write_and_check(path, engine, prefix, count, barrier, results):
+    """One worker: write through its own Database while the other does, then read everything back."""
+    db = Database(path, engine=engine, replica=True)
+    db.connect()
+    try:
+        for i in range(count):
+            # Keep both caches loaded, so every write has to patch or drop them
+            db.get_mos_desc_by_bilmos('0000')
+            db.get_user_by_edipi('0000000000')
+            db.insert_mos_desc(f'{prefix}{i:03d}', 'Test')
+            db.insert_user('Cpl', 'Test', 'Marine', 'T', f'{prefix}{i:09d}', '2020-01-01', '0311', '0311', '')
+        barrier.wait()
+        prefixes = [str(worker) for worker in range(1, 3)]
+        results.put({
+            "prefix": prefix,
+            "missing_mos": [f'{p}{i:03d}' for p in prefixes for i in range(count)
+                            if db.get_mos_desc_by_bilmos(f'{p}{i:03d}') is None],
+            "missing_users": [f'{p}{i:09d}' for p in prefixes for i in range(count)
+                              if db.get_user_by_edipi(f'{p}{i:09d}') is None],
+            "replica": db.check_replica(),
+        })
+    finally:
+        db.close()
+        db.shutdown()
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def open(self, engine='default', **options):
+        db = Database(self.path, engine=engine, **options)
+        db.bootstrap()
+        db.connect()
+        self.addCleanup(db.shutdown)
+        self.addCleanup(db.release)
+        return db
+
+
+class SharedFileTest(DatabaseTestCase):
+    """Two Database instances on one file, as two serve.py workers would have."""
+
+    def test_writes_from_another_instance_reach_the_caches(self):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.path = os.path.join(self.directory, f'{engine}.db')
+                first = self.open(engine, replica=True)
+                second = self.open(engine, replica=True)
+                self.assertIsNone(first.get_mos_desc_by_bilmos('0311'))
+                self.assertIsNone(first.get_user_by_edipi('1000000001'))
+
+                second.insert_mos_desc('0311', 'Rifleman')
+                second.insert_user('Cpl', 'A', 'B', 'C', '1000000001', '2020-01-01', '0311', '0311', '')
+                # A write of its own must not stamp the first instance's stale caches as current
+                first.insert_mos_desc('0331', 'Machine Gunner')
+                first.insert_user('Cpl', 'D', 'E', 'F', '1000000002', '2020-01-01', '0331', '0331', '')
+
+                for db in (first, second):
+                    self.assertEqual(db.get_mos_desc_by_bilmos('0311')['DESCRIPTION'], 'Rifleman')
+                    self.assertEqual(db.get_mos_desc_by_bilmos('0331')['DESCRIPTION'], 'Machine Gunner')
+                    self.assertIsNotNone(db.get_user_by_edipi('1000000001'))
+                    self.assertIsNotNone(db.get_user_by_edipi('1000000002'))
+                    self.assertTrue(db.check_replica()["consistent"])
+
+    def test_concurrent_writers_in_two_processes(self):
+        context = multiprocessing.get_context('spawn')
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                path = os.path.join(self.directory, f'{engine}-processes.db')
+                db = Database(path, engine=engine)
+                db.bootstrap()
+                db.shutdown()
+                barrier, results = context.Barrier(2), context.Queue()
+                workers = [context.Process(target=_write_and_check, args=(path, engine, prefix, 60, barrier, results))
+                           for prefix in ('1', '2')]
+                for worker in workers:
+                    worker.start()
+                reports = [results.get(timeout=120) for _ in workers]
+                for worker in workers:
+                    worker.join(30)
+                    self.assertEqual(worker.exitcode, 0)
+                for report in reports:
+                    self.assertEqual(report["missing_mos"], [], report["prefix"])
+                    self.assertEqual(report["missing_users"], [], report["prefix"])
+                    self.assertTrue(report["replica"]["consistent"], report["replica"])
+
+
+class ExecutorTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = self.open()
+        self.executor = QueryExecutor(self.db)
+
+    def test_step_budget_stops_a_runaway_statement(self):
+        result, = self.executor.run(ENDLESS, max_steps=100_000, timeout=30)
+        self.assertTrue(result["rejected"])
+        self.assertIn("VM steps", result["error"])
+
+    def test_time_budget_stops_a_runaway_statement(self):
+        result, = self.executor.run(ENDLESS, timeout=0.2, max_steps=10 ** 12)
+        self.assertTrue(result["rejected"])
+        self.assertIn("time budget", result["error"])
+        self.assertLess(result["ms"], 5000)
+
+    def test_a_rejected_statement_ends_the_request(self):
+        results = self.executor.run("SELECT 1; " + ENDLESS + "; SELECT 2", max_steps=100_000)
+        self.assertEqual(results[0]["rows"], [{"1": 1}])
+        self.assertTrue(results[1]["rejected"])
+        self.assertEqual(len(results), 2)
+
+    def test_read_only_rejects_writes_before_they_run(self):
+        self.db.insert_mos_desc('0311', 'Rifleman')
+        for sql in ("DELETE FROM mos", "UPDATE mos SET DESCRIPTION = 'x'", "PRAGMA user_version = 7",
+                    "CREATE TABLE scratch (x)", "INSERT INTO mos VALUES ('0331', 'x')"):
+            with self.subTest(sql=sql):
+                result, = self.executor.run(sql, read_only=True)
+                self.assertTrue(result["rejected"])
+                self.assertFalse(result["read_only"])
+        self.assertEqual([row["BILMOS"] for row in self.db.get_all_mos_desc()], ['0311'])
+
+    def test_authorizer_classifies_statements(self):
+        conn = self.db.conn
+        for sql in ("SELECT * FROM roster", "PRAGMA table_info(roster)", "EXPLAIN DELETE FROM mos",
+                    "EXPLAIN QUERY PLAN SELECT * FROM mos", "WITH x AS (SELECT 1) SELECT * FROM x"):
+            with self.subTest(sql=sql):
+                self.assertTrue(is_read_only(conn, sql))
+        for sql in ("DELETE FROM mos", "PRAGMA journal_mode = DELETE", "DROP TABLE mos"):
+            with self.subTest(sql=sql):
+                self.assertFalse(is_read_only(conn, sql))
+
+    def test_writes_commit_and_drop_the_mos_cache(self):
+        self.db.insert_mos_desc('0311', 'Rifleman')
+        self.assertEqual(self.db.get_mos_desc_by_bilmos('0311')['DESCRIPTION'], 'Rifleman')
+        result, = self.executor.run("UPDATE mos SET DESCRIPTION = 'Infantry' WHERE BILMOS = '0311'")
+        self.assertEqual(result["changes"], 1)
+        self.assertEqual(self.db.get_mos_desc_by_bilmos('0311')['DESCRIPTION'], 'Infantry')
+
+    def test_split_statements(self):
+        self.assertEqual(split_statements("SELECT ';'; SELECT 2 -- done"), ["SELECT ';';", "SELECT 2 -- done"])
+        self.assertEqual(split_statements("SELECT 1; -- trailing note"), ["SELECT 1;"])
+        self.assertEqual(split_statements("/* only a comment */"), [])
+
+
+class CursorTest(DatabaseTestCase):
+    SQL = "VALUES " + ", ".join(f"({i})" for i in range(10))
+
+    def pages(self, registry, page_size=3):
+        page = registry.open('client', self.SQL, page_size)
+        rows = [row["column1"] for row in page["rows"]]
+        while page["cursor"]:
+            page = registry.fetch('client', page["cursor"], page_size)
+            rows += [row["column1"] for row in page["rows"]]
+        return rows
+
+    def test_pages_cover_the_result_once(self):
+        for engine, snapshot in (('default', False), ('wal', True)):
+            with self.subTest(engine=engine, snapshot=snapshot):
+                self.path = os.path.join(self.directory, f'{engine}.db')
+                db = self.open(engine)
+                self.assertEqual(self.pages(CursorRegistry(db, snapshot=snapshot)), list(range(10)))
+                state = SharedState(os.path.join(self.directory, f'{engine}-state.db'))
+                self.assertEqual(self.pages(SharedCursorRegistry(db, state)), list(range(10)))
+
+    def test_non_subquery_statements_page_from_their_rows(self):
+        db = self.open()
+        registry = CursorRegistry(db)
+        page = registry.open('client', "PRAGMA table_info(roster)", 4)
+        columns = [row["name"] for row in page["rows"]]
+        while page["cursor"]:
+            page = registry.fetch('client', page["cursor"], 4)
+            columns += [row["name"] for row in page["rows"]]
+        self.assertEqual(columns, list(ROSTER_COLUMNS))
+
+    def test_cursors_refuse_writes_and_cap_each_client(self):
+        db = self.open()
+        state = SharedState(os.path.join(self.directory, 'state.db'))
+        for registry in (CursorRegistry(db, max_per_client=2), SharedCursorRegistry(db, state, max_per_client=2)):
+            with self.subTest(registry=type(registry).__name__):
+                with self.assertRaises(ValueError):
+                    registry.open('client', "DELETE FROM mos")
+                with self.assertRaises(ValueError):
+                    registry.open('client', "SELECT 1; SELECT 2")
+                registry.open('client', self.SQL, 1)
+                registry.open('client', self.SQL, 1)
+                with self.assertRaises(CursorLimit):
+                    registry.open('client', self.SQL, 1)
+                self.assertIsNotNone(registry.open('other', self.SQL, 1)["cursor"])
+
+    def test_shared_cursor_continues_in_another_process(self):
+        db = self.open()
+        state_path = os.path.join(self.directory, 'state.db')
+        registry = SharedCursorRegistry(db, SharedState(state_path))
+        page = registry.open('client', self.SQL, 3)
+        self.assertEqual([row["column1"] for row in page["rows"]], [0, 1, 2])
+
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        worker = context.Process(target=_page_shared_cursor, args=(self.path, state_path, page["cursor"], results))
+        worker.start()
+        other = results.get(timeout=60)
+        worker.join(30)
+        self.assertEqual([row["column1"] for row in other["rows"]], [3, 4, 5])
+
+        page = registry.fetch('client', page["cursor"], 3)
+        self.assertEqual([row["column1"] for row in page["rows"]], [6, 7, 8])
+        self.assertIsNone(registry.fetch('other', page["cursor"], 3))
+        self.assertTrue(registry.close('client', page["cursor"]))
+        self.assertIsNone(registry.fetch('client', page["cursor"], 3))
+
+
+class ReplicaTest(unittest.TestCase):
+    def test_writes_never_change_a_published_snapshot(self):
+        replica = RosterReplica()
+        rows = [_roster_row('1000000001'), _roster_row('1000000002', rank='Sgt')]
+        replica.load('v1', rows)
+        before = replica.lookup('v1')
+        indexed = {column: {value: list(keys) for value, keys in index.items()}
+                   for column, index in before.indexes.items()}
+
+        def change(draft):
+            draft.put([_roster_row('1000000003'), _roster_row('1000000002', rank='SSgt', bilmos='0331')])
+            draft.remove(['1000000001'])
+
+        replica.apply('v1', 'v2', change)
+        self.assertEqual(sorted(before.rows), ['1000000001', '1000000002'])
+        self.assertEqual(before.edipis, ['1000000001', '1000000002'])
+        self.assertEqual(before.get('1000000002').RANK, 'Sgt')
+        self.assertEqual(before.indexes, indexed)
+
+        after = replica.lookup('v2')
+        self.assertIsNone(replica.lookup('v1'))
+        self.assertEqual(after.edipis, ['1000000002', '1000000003'])
+        self.assertEqual([row.EDIPI for row in after.by('RANK', 'Cpl')], ['1000000003'])
+        self.assertEqual([row.EDIPI for row in after.by('BILMOS', '0331')], ['1000000002'])
+        expected = [_roster_row('1000000002', rank='SSgt', bilmos='0331'), _roster_row('1000000003')]
+        self.assertTrue(replica.check(expected)["consistent"])
+
+    def test_a_write_from_an_unexpected_version_drops_the_replica(self):
+        replica = RosterReplica()
+        replica.load('v1', [_roster_row('1000000001')])
+        snapshot = replica.lookup('v1')
+        replica.apply('v0', 'v2', lambda draft: draft.put([_roster_row('1000000002')]))
+        self.assertIsNone(replica.snapshot)
+        self.assertIsNone(replica.lookup('v2'))
+        self.assertEqual(list(snapshot.rows), ['1000000001'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+Tests for the background job queue: python -m unittest test_jobs (from this directory).
+
+Two JobQueue instances on one SharedState stand in for two serve.py workers;
+the multi-process tests run the submitting side in a separate process.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from db.state import SharedState
+from tools.jobs import Job, JobFailed, JobQueue, QueueFull
+
+
+def _render(data):
+    return data
+
+
+def _fail():
+    raise JobFailed("Render failed", details=["EDIT_X is not a field"])
+
+
+def _submit_in_worker(state_path, directory, hang, results):
+    """Another worker: submit a job, report its id and either finish it or exit while it runs."""
+    queue = JobQueue(SharedState(state_path), directory, workers=1)
+    started = threading.Event()
+
+    def run():
+        started.set()
+        if hang:
+            time.sleep(60)
+        return b"rendered elsewhere"
+
+    job = queue.submit('counseling', run)
+    if hang:
+        started.wait(10)
+    else:
+        queue.wait(job.id, 10)
+    results.put(job.id)
+    results.close()
+    results.join_thread()
+    # Without shutdown(), as a worker that is killed would
+    os._exit(0)
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.directory, 'state.db')
+        self.jobs = os.path.join(self.directory, 'jobs')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def queue(self, **options):
+        queue = JobQueue(SharedState(self.state_path), self.jobs, **options)
+        self.addCleanup(queue.shutdown, 10)
+        return queue
+
+    def test_another_queue_reports_and_serves_a_job(self):
+        first, second = self.queue(), self.queue()
+        job = first.submit('counseling', _render, b"document")
+        finished = second.wait(job.id, 10)
+        self.assertEqual(finished.status, Job.DONE)
+        self.assertEqual(second.result(finished), b"document")
+        self.assertIsNotNone(finished.describe()["run_ms"])
+
+    def test_failure_details_reach_other_queues(self):
+        first, second = self.queue(), self.queue()
+        job = first.submit('counseling', _fail)
+        failed = second.wait(job.id, 10)
+        self.assertEqual(failed.status, Job.FAILED)
+        self.assertEqual(failed.describe()["details"], ["EDIT_X is not a field"])
+        self.assertIsNone(second.result(failed))
+
+    def test_queue_depth_is_counted_across_queues(self):
+        release = threading.Event()
+        first = self.queue(workers=1, max_queued=1)
+        second = self.queue(workers=1, max_queued=1)
+        running = first.submit('counseling', lambda: release.wait(10) and b"")
+        deadline = time.monotonic() + 10
+        while first.get(running.id).status != Job.RUNNING and time.monotonic() < deadline:
+            time.sleep(0.01)
+        first.submit('counseling', _render, b"queued")
+        with self.assertRaises(QueueFull):
+            second.submit('counseling', _render, b"turned away")
+        self.assertEqual(second.stats()["queued"], 1)
+        release.set()
+
+    def test_cancel_from_another_queue(self):
+        release = threading.Event()
+        ran = []
+        first, second = self.queue(workers=1), self.queue()
+        first.submit('counseling', lambda: release.wait(10) and b"")
+        queued = first.submit('counseling', lambda: ran.append(True) or b"")
+        self.assertTrue(second.cancel(queued.id))
+        self.assertIsNone(first.get(queued.id))
+        self.assertFalse(second.cancel(queued.id))
+        release.set()
+        first.shutdown(10)
+        self.assertEqual(ran, [])
+
+    def test_finished_jobs_expire(self):
+        queue = self.queue(ttl=0.05)
+        job = queue.wait(queue.submit('counseling', _render, b"document").id, 10)
+        self.assertEqual(job.status, Job.DONE)
+        time.sleep(0.1)
+        self.assertIsNone(queue.get(job.id))
+        self.assertIsNone(queue.result(job))
+
+    def test_job_finished_by_another_process(self):
+        job_id = self.run_worker(hang=False)
+        job = self.queue().get(job_id)
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(self.queue().result(job), b"rendered elsewhere")
+
+    def test_job_lost_with_its_process_is_failed(self):
+        job_id = self.run_worker(hang=True)
+        job = self.queue().get(job_id)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("exited", job.error)
+
+    def run_worker(self, hang):
+        self.queue()  # creates the jobs table before the worker starts
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        worker = context.Process(target=_submit_in_worker, args=(self.state_path, self.jobs, hang, results))
+        worker.start()
+        job_id = results.get(timeout=60)
+        # Reaped, so its pid no longer counts as running
+        worker.join(30)
+        return job_id
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import threading
+import time
+import zlib
+
+from flask import g, request
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is offered on its own
+    brotli = None
+
+# Content that is already compressed (a .docx is a ZIP) gains nothing from another pass
+COMPRESSED_TYPES = (
+    'application/zip',
+    'application/gzip',
+    'application/x-brotli',
+    'application/vnd.openxmlformats-officedocument',
+    'application/pdf',
+    'image/',
+    'audio/',
+    'video/',
+    'font/woff',
+)
+
+
+class _Gzip:
+    def __init__(self, level):
+        # wbits 16 + MAX_WBITS writes a gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self, final):
+        return self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class _Brotli:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self, final):
+        return self._compressor.finish() if final else self._compressor.flush()
+
+
+class ResponseCompressor:
+    """
+    after_request hook that compresses responses with brotli (when installed) or
+    gzip, whichever the client prefers in Accept-Encoding.
+
+    Bodies smaller than `min_size`, already-compressed content types and
+    send_file() passthrough responses are left alone. Streamed responses are
+    compressed chunk by chunk, flushing after each chunk so NDJSON still
+    arrives incrementally. Each buffered response reports its JSON encode and
+    compression time in Server-Timing and its ratio in X-Compression-Ratio.
+    """
+
+    def __init__(self, min_size=1024, gzip_level=5, brotli_quality=4):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = (['br'] if brotli else []) + ['gzip']
+        self._lock = threading.Lock()
+        self._stats = {"responses": 0, "compressed": 0, "streamed": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def _compressor(self, encoding):
+        return _Brotli(self.brotli_quality) if encoding == 'br' else _Gzip(self.gzip_level)
+
+    def _count(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                self._stats[key] += value
+
+    def after_request(self, response):
+        self._count(responses=1)
+        timing = []
+        if 'json_encode_ms' in g:
+            timing.append(f"json;dur={g.json_encode_ms:.3f}")
+        encoding = self._negotiate(request, response)
+        if encoding and response.is_streamed:
+            response.response = self._stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            self._count(streamed=1)
+        elif encoding:
+            data = response.get_data()
+            if len(data) >= self.min_size:
+                started = time.perf_counter()
+                compressor = self._compressor(encoding)
+                compressed = compressor.compress(data) + compressor.flush(True)
+                seconds = time.perf_counter() - started
+                response.set_data(compressed)
+                response.headers['Content-Encoding'] = encoding
+                response.headers['X-Compression-Ratio'] = f"{len(compressed) / len(data):.3f}"
+                response.vary.add('Accept-Encoding')
+                timing.append(f"compress;dur={seconds * 1000:.3f};desc=\"{encoding}\"")
+                self._count(compressed=1, bytes_in=len(data), bytes_out=len(compressed), seconds=seconds)
+        if timing:
+            existing = response.headers.get('Server-Timing')
+            response.headers['Server-Timing'] = ', '.join(([existing] if existing else []) + timing)
+        return response
+
+    def _negotiate(self, request, response):
+        """Pick a content encoding for this response, or None to send it as is."""
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return None
+        if response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return None
+        if (response.mimetype or '').startswith(COMPRESSED_TYPES):
+            return None
+        if request.method == 'HEAD':
+            return None
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if not encoding or request.accept_encodings[encoding] <= 0:
+            return None
+        return encoding
+
+    def _stream(self, chunks, encoding):
+        compressor = self._compressor(encoding)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                data = compressor.compress(chunk) + compressor.flush(False)
+                if data:
+                    yield data
+            yield compressor.flush(True)
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["ratio"] = round(stats["bytes_out"] / stats["bytes_in"], 4) if stats["bytes_in"] else None
+        stats["encodings"] = self.encodings
+        return stats
@@ -0,0 +1,169 @@
+import json
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from tools.doc import load_template
+
+
+def counseling_fields(marine: Dict, senior: Optional[Dict] = None, mos: Optional[Dict] = None) -> Dict:
+    """
+    Map roster rows (as returned by Database) to the counseling template's EDIT_ keys.
+    `senior` is the Marine performing the counseling, `mos` the marine's BILMOS row.
+    """
+    fields = {
+        "EDIT_lastName": marine["LASTNAME"],
+        "EDIT_firstName": marine["FIRSTNAME"],
+        "Edit_MI": marine["MI"] or "",
+        "EDIT_EDIPI": marine["EDIPI"],
+        "EDIT_RANK": marine["RANK"],
+        "EDIT_DOR": marine["DOR"],
+        "EDIT_PMOS": marine["PMOS"],
+        "EDIT_BILMOS": marine["BILMOS"],
+    }
+    if senior:
+        fields.update({
+            "EDIT_sLastName": senior["LASTNAME"],
+            "EDIT_sFirstName": senior["FIRSTNAME"],
+            "EDIT_sMI": senior["MI"] or "",
+            "EDIT_sEDIPI": senior["EDIPI"],
+            "EDIT_sRank": senior["RANK"],
+            "EDIT_Billet": senior.get("BILLET") or "",
+        })
+    if mos:
+        fields["EDIT_MOSDESC"] = mos["DESCRIPTION"]
+    return fields
+
+
+def document_name(index: int, fields: Dict) -> str:
+    """File name for one document inside a batch archive."""
+    parts = [f"{index + 1:04d}"]
+    for key in ("EDIT_lastName", "EDIT_EDIPI"):
+        value = str(fields.get(key) or "").strip()
+        if value:
+            parts.append("".join(c for c in value if c.isalnum() or c in "-_"))
+    return "_".join(parts) + ".docx"
+
+
+def _init_worker(template_path: str):
+    """Compile the template once per worker process."""
+    load_template(template_path)
+
+
+def _render_job(template_path: str, index: int, fields: Dict) -> Tuple[int, bytes, Dict]:
+    # Diagnostics off: only failures carry messages back across the process boundary
+    doc_bytes, response = load_template(template_path).render(fields, "off")
+    return index, doc_bytes, response
+
+
+def _render_keyed(template_path: str, fields: Dict) -> Tuple[bytes, Dict, str]:
+    # Key and document from the same compiled template, even if the file changes meanwhile
+    template = load_template(template_path)
+    doc_bytes, response = template.render(fields, "off")
+    return doc_bytes, response, template.cache_key(fields)
+
+
+class RenderPool:
+    """
+    Renders counseling documents on a pool of worker processes.
+
+    python-docx/lxml work is CPU bound and holds the GIL, so threads don't help;
+    each worker process keeps its own compiled template. The executor is created
+    lazily and re-created after a fork, so it is safe to build before workers fork.
+
+    Worker processes come from a fork server (spawned where there is none) rather
+    than a fork of the caller, which by then runs request threads that may hold
+    locks. That also lets the executor start them on demand: up to `max_workers`
+    (default: the CPU count), one per document rendering at the same time.
+    """
+
+    def __init__(self, template_path: str, max_workers: Optional[int] = None):
+        self.template_path = template_path
+        self.max_workers = max_workers or os.cpu_count() or 1
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(start_method)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=self._context,
+                    initializer=_init_worker,
+                    initargs=(self.template_path,),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def render(self, fields: Dict) -> Tuple[bytes, Dict, str]:
+        """Render one document on a worker process and wait for it: (doc_bytes, response, cache key),
+           the cache key coming from the template the worker rendered with."""
+        return self.executor().submit(_render_keyed, self.template_path, fields).result()
+
+    def render_iter(self, field_sets: List[Dict]) -> Iterator[Tuple[int, bytes, Dict]]:
+        """
+        Yield (index, doc_bytes, response) in completion order. At most twice the
+        worker count is in flight, so finished documents never pile up in memory
+        faster than the caller consumes them.
+        """
+        executor = self.executor()
+        pending = set()
+        jobs = iter(enumerate(field_sets))
+        limit = self.max_workers * 2
+        while True:
+            for index, fields in jobs:
+                pending.add(executor.submit(_render_job, self.template_path, index, fields))
+                if len(pending) >= limit:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+class _StreamBuffer:
+    """Write-only file object that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(documents: Iterable[Tuple[str, bytes]], errors: Optional[List[Dict]] = None) -> Iterator[bytes]:
+    """
+    Yield a ZIP archive chunk by chunk as documents arrive. Documents are stored
+    uncompressed since a .docx is already a deflated zip. If `errors` is given,
+    it is written as errors.json at the end once it is non-empty.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, data in documents:
+            archive.writestr(name, data)
+            yield buffer.drain()
+        if errors:
+            archive.writestr("errors.json", json.dumps(errors, indent=2))
+    yield buffer.drain()
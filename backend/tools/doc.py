@@ -1,11 +1,283 @@
+import copy
 import docx
+import hashlib
 import json
+import logging
 import os
+import struct
+import threading
+import time
+import zipfile
+import zlib
 from io import BytesIO
+from docx.opc.oxml import serialize_part_xml
 from docx.shared import Pt
+from docx.table import _Cell
 from typing import Dict, Union, List, Tuple
 
-def edit_word_tables(input_docx_path: str, json_data: str) -> Tuple[bytes, Dict[str, Union[str, List]]]:
+logger = logging.getLogger(__name__)
+
+
+# Render diagnostics levels, cheapest first. DOC_DIAGNOSTICS sets the default for edit_word_tables.
+DIAGNOSTICS_LEVELS = ("off", "summary", "full")
+
+
+def _is_placeholder(text: str) -> bool:
+    """Cells marked 'EDIT_...' or 'EDIT' (case-insensitive) are fill-in slots."""
+    return text.lower().startswith("edit_") or text.lower() == "edit"
+
+
+# Fixed member timestamp (1980-01-01 00:00, the zip epoch) so identical renders produce identical bytes
+_ZIP_DOS_TIME = 0
+_ZIP_DOS_DATE = (1 << 5) | 1
+
+
+def _deflate_entry(name: str, data: bytes) -> Tuple[bytes, int, int, bytes]:
+    """Compress one zip member: (name, crc32, uncompressed size, raw deflate data)."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return name.encode("utf-8"), zlib.crc32(data), len(data), compressor.compress(data) + compressor.flush()
+
+
+def _build_zip(entries: List[Tuple[bytes, int, int, bytes]]) -> bytes:
+    """Write pre-deflated members into a zip archive without recompressing them."""
+    out = BytesIO()
+    central = []
+    for name, crc, size, data in entries:
+        offset = out.tell()
+        out.write(struct.pack("<IHHHHHIIIHH", 0x04034B50, 20, 0, zipfile.ZIP_DEFLATED,
+                              _ZIP_DOS_TIME, _ZIP_DOS_DATE, crc, len(data), size, len(name), 0))
+        out.write(name)
+        out.write(data)
+        central.append(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, 20, 20, 0, zipfile.ZIP_DEFLATED,
+                                   _ZIP_DOS_TIME, _ZIP_DOS_DATE, crc, len(data), size, len(name),
+                                   0, 0, 0, 0, 0, offset) + name)
+    directory_offset = out.tell()
+    directory = b"".join(central)
+    out.write(directory)
+    out.write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(entries), len(entries),
+                          len(directory), directory_offset, 0))
+    return out.getvalue()
+
+
+class CounselingTemplate:
+    """
+    A counseling .docx parsed once and indexed for repeated rendering.
+
+    Compiling walks every table a single time and records the location of each
+    placeholder cell as a child-index path from the document root. Rendering
+    copies the parsed document XML, writes values straight into those cells and
+    zips the result with the template's other parts, which are compressed once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        with open(path, "rb") as f:
+            # Identifies this version of the template in render cache keys
+            self.digest = hashlib.sha256(f.read()).hexdigest()
+        doc = docx.Document(path)
+
+        # Serialize the untouched package once, exactly as python-docx saves it,
+        # so every render reuses the same bytes for the parts it doesn't edit.
+        stream = BytesIO()
+        doc.save(stream)
+        self._document_name = doc.part.partname.membername
+        with zipfile.ZipFile(stream) as package:
+            self._parts = [
+                (info.filename, None if info.filename == self._document_name else _deflate_entry(info.filename, package.read(info)))
+                for info in package.infolist()
+            ]
+        self._root = doc.element
+
+        self.tables = []  # Table details: {"table_index", "rows", "columns", "cells": [...]}
+        self.slots = []  # (placeholder text, table index, row, column, path to <w:tc>)
+        seen = set()  # holds the <w:tc> elements themselves so their proxies stay stable
+        for table_idx, table in enumerate(doc.tables):
+            table_info = {
+                "table_index": table_idx,
+                "rows": len(table.rows),
+                "columns": len(table.columns),
+                "cells": []
+            }
+            for row_idx, row in enumerate(table.rows):
+                for cell_idx, cell in enumerate(row.cells):
+                    cell_text = cell.text.strip()
+                    table_info["cells"].append({"row": row_idx + 1, "column": cell_idx + 1, "text": cell_text})
+                    # Merged cells are repeated by row.cells; only the first occurrence is a slot
+                    if not _is_placeholder(cell_text) or cell._tc in seen:
+                        continue
+                    seen.add(cell._tc)
+                    self.slots.append((cell_text, table_idx, row_idx + 1, cell_idx + 1, self._path_to(cell._tc)))
+            self.tables.append(table_info)
+
+        # Build the replacement paragraphs once through python-docx so each render
+        # only clones them: a paragraph holding one Times New Roman 9pt run, and
+        # the bare paragraph add_paragraph("") produces.
+        scratch = _Cell(copy.deepcopy(self._root.body.tbl_lst[0].tr_lst[0].tc_lst[0]), None) if self.slots else None
+        if scratch is not None:
+            paragraph = scratch.add_paragraph("x")
+            for run in paragraph.runs:
+                run.font.name = "Times New Roman"
+                run.font.size = Pt(9)
+            self._text_paragraph = paragraph._p
+            self._empty_paragraph = scratch.add_paragraph("")._p
+
+    def cache_key(self, field_values: Dict) -> str:
+        """
+        Content address of the document render() makes from `field_values`: the
+        template digest plus the values of the slots it fills, as render() writes
+        them. Keys the template doesn't use and null values are left out.
+        """
+        names = {cell_text for cell_text, *_ in self.slots}
+        values = {key: str(value) for key, value in field_values.items() if key in names and value is not None}
+        payload = json.dumps(values, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(f"{self.digest}\0{payload}".encode("utf-8")).hexdigest()
+
+    def _path_to(self, element) -> Tuple[int, ...]:
+        """Child-index path from the document root down to `element`."""
+        path = []
+        while element is not self._root:
+            parent = element.getparent()
+            path.append(parent.index(element))
+            element = parent
+        return tuple(reversed(path))
+
+    def _package(self, document_xml: bytes) -> bytes:
+        """Assemble the .docx zip around a freshly serialized document.xml."""
+        entries = [
+            entry if entry is not None else _deflate_entry(name, document_xml)
+            for name, entry in self._parts
+        ]
+        return _build_zip(entries)
+
+    @staticmethod
+    def _locate(root, path: Tuple[int, ...]):
+        element = root
+        for index in path:
+            element = element[index]
+        return element
+
+    def inspect(self) -> Dict:
+        """Full description of the template: every table and cell, and each fill-in slot."""
+        return {
+            "path": self.path,
+            "tables": self.tables,
+            "slots": [
+                {"placeholder": cell_text, "table": table_idx, "row": row, "column": column}
+                for cell_text, table_idx, row, column, _ in self.slots
+            ],
+        }
+
+    def render(self, field_values: Dict, diagnostics: str = "off") -> Tuple[bytes, Dict[str, Union[str, List]]]:
+        """
+        Fill the placeholder cells from `field_values` and return the document as bytes
+        together with response metadata (status, messages, and "timings": seconds spent
+        copying the parsed document, filling cells and saving the package).
+
+        diagnostics controls how much is recorded in messages:
+            "off"     - failures only
+            "summary" - plus one line per updated/skipped cell and the editable/updated cell lists
+            "full"    - plus the text of every cell in every table
+        """
+        if diagnostics not in DIAGNOSTICS_LEVELS:
+            raise ValueError(f"diagnostics must be one of {DIAGNOSTICS_LEVELS}")
+        verbose = diagnostics != "off"
+        response = {"status": "success", "messages": []}
+        updated_cells = []
+        started = time.perf_counter()
+        root = copy.deepcopy(self._root)
+        copied = time.perf_counter()
+
+        for cell_text, table_idx, row, column, path in self.slots:
+            if cell_text not in field_values:
+                continue
+            new_value = field_values[cell_text]
+            if new_value is None:
+                if verbose:
+                    response["messages"].append(f"Skipped cell in Table {table_idx}, Cell ({row}, {column}): null value provided for {cell_text}")
+                continue
+            try:
+                new_value_str = str(new_value)
+                tc = self._locate(root, path)
+                # Clear existing content (same as Paragraph.clear())
+                for p in tc.p_lst:
+                    p.clear_content()
+                # Add new paragraph with font settings, cloned from the prepared prototype
+                if new_value_str:
+                    p = copy.deepcopy(self._text_paragraph)
+                    p.r_lst[0].text = new_value_str
+                else:
+                    p = copy.deepcopy(self._empty_paragraph)
+                tc._insert_p(p)
+                if verbose:
+                    updated_cells.append(f"Table {table_idx}, Cell ({row}, {column}): {new_value_str}")
+                    response["messages"].append(f"Updated cell in Table {table_idx}, Cell ({row}, {column}) with value: {new_value_str} (font: Times New Roman, 9pt)")
+            except Exception as e:
+                response["messages"].append(f"Failed to update cell in Table {table_idx}, Cell ({row}, {column}): {str(e)}")
+
+        # Zip the edited document.xml with the unchanged, already compressed parts
+        filled = time.perf_counter()
+        try:
+            doc_bytes = self._package(serialize_part_xml(root))
+        except Exception as e:
+            response["status"] = "error"
+            response["messages"].append(f"Failed to generate document bytes: {str(e)}")
+            return b"", response
+        response["timings"] = {"copy": copied - started, "fill": filled - copied, "save": time.perf_counter() - filled}
+
+        if not verbose:
+            return doc_bytes, response
+
+        # Add table and cell information to response
+        response["messages"].append("Generated modified Word document as byte stream")
+        response["messages"].append(f"Found {len(self.tables)} tables in the document.")
+        if self.slots:
+            edit_cells = [f"Table {table_idx}, Cell ({row}, {column}): {cell_text}" for cell_text, table_idx, row, column, _ in self.slots]
+            response["messages"].append(f"Editable cells: {', '.join(edit_cells)}")
+        else:
+            response["messages"].append("No cells with 'EDIT_' or 'EDIT' found.")
+        if updated_cells:
+            response["messages"].append(f"Updated cells: {', '.join(updated_cells)}")
+        else:
+            response["messages"].append("No cells updated.")
+        if diagnostics == "full":
+            response["messages"].append("Table details:")
+            for table_info in self.tables:
+                response["messages"].append(f"Table {table_info['table_index']}: {table_info['rows']} rows, {table_info['columns']} columns")
+                for cell_info in table_info["cells"]:
+                    response["messages"].append(f"  Cell ({cell_info['row']}, {cell_info['column']}): {cell_info['text']}")
+        return doc_bytes, response
+
+
+_templates: Dict[str, CounselingTemplate] = {}
+_templates_lock = threading.Lock()
+
+
+def inspect_template(path: str) -> Dict:
+    """Describe every table, cell and placeholder slot of the template at `path`."""
+    return load_template(path).inspect()
+
+
+def load_template(path: str) -> CounselingTemplate:
+    """
+    Return the compiled template for `path`, compiling it on first use and
+    again whenever the file's modification time changes.
+    """
+    mtime = os.path.getmtime(path)
+    template = _templates.get(path)
+    if template is not None and template.mtime == mtime:
+        return template
+    with _templates_lock:
+        template = _templates.get(path)
+        if template is None or template.mtime != mtime:
+            logger.debug("Compiling Word template: %s", path)
+            template = CounselingTemplate(path)
+            _templates[path] = template
+        return template
+
+
+def edit_word_tables(input_docx_path: str, json_data: str, diagnostics: str = None,
+                     template: CounselingTemplate = None) -> Tuple[bytes, Dict[str, Union[str, List]]]:
     """
     Finds tables in a Word document, identifies cells with 'EDIT_' or 'EDIT' markers, and updates them with JSON values,
     setting font to Times New Roman, 9pt. Returns the modified document as bytes.
@@ -23,9 +295,14 @@ def edit_word_tables(input_docx_path: str, json_data: str) -> Tuple[bytes, Dict[
                 "EDIT_Topics": "asdf",
                 ...
             }
+        diagnostics (str): "off", "summary" or "full" (see CounselingTemplate.render).
+            Defaults to DOC_DIAGNOSTICS, "off" unless set. Messages are printed unless "off".
+        template (CounselingTemplate): Already loaded template for input_docx_path to render
+            with, e.g. the one a cache key was computed from. Loaded here when omitted.
     
     Returns:
-        Tuple[bytes, Dict]: (Modified document as bytes, response metadata with status and messages).
+        Tuple[bytes, Dict]: (Modified document as bytes, response metadata with status and messages,
+        plus per-phase "timings" in seconds on success).
     """
     response = {"status": "success", "messages": []}
     
@@ -47,107 +324,28 @@ def edit_word_tables(input_docx_path: str, json_data: str) -> Tuple[bytes, Dict[
             response["messages"].append(f"Invalid JSON format: {str(e)} JSON: {json_data}")
             return b"", response
         
-        # Load the Word document
+        # Load the compiled template (parsed once, re-parsed only if the file changed)
+        started = time.perf_counter()
         try:
-            print(f"Reading Word document: {input_docx_path}")
-            doc = docx.Document(input_docx_path)
+            template = template or load_template(input_docx_path)
         except Exception as e:
             response["status"] = "error"
             response["messages"].append(f"Failed to read Word document: {str(e)}")
             return b"", response
+
+        diagnostics = diagnostics or os.getenv("DOC_DIAGNOSTICS", "off")
+        loaded = time.perf_counter() - started
+        doc_bytes, response = template.render(field_values, diagnostics)
+        if "timings" in response:
+            response["timings"] = {"load": loaded, **response["timings"]}
         
-        # Lists to track tables and cells
-        edit_cells = []  # Cells with "EDIT_" or "EDIT"
-        updated_cells = []  # Cells updated with JSON values
-        all_tables = []  # All table details
-        
-        # Iterate through all tables in the document
-        for table_idx, table in enumerate(doc.tables):
-            table_info = {
-                "table_index": table_idx,
-                "rows": len(table.rows),
-                "columns": len(table.columns),
-                "cells": []
-            }
-            print(f"\nTable {table_idx}: {table_info['rows']} rows, {table_info['columns']} columns")
-            
-            # Iterate through each cell in the table
-            for row_idx, row in enumerate(table.rows):
-                for cell_idx, cell in enumerate(row.cells):
-                    cell_text = cell.text.strip()
-                    cell_info = {
-                        "row": row_idx + 1,  # 1-based indexing to match provided output
-                        "column": cell_idx + 1,
-                        "text": cell_text
-                    }
-                    table_info["cells"].append(cell_info)
-                    
-                    # Check for "EDIT_" or "EDIT" marker (case-insensitive)
-                    if cell_text.lower().startswith("edit_") or cell_text.lower() == "edit":
-                        edit_cells.append(f"Table {table_idx}, Cell ({row_idx + 1}, {cell_idx + 1}): {cell_text}")
-                        print(f"  Found editable cell in Table {table_idx}, Cell ({row_idx + 1}, {cell_idx + 1}): {cell_text}")
-                        
-                        # Update cell if it matches a JSON key
-                        if cell_text in field_values:
-                            new_value = field_values[cell_text]
-                            if new_value is None:
-                                response["messages"].append(f"Skipped cell in Table {table_idx}, Cell ({row_idx + 1}, {cell_idx + 1}): null value provided for {cell_text}")
-                                continue
-                            try:
-                                new_value_str = str(new_value)
-                                # Clear existing content
-                                for paragraph in cell.paragraphs:
-                                    paragraph.clear()
-                                # Add new paragraph with font settings
-                                paragraph = cell.add_paragraph(new_value_str)
-                                for run in paragraph.runs:
-                                    run.font.name = "Times New Roman"
-                                    run.font.size = Pt(9)
-                                updated_cells.append(f"Table {table_idx}, Cell ({row_idx + 1}, {cell_idx + 1}): {new_value_str}")
-                                response["messages"].append(f"Updated cell in Table {table_idx}, Cell ({row_idx + 1}, {cell_idx + 1}) with value: {new_value_str} (font: Times New Roman, 9pt)")
-                            except Exception as e:
-                                response["messages"].append(f"Failed to update cell in Table {table_idx}, Cell ({row_idx + 1}, {cell_idx + 1}): {str(e)}")
-                    else:
-                        print(f"  Cell ({row_idx + 1}, {cell_idx + 1}): {cell_text}")
-            
-            all_tables.append(table_info)
-        
-        # Save the modified document to a BytesIO stream
-        output_stream = BytesIO()
-        try:
-            doc.save(output_stream)
-            doc_bytes = output_stream.getvalue()
-            output_stream.close()
-            response["messages"].append("Generated modified Word document as byte stream")
-        except Exception as e:
-            response["status"] = "error"
-            response["messages"].append(f"Failed to generate document bytes: {str(e)}")
-            return b"", response
-        
-        # Add table and cell information to response
-        response["messages"].append(f"Found {len(doc.tables)} tables in the document.")
-        if edit_cells:
-            response["messages"].append(f"Editable cells: {', '.join(edit_cells)}")
-        else:
-            response["messages"].append("No cells with 'EDIT_' or 'EDIT' found.")
-        if updated_cells:
-            response["messages"].append(f"Updated cells: {', '.join(updated_cells)}")
-        else:
-            response["messages"].append("No cells updated.")
-        response["messages"].append("Table details:")
-        for table_info in all_tables:
-            response["messages"].append(f"Table {table_info['table_index']}: {table_info['rows']} rows, {table_info['columns']} columns")
-            for cell_info in table_info["cells"]:
-                response["messages"].append(f"  Cell ({cell_info['row']}, {cell_info['column']}): {cell_info['text']}")
-        
-        print("\nResponse messages:")
-        for msg in response["messages"]:
-            print(msg)
+        if diagnostics != "off":
+            logger.debug("Response messages: %s", response["messages"])
         
         return doc_bytes, response
     
     except Exception as e:
         response["status"] = "error"
         response["messages"].append(f"Unexpected error: {str(e)}")
-        print("Error:", response["messages"])
+        logger.error("Rendering failed: %s", response["messages"])
         return b"", response
\ No newline at end of file
@@ -0,0 +1,78 @@
+import json
+import time
+
+from flask import Response, g, has_app_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional; the standard library encoder is used instead
+    orjson = None
+
+ENCODER = 'orjson' if orjson else 'json'
+
+
+def _default(value):
+    # Tuple subclasses such as RosterRow, which orjson doesn't serialize itself
+    if isinstance(value, tuple):
+        return tuple(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    """Encode `value` as compact UTF-8 JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _record(started):
+    """Add the time since `started` to this request's JSON encode time (see ResponseCompressor)."""
+    if has_app_context():
+        g.json_encode_ms = g.get('json_encode_ms', 0.0) + (time.perf_counter() - started) * 1000
+
+
+def response(value, mimetype='application/json') -> Response:
+    """Build a JSON response with dumps(), recording the encode time."""
+    started = time.perf_counter()
+    body = dumps(value)
+    _record(started)
+    return Response(body, mimetype=mimetype)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that encodes jsonify() output with orjson when it is
+    installed. Output matches the default provider's: sorted keys, and dates,
+    dataclasses and other extra types go through Flask's own `default`.
+    Falls back to the default provider when orjson is missing or the output is
+    meant to be indented (debug mode).
+    """
+
+    def _orjson_dumps(self, obj) -> bytes:
+        flask_default = self.default
+
+        def default(value):
+            if isinstance(value, tuple):
+                return tuple(value)
+            return flask_default(value)
+
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        started = time.perf_counter()
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            result = super().response(*args, **kwargs)
+        else:
+            obj = self._prepare_response_obj(args, kwargs)
+            result = self._app.response_class(self._orjson_dumps(obj) + b"\n", mimetype=self.mimetype)
+        _record(started)
+        return result
@@ -0,0 +1,354 @@
+import json
+import os
+import queue
+import secrets
+import tempfile
+import threading
+import time
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at its depth limit."""
+
+
+class JobFailed(Exception):
+    """Raised by a job function to fail with structured `details` (e.g. render messages)."""
+
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details
+
+
+def _alive(pid):
+    """Whether the process that accepted a job is still running (on this host)."""
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        # Only one process serves there (waitress), so another pid is an earlier run.
+        # os.kill(pid, 0) would send it a Ctrl-C rather than test it.
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Job:
+    QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+    def __init__(self, row):
+        self.id = row['ID']
+        self.kind = row['KIND']
+        self.status = row['STATUS']
+        self.pid = row['PID']
+        self.created = row['CREATED']
+        self.started = row['STARTED']
+        self.finished = row['FINISHED']
+        self.expires = row['EXPIRES']  # wall-clock deadline, set once finished
+        self.queue_ms = row['QUEUE_MS']
+        self.run_ms = row['RUN_MS']
+        self.error = row['ERROR']
+        self.details = json.loads(row['DETAILS']) if row['DETAILS'] else None
+
+    @property
+    def finished_running(self):
+        return self.status in (Job.DONE, Job.FAILED)
+
+    def describe(self):
+        """Status document for clients polling the job."""
+        info = {
+            "job": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "queue_ms": self.queue_ms,
+            "run_ms": self.run_ms,
+        }
+        if self.status == Job.QUEUED:
+            info["queue_ms"] = round((time.time() - self.created) * 1000, 3)
+        if self.expires is not None:
+            info["expires_in"] = max(0, round(self.expires - time.time(), 1))
+        if self.error is not None:
+            info["error"] = self.error
+            if self.details is not None:
+                info["details"] = self.details
+        return info
+
+
+class JobQueue:
+    """
+    Background jobs with ids the client polls.
+
+    submit() queues fn(*args), a function returning bytes, and returns a Job at
+    once; `workers` threads of the submitting process run its queued jobs in
+    order. Job state is a row in the `jobs` table of a SharedState and each
+    result is a file in `directory`, so any worker process can report on a job,
+    wait for it, serve its result or cancel it.
+
+    At most `max_queued` jobs (across all processes) wait at a time and submit()
+    raises QueueFull beyond that, so a burst is turned away instead of piling
+    up. Finished jobs keep their result for `ttl` seconds, and at most
+    `max_retained` of them are kept, oldest dropped first. Jobs whose process
+    exited before finishing them are marked failed.
+
+    Worker threads start on the first submit and again after a fork, so the
+    queue can be built before serve.py forks its workers.
+    """
+
+    def __init__(self, state, directory, workers=2, max_queued=100, ttl=600.0, max_retained=1000,
+                 poll_interval=0.1):
+        self.state = state
+        self.directory = directory
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.max_retained = max_retained
+        self.poll_interval = poll_interval
+        self._queue = queue.Queue()
+        self._events = {}  # id -> Event set when a job of this process finishes
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0, "expired": 0}
+        os.makedirs(directory, exist_ok=True)
+        state.create('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                ID TEXT PRIMARY KEY,
+                KIND TEXT NOT NULL,
+                STATUS TEXT NOT NULL,
+                PID INTEGER NOT NULL,
+                CREATED REAL NOT NULL,
+                STARTED REAL,
+                FINISHED REAL,
+                EXPIRES REAL,
+                QUEUE_MS REAL,
+                RUN_MS REAL,
+                ERROR TEXT,
+                DETAILS TEXT
+            )
+        ''', '''
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (STATUS)
+        ''')
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, job_id + ".result")
+
+    def _ensure_started(self):
+        # Caller holds _lock
+        if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+            return
+        self._pid = os.getpid()
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def after_fork(self):
+        """Start over in a forked worker process; queued work and threads belong to the parent."""
+        self._queue = queue.Queue()
+        self._events = {}
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args):
+        """Queue fn(*args) and return its Job. Raises QueueFull when max_queued jobs are waiting."""
+        self.expire()
+        job_id = secrets.token_urlsafe(16)
+        # One statement, so the depth check and the insert can't interleave with another worker's
+        inserted = self.state.execute('''
+            INSERT INTO jobs (ID, KIND, STATUS, PID, CREATED)
+            SELECT ?, ?, ?, ?, ?
+            WHERE (SELECT COUNT(*) FROM jobs WHERE STATUS = ?) < ?
+        ''', (job_id, kind, Job.QUEUED, os.getpid(), time.time(), Job.QUEUED, self.max_queued)).rowcount
+        with self._lock:
+            if not inserted:
+                self._stats["rejected"] += 1
+                raise QueueFull(f"{self.max_queued} jobs are already queued; try again shortly")
+            self._stats["submitted"] += 1
+            self._events[job_id] = threading.Event()
+            self._ensure_started()
+        self._queue.put((job_id, fn, args))
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """The Job with this id, or None if unknown or expired."""
+        self.expire()
+        row = self.state.execute('''
+            SELECT * FROM jobs
+            WHERE ID = ?
+        ''', (job_id,)).fetchone()
+        return Job(row) if row else None
+
+    def wait(self, job_id, timeout):
+        """Like get(), but first wait up to `timeout` seconds for the job to finish."""
+        job = self.get(job_id)
+        if job is None or job.finished_running or timeout <= 0:
+            return job
+        event = self._events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+            return self.get(job_id)
+        # Another process runs it; poll its row
+        deadline = time.monotonic() + timeout
+        while job is not None and not job.finished_running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(self.poll_interval, remaining))
+            job = self.get(job_id)
+        return job
+
+    def result(self, job):
+        """The bytes a finished job returned, or None if they are gone."""
+        try:
+            with open(self._path(job.id), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def cancel(self, job_id):
+        """Forget a job. A queued job never runs; a running one finishes but its result is dropped.
+           Returns False if the job was unknown."""
+        row = self.state.execute('''
+            SELECT STATUS FROM jobs
+            WHERE ID = ?
+        ''', (job_id,)).fetchone()
+        if row is None:
+            return False
+        if not self.state.execute('''
+            DELETE FROM jobs
+            WHERE ID = ?
+        ''', (job_id,)).rowcount:
+            return False
+        self._remove(job_id)
+        if row['STATUS'] == Job.QUEUED:
+            with self._lock:
+                self._stats["cancelled"] += 1
+        return True
+
+    def _remove(self, job_id):
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def expire(self):
+        """Drop finished jobs past their TTL and the oldest beyond max_retained, and fail
+           jobs whose process exited before finishing them."""
+        now = time.time()
+        stale = [row['ID'] for row in self.state.execute('''
+            SELECT ID FROM jobs
+            WHERE EXPIRES <= ?
+        ''', (now,))]
+        stale += [row['ID'] for row in self.state.execute('''
+            SELECT ID FROM jobs
+            WHERE EXPIRES > ?
+            ORDER BY FINISHED DESC
+            LIMIT -1 OFFSET ?
+        ''', (now, self.max_retained))]
+        expired = 0
+        for job_id in stale:
+            if self.state.execute('''
+                DELETE FROM jobs
+                WHERE ID = ?
+            ''', (job_id,)).rowcount:
+                self._remove(job_id)
+                expired += 1
+        pids = [row['PID'] for row in self.state.execute('''
+            SELECT DISTINCT PID FROM jobs
+            WHERE STATUS IN (?, ?)
+        ''', (Job.QUEUED, Job.RUNNING))]
+        for pid in pids:
+            if not _alive(pid):
+                self.state.execute('''
+                    UPDATE jobs
+                    SET STATUS = ?, ERROR = ?, FINISHED = ?, EXPIRES = ?
+                    WHERE PID = ? AND STATUS IN (?, ?)
+                ''', (Job.FAILED, "The worker process running this job exited", now, now + self.ttl,
+                      pid, Job.QUEUED, Job.RUNNING))
+        with self._lock:
+            self._stats["expired"] += expired
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job_id, fn, args = item
+            started = time.time()
+            # Claim it; a job cancelled while queued has no row left to claim
+            claimed = self.state.execute('''
+                UPDATE jobs
+                SET STATUS = ?, STARTED = ?, QUEUE_MS = ROUND((? - CREATED) * 1000, 3)
+                WHERE ID = ? AND STATUS = ?
+            ''', (Job.RUNNING, started, started, job_id, Job.QUEUED)).rowcount
+            if not claimed:
+                self._finish(job_id)
+                continue
+            timer = time.perf_counter()
+            error = details = None
+            try:
+                self._store(job_id, fn(*args))
+                status = Job.DONE
+            except Exception as e:
+                error = str(e)
+                details = getattr(e, 'details', None)
+                status = Job.FAILED
+            run_ms = round((time.perf_counter() - timer) * 1000, 3)
+            finished = time.time()
+            recorded = self.state.execute('''
+                UPDATE jobs
+                SET STATUS = ?, FINISHED = ?, EXPIRES = ?, RUN_MS = ?, ERROR = ?, DETAILS = ?
+                WHERE ID = ? AND STATUS = ?
+            ''', (status, finished, finished + self.ttl, run_ms, error,
+                  json.dumps(details) if details is not None else None, job_id, Job.RUNNING)).rowcount
+            if not recorded:
+                # Cancelled while it ran
+                self._remove(job_id)
+            with self._lock:
+                self._stats["completed" if status == Job.DONE else "failed"] += 1
+            self._finish(job_id)
+
+    def _store(self, job_id, data):
+        # Write under a temporary name so other processes never read a partial result
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp, self._path(job_id))
+
+    def _finish(self, job_id):
+        with self._lock:
+            event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def shutdown(self, timeout=None):
+        """Let the workers finish the jobs already queued, then stop them."""
+        with self._lock:
+            threads = [thread for thread in self._threads if thread.is_alive()] if self._pid == os.getpid() else []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def stats(self):
+        """This process's counters, with job counts by state across all processes."""
+        with self._lock:
+            stats = dict(self._stats)
+        counts = dict(self.state.execute('''
+            SELECT STATUS, COUNT(*) FROM jobs
+            GROUP BY STATUS
+        ''').fetchall())
+        stats["queued"] = counts.get(Job.QUEUED, 0)
+        stats["running"] = counts.get(Job.RUNNING, 0)
+        stats["retained"] = counts.get(Job.DONE, 0) + counts.get(Job.FAILED, 0)
+        stats["workers"] = self.workers
+        stats["max_queued"] = self.max_queued
+        return stats
@@ -0,0 +1,125 @@
+import math
+import threading
+from bisect import bisect_left
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds; request and render latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Seconds; single SQL statements are mostly well under a millisecond
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+# Label value used once a metric has max_series label combinations
+OVERFLOW = "other"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """
+    Prometheus histogram with labels. At most `max_series` label combinations are
+    kept; observations for new ones beyond that are counted under OVERFLOW so
+    free-form labels (ad-hoc SQL) can't grow it without bound.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, max_series=500):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.max_series = max_series
+        self._series = {}  # label values -> [count per bucket..., count above the last, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                if len(self._series) >= self.max_series:
+                    key = (OVERFLOW,) * len(self.labelnames)
+                    series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                le = _labels(self.labelnames, key, f'le="{_number(float(bound))}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += values[len(self.buckets)]
+            le = _labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(values[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Value read when metrics are rendered. fn() returns a number, or with labelnames
+    a list of (label values, number).
+    """
+
+    def __init__(self, name, help, fn, labelnames=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        values = self.fn()
+        if not self.labelnames:
+            values = [((), values)]
+        for key, value in values:
+            if value is not None:
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    """The metrics of one process, rendered together for /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, max_series=500):
+        metric = Histogram(name, help, labelnames, buckets, max_series)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, fn, labelnames=(), kind="gauge"):
+        metric = Gauge(name, help, fn, labelnames, kind)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,162 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class RenderCache:
+    """
+    Rendered documents keyed by content address (see CounselingTemplate.cache_key).
+
+    The memory tier is an LRU bounded by the total size of the cached documents.
+    With a `directory`, documents are also written there, one file per key, and
+    memory misses fall back to it; that tier is shared by every process using
+    the directory and is pruned oldest-used first once it passes `disk_max_bytes`.
+    Keys include the template digest, so entries rendered from an older template
+    are never hit again and simply age out.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, directory: Optional[str] = None,
+                 disk_max_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()  # key -> bytes, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None  # measured on first use
+        self._stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0,
+                       "evictions": 0, "disk_evictions": 0, "disk_errors": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".docx")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """The cached document for `key`, or None."""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["memory_hits"] += 1
+                return data
+        data = self._read(key) if self.directory else None
+        with self._lock:
+            if data is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Cache a rendered document."""
+        with self._lock:
+            self._stats["stores"] += 1
+            self._remember(key, data)
+        if self.directory:
+            self._write(key, data)
+
+    def _remember(self, key, data):
+        """Add to the memory tier and evict down to max_bytes. Caller holds _lock."""
+        if len(data) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._entries[key] = data
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self._stats["evictions"] += 1
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used for pruning
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError:
+            with self._lock:
+                self._stats["disk_errors"] += 1
+            return None
+
+    def _write(self, key, data):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write under a temporary name so readers never see a partial file
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp, path)
+        except OSError:
+            with self._lock:
+                self._stats["disk_errors"] += 1
+            return
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, _, size in self._disk_files())
+            else:
+                self._disk_bytes += len(data)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._prune()
+
+    def _disk_files(self):
+        """(last used, path, size) of every cached file."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(".docx"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        return files
+
+    def _prune(self):
+        """Delete least recently used files until the disk tier is back to 90% of its limit. Caller holds _disk_lock."""
+        files = sorted(self._disk_files())
+        total = sum(size for _, _, size in files)
+        target = self.disk_max_bytes * 0.9
+        for _, path, size in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self._stats["disk_evictions"] += 1
+        self._disk_bytes = total
+
+    def clear(self):
+        """Empty the memory tier (the disk tier is left alone)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        if self.directory:
+            stats["disk_bytes"] = self._disk_bytes
+        return stats
@@ -0,0 +1,125 @@
+import codecs
+import csv
+import re
+import time
+from typing import Dict, Iterator, List, Tuple
+
+REQUIRED_FIELDS = ['rank', 'firstName', 'lastName', 'edipi', 'dor', 'pmos', 'bilmos']
+EDIPI_PATTERN = re.compile(r'^[0-9]{10}$')
+MOS_PATTERN = re.compile(r'^[0-9]{4}$')
+DOR_PATTERN = re.compile(r'^[0-9]+$')
+
+# Cap on rejection details returned to the client; the count is always exact
+MAX_REJECTION_DETAILS = 1000
+
+
+def iter_lines(stream, encoding: str = 'utf-8-sig', chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """
+    Decode a binary stream incrementally and yield lines with their endings,
+    so the upload never has to be held in memory as one string.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        final = not chunk
+        pending += decoder.decode(chunk, final=final)
+        # Only hand complete lines to csv; keep the partial tail for the next chunk
+        cut = len(pending) if final else pending.rfind('\n') + 1
+        start = 0
+        while start < cut:
+            end = pending.find('\n', start, cut)
+            end = cut if end < 0 else end + 1
+            yield pending[start:end]
+            start = end
+        pending = pending[cut:]
+        if final:
+            return
+
+
+def validate_row(row: Dict[str, str]) -> Tuple[tuple, List[str]]:
+    """Check one CSV row. Returns (roster tuple, list of problems)."""
+    values = {key: (row.get(key) or '').strip() for key in REQUIRED_FIELDS + ['mi', 'billet']}
+    errors = [f"missing {field}" for field in REQUIRED_FIELDS if not values[field]]
+    if values['edipi'] and not EDIPI_PATTERN.match(values['edipi']):
+        errors.append("edipi must be 10 digits")
+    if values['pmos'] and not MOS_PATTERN.match(values['pmos']):
+        errors.append("pmos must be 4 digits")
+    if values['bilmos'] and not MOS_PATTERN.match(values['bilmos']):
+        errors.append("bilmos must be 4 digits")
+    if values['dor'] and not DOR_PATTERN.match(values['dor']):
+        errors.append("dor must be numeric (YYYYMMDD)")
+    record = (
+        values['rank'],
+        values['firstName'],
+        values['lastName'],
+        values['mi'],
+        values['edipi'],
+        int(values['dor']) if DOR_PATTERN.match(values['dor']) else values['dor'],
+        values['pmos'],
+        values['bilmos'],
+        values['billet'],
+    )
+    return record, errors
+
+
+def import_roster_csv(db, stream, batch_size: int = 1000) -> Dict:
+    """
+    Stream a roster CSV into the database.
+
+    Rows are decoded and validated as they are read and written in chunks of
+    `batch_size`, each chunk as one upsert transaction. Invalid rows are
+    reported instead of aborting the import.
+
+    Returns:
+        {
+            "imported": 1998,
+            "rejected_count": 2,
+            "rejected": [{"line": 14, "edipi": "123", "errors": ["edipi must be 10 digits"]}, ...],
+            "stats": {"rows": 2000, "batches": 2, "seconds": 0.41, "rows_per_second": 4878.0}
+        }
+    """
+    started = time.perf_counter()
+    report = {"imported": 0, "rejected_count": 0, "rejected": []}
+    batches = 0
+    rows_read = 0
+
+    def reject(line, edipi, errors):
+        report["rejected_count"] += 1
+        if len(report["rejected"]) < MAX_REJECTION_DETAILS:
+            report["rejected"].append({"line": line, "edipi": edipi, "errors": errors})
+
+    def flush(batch):
+        nonlocal batches
+        if not batch:
+            return
+        batches += 1
+        failed = db.upsert_users([record for _, record in batch])
+        report["imported"] += len(batch) - len(failed)
+        for index, message in failed:
+            line, record = batch[index]
+            reject(line, record[4], [message])
+
+    reader = csv.DictReader(iter_lines(stream))
+    batch = []
+    for row in reader:
+        rows_read += 1
+        record, errors = validate_row(row)
+        if errors:
+            # reader.line_num is the physical line the row ended on (header is line 1)
+            reject(reader.line_num, record[4], errors)
+            continue
+        batch.append((reader.line_num, record))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    flush(batch)
+
+    seconds = time.perf_counter() - started
+    report["stats"] = {
+        "rows": rows_read,
+        "batches": batches,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(rows_read / seconds, 1) if seconds > 0 else None,
+    }
+    return report
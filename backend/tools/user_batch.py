@@ -0,0 +1,56 @@
+from typing import Dict, List, Tuple
+
+# Request field -> roster column, as used by POST/PUT /users
+FIELD_COLUMNS = {
+    'rank': 'RANK',
+    'firstName': 'FIRSTNAME',
+    'lastName': 'LASTNAME',
+    'mi': 'MI',
+    'dor': 'DOR',
+    'pmos': 'PMOS',
+    'bilmos': 'BILMOS',
+    'billet': 'BILLET',
+}
+INSERT_REQUIRED = ['rank', 'firstName', 'lastName', 'dor', 'pmos', 'bilmos']
+OPERATIONS = ('insert', 'update', 'delete')
+
+
+def parse_operations(payload) -> Tuple[List[Tuple[int, str, str, Dict]], List[Dict]]:
+    """
+    Turn the JSON operations of POST /users/batch into (index, op, edipi, {COLUMN: value})
+    tuples for Database.batch_users(). Returns (operations, errors), with one
+    {"index", "edipi", "error"} per malformed entry.
+
+        {"op": "insert", "edipi": "...", "rank": ..., "firstName": ..., ...}
+        {"op": "update", "edipi": "...", "rank": "CPL"}      only the given fields change
+        {"op": "delete", "edipi": "..."}
+    """
+    operations = []
+    errors = []
+    for index, entry in enumerate(payload):
+        if not isinstance(entry, dict):
+            errors.append({"index": index, "edipi": None, "error": "operation must be an object"})
+            continue
+        op = entry.get('op')
+        edipi = entry.get('edipi')
+        fields = {key: value for key, value in entry.items() if key not in ('op', 'edipi')}
+        problem = None
+        if op not in OPERATIONS:
+            problem = f"op must be one of {', '.join(OPERATIONS)}"
+        elif edipi in (None, ''):
+            problem = "missing edipi"
+        elif set(fields) - set(FIELD_COLUMNS):
+            problem = f"unknown fields: {', '.join(sorted(set(fields) - set(FIELD_COLUMNS)))}"
+        elif op == 'insert' and [field for field in INSERT_REQUIRED if field not in fields]:
+            problem = "missing " + ', '.join(field for field in INSERT_REQUIRED if field not in fields)
+        elif op == 'update' and not fields:
+            problem = "update needs at least one field to change"
+        elif op == 'delete' and fields:
+            problem = "delete takes only edipi"
+        if problem:
+            errors.append({"index": index, "edipi": edipi, "error": problem})
+            continue
+        if op == 'insert':
+            fields = {'mi': '', 'billet': '', **fields}
+        operations.append((index, op, str(edipi), {FIELD_COLUMNS[key]: value for key, value in fields.items()}))
+    return operations, errors